@@ -0,0 +1,108 @@
+"""Sync Flask app against the ASGI app at high concurrency.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.async_vs_sync --concurrency 256
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.asgi import asgi_request, create_async_app
+from module_29_testing.hw.main.models import db
+
+from .endpoints import TestClientDriver, run
+from .seed import seed
+from .stats import summarize
+
+
+def workload(args, rnd):
+    visits = [(client_id, rnd.randint(1, args.parkings))
+              for client_id in rnd.sample(range(1, args.clients + 1),
+                                          args.requests)]
+    yield 'GET /clients/<id>', [
+        ('GET', f'/clients/{rnd.randint(1, args.clients)}', None)
+        for _ in range(args.requests)]
+    yield 'POST /client_parkings', [
+        ('POST', '/client_parkings', {'client_id': client_id,
+                                      'parking_id': parking_id})
+        for client_id, parking_id in visits]
+    yield 'DELETE /client_parkings', [
+        ('DELETE', '/client_parkings', {'client_id': client_id,
+                                        'parking_id': parking_id})
+        for client_id, parking_id in visits]
+
+
+async def run_async(app, requests, concurrency):
+    latencies = []
+    failures = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(method, path, body):
+        async with semaphore:
+            started = time.perf_counter()
+            status, _, _ = await asgi_request(app, method, path, body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status >= 400:
+                failures.append(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(*request) for request in requests))
+    return latencies, time.perf_counter() - started, failures
+
+
+def report(flavour, scenario, latencies, elapsed, failures):
+    summary = summarize(latencies, elapsed, 0)
+    print(f'{flavour:<6} {scenario:<26} {summary["p50_ms"]:>8.2f} '
+          f'{summary["p99_ms"]:>8.2f} {summary["rps"]:>8.0f} '
+          f'{len(failures):>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=20_000)
+    parser.add_argument('--parkings', type=int, default=50)
+    parser.add_argument('--log-rows', type=int, default=100_000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=128)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        sync_app = create_app({'SQLALCHEMY_DATABASE_URI': uri,
+                               'SCHEMA_CHECK': False,
+                               'SQLALCHEMY_ENGINE_OPTIONS': {
+                                   'connect_args': {
+                                       'timeout': 60,
+                                       'check_same_thread': False}}})
+        with sync_app.app_context():
+            db.create_all()
+            seed(args.clients, args.parkings, args.log_rows,
+                 places=args.clients)
+            db.session.remove()
+        async_app = create_async_app({'SQLALCHEMY_DATABASE_URI': uri,
+                                      'SQLALCHEMY_ENGINE_OPTIONS': {
+                                          'connect_args': {'timeout': 60}}})
+
+        print(f'{"app":<6} {"scenario":<26} {"p50 ms":>8} {"p99 ms":>8} '
+              f'{"req/s":>8} {"errors":>7}')
+        driver = TestClientDriver(sync_app)
+        for scenario, requests in workload(args, random.Random('sync')):
+            report('sync', scenario, *run(driver, requests, args.concurrency))
+
+        # One event loop for the whole run, pooled aiosqlite connections
+        # are bound to the loop they were opened on
+        async def run_all():
+            for scenario, requests in workload(args, random.Random('async')):
+                report('async', scenario, *await run_async(
+                    async_app, requests, args.concurrency))
+            await async_app.engine.dispose()
+
+        asyncio.run(run_all())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Billing outbox drain throughput against a slow payment gateway.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.billing --jobs 2000 --latency 0.05
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from module_29_testing.hw.main import billing
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, BillingJob, Client
+
+
+def seed(jobs):
+    now = datetime.datetime.now()
+    db.session.query(BillingJob).delete()
+    if not db.session.query(Client).count():
+        db.session.add(Client(name='name', surname='surname',
+                              credit_card='1234', car_number='A123AA'))
+        db.session.flush()
+    db.session.execute(BillingJob.__table__.insert(),
+                       [{'client_parking_id': i, 'client_id': 1,
+                         'time_in': now, 'time_out': now, 'status': 'pending',
+                         'attempts': 0, 'next_attempt_at': now}
+                        for i in range(jobs)])
+    db.session.commit()
+
+
+def drain(app, gateway, workers):
+    pool = billing.BillingWorkerPool(app, gateway, workers)
+    started = time.perf_counter()
+    pool.start()
+    try:
+        while db.session.query(BillingJob)\
+                .filter(BillingJob.status != 'paid').count():
+            db.session.rollback()
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--failure-rate', type=float, default=0.1)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 4, 16, 32])
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f'{"workers":>8} {"elapsed s":>10} {"jobs/s":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI':
+                f'sqlite:///{os.path.join(tmp, "bench.db")}',
+            'BILLING_BATCH_SIZE': args.batch_size,
+            'BILLING_POLL_INTERVAL': 0.01,
+            'BILLING_BACKOFF_SECONDS': 0.01,
+            'BILLING_MAX_ATTEMPTS': 100,
+            'SCHEMA_CHECK': False})
+        with app.app_context():
+            db.create_all()
+            for workers in args.workers:
+                seed(args.jobs)
+                gateway = billing.FakePaymentGateway(
+                    latency=args.latency, failure_rate=args.failure_rate)
+                elapsed = drain(app, gateway, workers)
+                print(f'{workers:>8} {elapsed:>10.2f} '
+                      f'{args.jobs / elapsed:>10.1f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Latency, throughput and SQL query counts for every endpoint.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.endpoints --save-baseline base.json
+    python -m module_29_testing.hw.bench.endpoints --compare base.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db
+
+from .seed import seed
+from .stats import QueryCounter, summarize
+
+
+class TestClientDriver:
+    name = 'testclient'
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        response = self._local.client.open(path, method=method, json=body)
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class HTTPDriver:
+    name = 'http'
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=_QuietRequestHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def request(self, method, path, body):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            headers = {'Content-Type': 'application/json'} if payload else {}
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def scenarios(args, rnd):
+    visits = [(client_id, rnd.randint(1, args.parkings))
+              for client_id in rnd.sample(range(1, args.clients + 1),
+                                          min(args.requests, args.clients))]
+    yield 'GET /clients', [('GET', '/clients', None)] * args.full_list_requests
+    yield 'GET /clients?limit=100', [
+        ('GET', f'/clients?after_id={rnd.randint(0, args.clients)}&limit=100',
+         None) for _ in range(args.requests)]
+    yield 'GET /clients/<id>', [
+        ('GET', f'/clients/{rnd.randint(1, args.clients)}', None)
+        for _ in range(args.requests)]
+    yield 'POST /parkings', [
+        ('POST', '/parkings', {'address': f'bench address {rnd.random()}',
+                               'count_places': 100})
+        for _ in range(args.requests)]
+    yield 'POST /client_parkings', [
+        ('POST', '/client_parkings', {'client_id': client_id,
+                                      'parking_id': parking_id})
+        for client_id, parking_id in visits]
+    yield 'DELETE /client_parkings', [
+        ('DELETE', '/client_parkings', {'client_id': client_id,
+                                        'parking_id': parking_id})
+        for client_id, parking_id in visits]
+
+
+def run(driver, requests, concurrency):
+    latencies = []
+    failures = []
+    pending = iter(requests)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            started = time.perf_counter()
+            status = driver.request(*item)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    failures.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started, failures
+
+
+def compare(results, baseline):
+    print(f'\n{"scenario":<40} {"p50":>9} {"p99":>9} {"rps":>9}')
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        deltas = [(current[m] - previous[m]) / previous[m] * 100
+                  if previous[m] else 0.0
+                  for m in ('p50_ms', 'p99_ms', 'rps')]
+        print(f'{key:<40} ' + ' '.join(f'{d:>+8.1f}%' for d in deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100_000)
+    parser.add_argument('--parkings', type=int, default=100)
+    parser.add_argument('--log-rows', type=int, default=1_000_000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--full-list-requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--driver', choices=['testclient', 'http', 'both'],
+                        default='both')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    args = parser.parse_args()
+
+    drivers = [TestClientDriver, HTTPDriver] if args.driver == 'both' \
+        else [TestClientDriver if args.driver == 'testclient' else HTTPDriver]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SCHEMA_CHECK': False})
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        # create_app already tuned the engine options, keep its pragmas
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']\
+            .setdefault('connect_args', {})\
+            .update(timeout=30, check_same_thread=False)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed(args.clients, args.parkings, args.log_rows,
+                 places=args.clients)
+            print(f'seeded {args.clients} clients, {args.parkings} parkings, '
+                  f'{args.log_rows} log rows in '
+                  f'{time.perf_counter() - started:.1f}s')
+            db.session.remove()
+            engine = db.get_engine()
+
+        print(f'\n{"driver":<10} {"scenario":<28} {"p50 ms":>8} {"p99 ms":>8} '
+              f'{"req/s":>8} {"queries":>8} {"errors":>7}')
+        for driver_class in drivers:
+            driver = driver_class(app)
+            rnd = random.Random(driver.name)
+            for scenario, requests in scenarios(args, rnd):
+                if not requests:
+                    continue
+                with QueryCounter(engine) as counter:
+                    latencies, elapsed, failures = run(driver, requests,
+                                                       args.concurrency)
+                summary = summarize(latencies, elapsed, counter.count)
+                results[f'{driver.name} {scenario}'] = summary
+                print(f'{driver.name:<10} {scenario:<28} '
+                      f'{summary["p50_ms"]:>8.2f} {summary["p99_ms"]:>8.2f} '
+                      f'{summary["rps"]:>8.0f} '
+                      f'{summary["queries_per_request"]:>8.2f} '
+                      f'{len(failures):>7}')
+            driver.close()
+        engine.dispose()
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+        print(f'\nbaseline saved to {args.save_baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Conditional GETs of clients: full responses against 304s.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.etags --clients 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client
+
+from .stats import QueryCounter, percentile
+
+
+def seed(clients):
+    db.session.execute(Client.__table__.insert(),
+                       [{'name': f'name {i}', 'surname': 'surname',
+                         'credit_card': '1234', 'car_number': f'A{i:05}'}
+                        for i in range(clients)])
+    db.session.commit()
+
+
+def measure(client, paths, etags=None):
+    latencies = []
+    for path in paths:
+        headers = {'If-None-Match': etags[path]} if etags else {}
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if etags is None:
+            assert response.status_code == 200
+        else:
+            assert response.status_code == 304
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10_000)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    paths = [f'/clients/{rnd.randint(1, args.clients)}'
+             for _ in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                          'ETAG_VERSION_TTL': 3600,
+                          'SCHEMA_CHECK': False})
+        with app.app_context():
+            db.create_all()
+            seed(args.clients)
+            client = app.test_client()
+            etags = {path: client.get(path).headers['ETag']
+                     for path in set(paths)}
+
+            print(f'{"request":<24} {"p50 ms":>8} {"p99 ms":>8} '
+                  f'{"queries/req":>12}')
+            for label, known in (('GET', None), ('GET If-None-Match', etags)):
+                with QueryCounter(db.engine) as counter:
+                    latencies = measure(client, paths, known)
+                print(f'{label:<24} {statistics.median(latencies):>8.3f} '
+                      f'{percentile(latencies, 99):>8.3f} '
+                      f'{counter.count / len(paths):>12.2f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Peak memory of exporting the parking log, streamed against loaded.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.export --sessions 1000000
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import tracemalloc
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client, Parking, \
+    ClientParkingHistory
+
+INSERT_CHUNK = 50_000
+
+
+def seed(sessions, clients=1000, parkings=10):
+    db.session.execute(Client.__table__.insert(),
+                       [{'name': f'name {i}', 'surname': 'surname',
+                         'credit_card': '1234', 'car_number': f'A{i:05}'}
+                        for i in range(clients)])
+    db.session.execute(Parking.__table__.insert(),
+                       [{'address': f'address {i}', 'opened': True,
+                         'count_places': 100, 'count_available_places': 100}
+                        for i in range(parkings)])
+    start = datetime.datetime(2024, 1, 1)
+    for offset in range(0, sessions, INSERT_CHUNK):
+        db.session.execute(ClientParkingHistory.__table__.insert(), [
+            {'id': i + 1, 'client_id': i % clients + 1,
+             'parking_id': i % parkings + 1,
+             'time_in': start + datetime.timedelta(minutes=i),
+             'time_out': start + datetime.timedelta(minutes=i + 30)}
+            for i in range(offset, min(offset + INSERT_CHUNK, sessions))])
+        db.session.commit()
+
+
+def loaded(app):
+    # What an export built on query().all() and to_json costs
+    with app.app_context():
+        rows = [log.to_json() for log in
+                db.session.query(ClientParkingHistory).all()]
+        return len(rows)
+
+
+def streamed(client, fmt):
+    response = client.get(f'/client_parkings/export?format={fmt}',
+                          buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return size
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                          'SCHEMA_CHECK': False})
+        with app.app_context():
+            db.create_all()
+            seed(args.sessions)
+            db.session.remove()
+
+        client = app.test_client()
+        print(f'{args.sessions} sessions')
+        print(f'{"export":<22} {"seconds":>8} {"peak MiB":>9}')
+        rows = [('query().all() + to_json', loaded, app),
+                ('streamed csv', streamed, client, 'csv'),
+                ('streamed parquet', streamed, client, 'parquet')]
+        for label, func, *func_args in rows:
+            elapsed, peak = measure(func, *func_args)
+            print(f'{label:<22} {elapsed:>8.1f} {peak:>9.1f}')
+        with app.app_context():
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
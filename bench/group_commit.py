@@ -0,0 +1,98 @@
+"""Gate events per second with group commit off and on.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.group_commit --gates 32
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client, Parking
+
+from .stats import percentile
+
+
+def run(uri, gates, cycles, config):
+    app = create_app(dict({'SQLALCHEMY_DATABASE_URI': uri,
+                           'SCHEMA_CHECK': False}, **config))
+    # Lock errors without group commit are counted, not printed
+    app.logger.disabled = True
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(Client.__table__.insert(),
+                           [{'name': 'name', 'surname': 'surname',
+                             'credit_card': '1234', 'car_number': f'A{i}'}
+                            for i in range(gates)])
+        db.session.add(Parking(address='gate', opened=True,
+                               count_places=gates,
+                               count_available_places=gates))
+        db.session.commit()
+        db.session.remove()
+
+    barrier = threading.Barrier(gates + 1)
+    latencies = []
+    failures = []
+
+    def gate(client_id):
+        client = app.test_client()
+        body = {'client_id': client_id, 'parking_id': 1}
+        barrier.wait()
+        for _ in range(cycles):
+            for method in ('POST', 'DELETE'):
+                started = time.perf_counter()
+                response = client.open('/client_parkings', method=method,
+                                       json=body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 300:
+                    failures.append(response.status_code)
+
+    threads = [threading.Thread(target=gate, args=(i,))
+               for i in range(1, gates + 1)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    committer = app.extensions.get('group_committer')
+    if committer:
+        committer.close()
+    with app.app_context():
+        db.get_engine().dispose()
+    return len(latencies) / elapsed, statistics.median(latencies), \
+        percentile(latencies, 99), len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gates', type=int, default=32)
+    parser.add_argument('--cycles', type=int, default=50)
+    parser.add_argument('--window-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f'{args.gates} gates, {args.cycles} enter/leave cycles each')
+    print(f'{"synchronous":<12} {"group commit":<13} {"events/s":>9} '
+          f'{"p50 ms":>8} {"p99 ms":>8} {"failed":>7}')
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        for synchronous in ('FULL', 'NORMAL'):
+            for grouped in (False, True):
+                config = {'SQLITE_SYNCHRONOUS': synchronous,
+                          'GROUP_COMMIT': grouped,
+                          'GROUP_COMMIT_WINDOW': args.window_ms / 1000}
+                rate, p50, p99, failed = run(uri, args.gates, args.cycles,
+                                             config)
+                print(f'{synchronous:<12} {"on" if grouped else "off":<13} '
+                      f'{rate:>9.0f} {p50:>8.2f} {p99:>8.2f} {failed:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Client visit history: lazy relationships against the history endpoint.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.history
+"""
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client, Parking, \
+    ClientParking
+
+from .stats import QueryCounter
+
+
+def seed(visits, parkings=50):
+    db.session.execute(Parking.__table__.insert(),
+                       [{'address': f'address {i}', 'opened': True,
+                         'count_places': 100, 'count_available_places': 100}
+                        for i in range(parkings)])
+    start = datetime.datetime(2024, 1, 1)
+    for client_id, count in enumerate(visits, 1):
+        db.session.add(Client(id=client_id, name='name', surname='surname',
+                              car_number=f'A{client_id:03}'))
+        db.session.execute(ClientParking.__table__.insert(), [
+            {'client_id': client_id, 'parking_id': i % parkings + 1,
+             'time_in': start + datetime.timedelta(hours=i),
+             'time_out': start + datetime.timedelta(hours=i, minutes=30)}
+            for i in range(count)])
+    db.session.commit()
+
+
+def lazy_history(client_id):
+    # What a view walking the default lazy backrefs does
+    client = db.session.query(Client).get(client_id)
+    return {'client': client.to_json(),
+            'visits': [dict(log.to_json(), parking=log.parking.to_json())
+                       for log in client.parking]}
+
+
+def measure(func, repeat, engine):
+    latencies = []
+    with QueryCounter(engine) as counter:
+        for _ in range(repeat):
+            db.session.remove()
+            started = time.perf_counter()
+            func()
+            latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), counter.count / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    visits = [10, 100, 1000]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                          'SCHEMA_CHECK': False})
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            seed(visits)
+            print(f'{"visits":>6} {"lazy ms":>9} {"queries":>8} '
+                  f'{"endpoint ms":>12} {"queries":>8}')
+            for client_id, count in enumerate(visits, 1):
+                lazy = measure(lambda: lazy_history(client_id), args.repeat,
+                               db.engine)
+                endpoint = measure(
+                    lambda: client.get(f'/clients/{client_id}/history'
+                                       f'?limit={count}'),
+                    args.repeat, db.engine)
+                print(f'{count:>6} {lazy[0]:>9.2f} {lazy[1]:>8.0f} '
+                      f'{endpoint[0]:>12.2f} {endpoint[1]:>8.0f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Gate retries with and without an Idempotency-Key.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.idempotency --retries 2000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.idempotency import IdempotencyStore
+from module_29_testing.hw.main.models import db, Client, Parking
+
+from .stats import QueryCounter, percentile
+
+
+def seed(clients):
+    db.session.execute(Client.__table__.insert(),
+                       [{'name': f'name {i}', 'surname': 'surname',
+                         'credit_card': '1234', 'car_number': f'A{i:05}'}
+                        for i in range(clients)])
+    db.session.add(Parking(address='gate', opened=True,
+                           count_places=clients,
+                           count_available_places=clients))
+    db.session.commit()
+
+
+def run(client, method, keyed, count, engine):
+    latencies = []
+    with QueryCounter(engine) as counter:
+        for i in range(1, count + 1):
+            headers = {'Idempotency-Key': f'{method}-{i}'} if keyed else {}
+            started = time.perf_counter()
+            client.open('/client_parkings', method=method, headers=headers,
+                        json={'client_id': i, 'parking_id': 1})
+            latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), percentile(latencies, 99), \
+        counter.count / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--retries', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                          'SCHEMA_CHECK': False})
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            seed(args.retries)
+            engine = db.engine
+
+            # Every client enters, leaves and has the leave retried, once
+            # without keys and once with them
+            run(client, 'POST', False, args.retries, engine)
+            results = [('leave, no key', run(client, 'DELETE', False,
+                                             args.retries, engine)),
+                       ('retry, no key (404)', run(client, 'DELETE', False,
+                                                   args.retries, engine))]
+            run(client, 'POST', True, args.retries, engine)
+            results.append(('leave with key', run(client, 'DELETE', True,
+                                                  args.retries, engine)))
+            results.append(('retry, from the LRU', run(client, 'DELETE', True,
+                                                       args.retries, engine)))
+            app.extensions['idempotency_store'] = IdempotencyStore()
+            results.append(('retry, from the table', run(
+                client, 'DELETE', True, args.retries, engine)))
+
+            print(f'{"request":<24} {"p50 ms":>8} {"p99 ms":>8} '
+                  f'{"queries":>8}')
+            for label, (p50, p99, queries) in results:
+                print(f'{label:<24} {p50:>8.3f} {p99:>8.3f} {queries:>8.2f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Creating clients one POST at a time against the bulk import endpoint.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.import_clients --clients 20000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db
+
+from .stats import QueryCounter
+
+
+def rows(count):
+    return [{'name': f'name {i}', 'surname': 'surname',
+             'car_number': f'A{i:05}', 'credit_card': '1234'}
+            for i in range(count)]
+
+
+def one_by_one(client, clients):
+    for row in clients:
+        assert client.post('/clients', json=row).status_code == 201
+
+
+def bulk(client, clients, fmt):
+    if fmt == 'csv':
+        body = 'name,surname,car_number,credit_card\n' + ''.join(
+            f'{r["name"]},{r["surname"]},{r["car_number"]},'
+            f'{r["credit_card"]}\n' for r in clients)
+        content_type = 'text/csv'
+    else:
+        body = ''.join(json.dumps(r) + '\n' for r in clients)
+        content_type = 'application/x-ndjson'
+    response = client.post('/clients/import', data=body,
+                           content_type=content_type)
+    assert response.json['imported'] == len(clients)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    clients = rows(args.clients)
+    print(f'{"method":<16} {"seconds":>8} {"clients/s":>10} '
+          f'{"statements":>11}')
+    for label, run in (('POST /clients', lambda c: one_by_one(c, clients)),
+                       ('import csv', lambda c: bulk(c, clients, 'csv')),
+                       ('import ndjson', lambda c: bulk(c, clients,
+                                                        'ndjson'))):
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app({'SQLALCHEMY_DATABASE_URI':
+                              f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                              'IMPORT_BATCH_SIZE': args.batch_size,
+                              'SCHEMA_CHECK': False})
+            with app.app_context():
+                db.create_all()
+                with QueryCounter(db.engine) as counter:
+                    started = time.perf_counter()
+                    run(app.test_client())
+                    elapsed = time.perf_counter() - started
+                db.session.remove()
+                db.get_engine().dispose()
+        print(f'{label:<16} {elapsed:>8.2f} {args.clients / elapsed:>10.0f} '
+              f'{counter.count:>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Enter/leave latency as the parking log grows.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.indexes \
+        --sizes 10000 100000 1000000 10000000
+
+Every size is measured twice: with the schema's indexes, then with the
+old (client_id, parking_id, time_out) lookup index added back, which the
+planner prefers over the partial unique index.
+
+Seeding ten million rows takes several minutes.
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client, Parking, ClientParking
+
+from .stats import percentile
+
+
+CLIENTS = 1000
+PARKINGS = 50
+INSERT_CHUNK = 50_000
+LOOKUP_INDEX = 'ix_client_parking_lookup'
+
+
+def seed(log_rows):
+    db.session.execute(Client.__table__.insert(),
+                       [{'name': f'name {i}', 'surname': 'surname',
+                         'credit_card': '1234', 'car_number': f'A{i:04}'}
+                        for i in range(CLIENTS)])
+    db.session.execute(Parking.__table__.insert(),
+                       [{'address': f'address {i}', 'opened': True,
+                         'count_places': CLIENTS,
+                         'count_available_places': CLIENTS}
+                        for i in range(PARKINGS)])
+    start = datetime.datetime(2020, 1, 1)
+    for offset in range(0, log_rows, INSERT_CHUNK):
+        chunk = range(offset, min(offset + INSERT_CHUNK, log_rows))
+        db.session.execute(ClientParking.__table__.insert(),
+                           [{'client_id': i % CLIENTS + 1,
+                             'parking_id': i % PARKINGS + 1,
+                             'time_in': start + datetime.timedelta(minutes=i),
+                             'time_out': start + datetime.timedelta(minutes=i + 30)}
+                            for i in chunk])
+        db.session.commit()
+
+
+def measure(app, iterations):
+    client = app.test_client()
+    rnd = random.Random(0)
+    enter_ms, leave_ms = [], []
+    for _ in range(iterations):
+        req = {'client_id': rnd.randint(1, CLIENTS),
+               'parking_id': rnd.randint(1, PARKINGS)}
+        started = time.perf_counter()
+        client.post('/client_parkings', json=req)
+        enter_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        client.delete('/client_parkings', json=req)
+        leave_ms.append((time.perf_counter() - started) * 1000)
+    return enter_ms, leave_ms
+
+
+def query_plan():
+    rows = db.session.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM client_parking '
+        'WHERE client_id = 1 AND parking_id = 1 AND time_out IS NULL')
+    return '; '.join(row[-1] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'{"log rows":>12} {"indexes":>8} {"enter p50":>10} '
+          f'{"enter p99":>10} {"leave p50":>10} {"leave p99":>10}  plan')
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app({'SCHEMA_CHECK': False})
+            app.config['SQLALCHEMY_DATABASE_URI'] = \
+                f'sqlite:///{os.path.join(tmp, "bench.db")}'
+            with app.app_context():
+                db.create_all()
+                seed(size)
+                for indexes in ('schema', '+lookup'):
+                    if indexes == '+lookup':
+                        db.session.execute(
+                            f'CREATE INDEX {LOOKUP_INDEX} ON client_parking '
+                            f'(client_id, parking_id, time_out)')
+                        db.session.commit()
+                    plan = query_plan()
+                    enter_ms, leave_ms = measure(app, args.iterations)
+                    print(f'{size:>12} {indexes:>8} '
+                          f'{statistics.median(enter_ms):>10.2f} '
+                          f'{percentile(enter_ms, 99):>10.2f} '
+                          f'{statistics.median(leave_ms):>10.2f} '
+                          f'{percentile(leave_ms, 99):>10.2f}  {plan}')
+                db.session.remove()
+                db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Parking listing pages: the in-memory snapshot against a filtered query.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.listing --parkings 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from module_29_testing.hw.main import listing
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Parking
+
+from .stats import percentile
+
+
+def query_page(opened, min_available, after_id, limit):
+    # The same page read straight from the table
+    query = db.session.query(Parking.id, Parking.address, Parking.opened,
+                             Parking.count_available_places)\
+        .filter(Parking.count_available_places >= min_available)
+    if opened is not None:
+        query = query.filter(Parking.opened == opened)
+    if after_id is not None:
+        query = query.filter(Parking.id > after_id)
+    return [row._asdict() for row in query.order_by(Parking.id)
+            .limit(limit)]
+
+
+def measure(func, pages):
+    latencies = []
+    for page in pages:
+        started = time.perf_counter()
+        func(*page)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--parkings', type=int, default=10000)
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                          'SCHEMA_CHECK': False})
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            db.session.execute(Parking.__table__.insert(), [
+                {'address': f'address {i}', 'opened': rng.random() < 0.8,
+                 'count_places': 100,
+                 'count_available_places': rng.randint(0, 100)}
+                for i in range(args.parkings)])
+            db.session.commit()
+
+            snapshot = listing.ParkingSnapshot()
+            started = time.perf_counter()
+            snapshot.reload(lambda: listing.parking_rows(db.session))
+            print(f'{len(snapshot)} parkings loaded in '
+                  f'{(time.perf_counter() - started) * 1000:.1f} ms')
+
+            pages = [(True, rng.choice([1, 10, 50, 90]),
+                      rng.choice([None, rng.randrange(args.parkings)]), 20)
+                     for _ in range(args.pages)]
+            for page in pages[:100]:
+                assert snapshot.page(*page) == query_page(*page)
+
+            print(f'{"open, min_available":<20} {"p50 ms":>8} {"p99 ms":>8}')
+            for name, func in (
+                    ('snapshot', snapshot.page),
+                    ('query', query_page),
+                    ('GET /parkings', lambda *page: client.get(
+                        '/parkings', query_string={
+                            'opened': 'true', 'min_available': page[1],
+                            'after_id': page[2], 'limit': page[3]}))):
+                p50, p99 = measure(func, pages)
+                print(f'{name:<20} {p50:>8.3f} {p99:>8.3f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
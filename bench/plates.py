@@ -0,0 +1,103 @@
+"""Resolving a license plate to a client at a million clients.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.plates --clients 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.migrations import upgrade
+from module_29_testing.hw.main.models import db, Client, Parking
+
+from .stats import percentile
+
+
+INSERT_CHUNK = 50_000
+
+
+def plate(i):
+    return f'A{i:07d}BC'
+
+
+def seed(clients):
+    for offset in range(0, clients, INSERT_CHUNK):
+        db.session.execute(Client.__table__.insert(),
+                           [{'name': f'name {i}', 'surname': 'surname',
+                             'credit_card': '1234', 'car_number': plate(i),
+                             'plate': plate(i)}
+                            for i in range(offset,
+                                           min(offset + INSERT_CHUNK,
+                                               clients))])
+        db.session.commit()
+    db.session.add(Parking(address='gate', opened=True, count_places=10,
+                           count_available_places=10))
+    db.session.commit()
+
+
+def timed(func, arguments):
+    latencies = []
+    for argument in arguments:
+        started = time.perf_counter()
+        func(argument)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--scans', type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    plates = [plate(rnd.randrange(args.clients)) for _ in range(args.lookups)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        upgrade(create_engine(uri))
+        app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+        with app.app_context():
+            started = time.perf_counter()
+            seed(args.clients)
+            print(f'seeded {args.clients} clients in '
+                  f'{time.perf_counter() - started:.1f}s')
+            db.session.remove()
+
+        client = app.test_client()
+        with app.app_context():
+            session = db.session
+            rows = [
+                ('car_number scan', lambda p: session.execute(
+                    'SELECT id FROM client WHERE car_number = :p',
+                    {'p': p}).all(), plates[:args.scans]),
+                ('plate index (SQL)', lambda p: session.query(Client.id)
+                 .filter(Client.plate == p).all(), plates),
+                ('GET /clients?car_number=', lambda p: client.get(
+                    f'/clients?car_number={p}'), plates),
+                ('POST by_plate enter+leave', lambda p: (
+                    client.post('/client_parkings/by_plate',
+                                json={'car_number': p, 'parking_id': 1}),
+                    client.post('/client_parkings/by_plate',
+                                json={'car_number': p, 'parking_id': 1,
+                                      'action': 'leave'})),
+                 plates[:args.lookups // 4]),
+            ]
+            print(f'{"lookup":<28} {"p50 ms":>9} {"p99 ms":>9}')
+            for label, func, arguments in rows:
+                p50, p99 = timed(func, arguments)
+                print(f'{label:<28} {p50:>9.4f} {p99:>9.4f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Free places for a time slot: the timeline index against a SQL sweep.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.reservations --reservations 100000
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from module_29_testing.hw.main import reservations
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client, Parking, \
+    Reservation
+
+from .stats import percentile
+
+
+START = datetime.datetime(2030, 1, 1)
+DAYS = 30
+
+
+def seed(count, parkings, rng):
+    db.session.execute(Parking.__table__.insert(),
+                       [{'address': f'address {i}', 'opened': True,
+                         'count_places': 10 ** 6,
+                         'count_available_places': 10 ** 6}
+                        for i in range(parkings)])
+    db.session.execute(Client.__table__.insert(),
+                       [{'name': 'name', 'surname': 'surname',
+                         'car_number': f'A{i}'} for i in range(1000)])
+    rows = []
+    for _ in range(count):
+        starts_at = START + datetime.timedelta(
+            minutes=rng.randrange(DAYS * 24 * 60))
+        rows.append({'client_id': rng.randint(1, 1000),
+                     'parking_id': rng.randint(1, parkings),
+                     'starts_at': starts_at,
+                     'ends_at': starts_at + datetime.timedelta(
+                         minutes=rng.randint(30, 240)),
+                     'created_at': START})
+    db.session.execute(Reservation.__table__.insert(), rows)
+    db.session.commit()
+
+
+def sweep_peak(parking_id, start, end):
+    # What answering without the index takes: overlapping rows, then a sweep
+    rows = reservations.reservations_in(db.session, parking_id, start, end)
+    deltas = {}
+    for row in rows:
+        deltas[max(row.starts_at, start)] = \
+            deltas.get(max(row.starts_at, start), 0) + 1
+        deltas[row.ends_at] = deltas.get(row.ends_at, 0) - 1
+    held = peak = 0
+    for moment in sorted(deltas):
+        held += deltas[moment]
+        if moment < end:
+            peak = max(peak, held)
+    return peak
+
+
+def measure(func, windows):
+    latencies = []
+    for window in windows:
+        started = time.perf_counter()
+        func(*window)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reservations', type=int, default=100000)
+    parser.add_argument('--parkings', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                          'SCHEMA_CHECK': False})
+        with app.app_context():
+            db.create_all()
+            seed(args.reservations, args.parkings, rng)
+
+            index = reservations.ReservationIndex()
+            started = time.perf_counter()
+            index.sync(db.session, START)
+            print(f'{len(index)} reservations indexed in '
+                  f'{time.perf_counter() - started:.2f} s')
+
+            windows = []
+            for _ in range(args.queries):
+                start = START + datetime.timedelta(
+                    minutes=rng.randrange(DAYS * 24 * 60))
+                windows.append((rng.randint(1, args.parkings), start,
+                                start + datetime.timedelta(hours=2)))
+            for parking_id, start, end in windows[:100]:
+                assert index.peak(parking_id, start, end) == \
+                    sweep_peak(parking_id, start, end)
+
+            print(f'{"peak for a 2 h slot":<22} {"p50 ms":>8} {"p99 ms":>8}')
+            for name, func in (('timeline index', index.peak),
+                               ('SQL + sweep', sweep_peak)):
+                p50, p99 = measure(func, windows)
+                print(f'{name:<22} {p50:>8.4f} {p99:>8.4f}')
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
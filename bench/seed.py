@@ -0,0 +1,63 @@
+import datetime
+import random
+
+import factory
+
+from module_29_testing.hw.main.compaction import compact_closed_sessions
+from module_29_testing.hw.main.models import db, Client, Parking, ClientParking
+from module_29_testing.hw.tests.factories import ClientFactory, \
+    ParkingFactory, ClientParkingFactory
+
+
+INSERT_CHUNK = 50_000
+# Faker is far too slow to run per row for millions of log rows, so a pool
+# of factory-built visits is replayed with shifted dates instead
+LOG_POOL_SIZE = 10_000
+
+
+def _insert(table, rows):
+    for offset in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(table.insert(), rows[offset:offset + INSERT_CHUNK])
+    db.session.commit()
+
+
+def seed_clients(count):
+    rows = factory.build_batch(dict, count, FACTORY_CLASS=ClientFactory)
+    _insert(Client.__table__, rows)
+
+
+def seed_parkings(count, places=None):
+    rows = factory.build_batch(dict, count, FACTORY_CLASS=ParkingFactory)
+    for i, row in enumerate(rows):
+        # Faker addresses repeat, the address column is unique
+        row['address'] = f'{row["address"]}, {i}'
+        if places:
+            row['count_places'] = row['count_available_places'] = places
+    _insert(Parking.__table__, rows)
+
+
+def seed_parking_log(count, clients, parkings, seed=0):
+    rnd = random.Random(seed)
+    pool = [(visit['time_in'], visit['time_out'] - visit['time_in'])
+            for visit in factory.build_batch(
+                dict, min(count, LOG_POOL_SIZE),
+                FACTORY_CLASS=ClientParkingFactory, client=None, parking=None)]
+    for offset in range(0, count, INSERT_CHUNK):
+        rows = []
+        for i in range(offset, min(offset + INSERT_CHUNK, count)):
+            time_in, stay = pool[i % len(pool)]
+            time_in -= datetime.timedelta(days=i // len(pool))
+            rows.append({'client_id': rnd.randint(1, clients),
+                         'parking_id': rnd.randint(1, parkings),
+                         'time_in': time_in,
+                         'time_out': time_in + stay})
+        db.session.execute(ClientParking.__table__.insert(), rows)
+        db.session.commit()
+    # Steady state: closed visits live in the history table
+    compact_closed_sessions(batch_size=INSERT_CHUNK)
+
+
+def seed(clients, parkings, log_rows, places=None):
+    seed_clients(clients)
+    seed_parkings(parkings, places)
+    seed_parking_log(log_rows, clients, parkings)
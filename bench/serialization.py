@@ -0,0 +1,62 @@
+"""Serializing and encoding a bulk listing of parking log rows.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.serialization --rows 100000
+"""
+import argparse
+import datetime
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import ClientParking
+from module_29_testing.hw.main.serializers import OrjsonProvider, orjson
+
+
+def reflective_json(obj):
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
+
+
+def timed(label, func, rows):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<36} {elapsed * 1000:>9.1f} ms '
+          f'{rows / elapsed:>12.0f} rows/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    start = datetime.datetime(2022, 1, 1)
+    rows = [ClientParking(id=i, client_id=i % 1000, parking_id=i % 50,
+                          time_in=start + datetime.timedelta(minutes=i),
+                          time_out=start + datetime.timedelta(minutes=i + 30))
+            for i in range(args.rows)]
+
+    timed('reflective to_json', lambda: [reflective_json(r) for r in rows],
+          args.rows)
+    dicts = timed('column tuple to_json', lambda: [r.to_json() for r in rows],
+                  args.rows)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                      'SCHEMA_CHECK': False})
+    with app.app_context():
+        default = DefaultJSONProvider(app)
+        timed('stdlib json encode', lambda: default.dumps(
+            dicts, separators=(',', ':')), args.rows)
+        if orjson:
+            fast = OrjsonProvider(app)
+            timed('orjson encode', lambda: fast.dumps(
+                dicts, separators=(',', ':')), args.rows)
+        else:
+            print('orjson is not installed, skipping the fast backend')
+
+
+if __name__ == '__main__':
+    main()
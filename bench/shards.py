@@ -0,0 +1,144 @@
+"""Gate events per second as the parkings are split over more shards.
+
+Gates run as threads spread over worker processes, like a multi-worker
+deployment, all writing to the same database files. Sharding splits the
+write lock, so events/s can only grow with the shard count when there
+are cores for the extra writers; on a single core the run is CPU-bound
+and only shows the lock waits (p99 and failed requests) going down. Run
+from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.shards --gates 32 --processes 8
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from module_29_testing.hw.main import migrations
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.models import db, Client
+
+from .stats import percentile
+
+
+def make_app(tmp, shards, synchronous):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "main.db")}',
+        'SHARD_DATABASE_URIS': [
+            f'sqlite:///{os.path.join(tmp, f"shard{i}.db")}'
+            for i in range(shards)],
+        'SQLITE_SYNCHRONOUS': synchronous,
+        'SCHEMA_CHECK': False})
+    # Lock errors are counted, not printed
+    app.logger.disabled = True
+    return app
+
+
+def seed(tmp, shards, gates, parkings, synchronous):
+    app = make_app(tmp, shards, synchronous)
+    router = app.extensions['shard_router']
+    with app.app_context():
+        for engine in [db.engine] + router.engines:
+            migrations.upgrade(engine)
+        db.session.execute(Client.__table__.insert(),
+                           [{'name': 'name', 'surname': 'surname',
+                             'credit_card': '1234', 'car_number': f'A{i}'}
+                            for i in range(gates)])
+        db.session.commit()
+        db.session.remove()
+        client = app.test_client()
+        for i in range(parkings):
+            client.post('/parkings', json={'address': f'address {i}',
+                                           'count_places': gates})
+        db.get_engine().dispose()
+    router.close()
+
+
+def worker(tmp, shards, synchronous, client_ids, parkings, cycles, start,
+           results):
+    app = make_app(tmp, shards, synchronous)
+    latencies = []
+    failures = []
+
+    def gate(client_id):
+        client = app.test_client()
+        body = {'client_id': client_id,
+                'parking_id': client_id % parkings + 1}
+        start.wait()
+        for _ in range(cycles):
+            for method in ('POST', 'DELETE'):
+                started = time.perf_counter()
+                response = client.open('/client_parkings', method=method,
+                                       json=body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 300:
+                    failures.append(response.status_code)
+
+    threads = [threading.Thread(target=gate, args=(client_id,))
+               for client_id in client_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, len(failures)))
+
+
+def run(tmp, shards, gates, processes, parkings, cycles, synchronous):
+    seed(tmp, shards, gates, parkings, synchronous)
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(
+        target=worker, args=(tmp, shards, synchronous,
+                             range(i + 1, gates + 1, processes), parkings,
+                             cycles, start, results))
+        for i in range(processes)]
+    for process in workers:
+        process.start()
+    # Apps are built before the clock starts
+    time.sleep(1)
+    started = time.perf_counter()
+    start.set()
+    latencies = []
+    failed = 0
+    for _ in workers:
+        worker_latencies, worker_failed = results.get()
+        latencies += worker_latencies
+        failed += worker_failed
+    elapsed = time.perf_counter() - started
+    for process in workers:
+        process.join()
+    return len(latencies) / elapsed, statistics.median(latencies), \
+        percentile(latencies, 99), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gates', type=int, default=32)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--parkings', type=int, default=16)
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--synchronous', default='FULL')
+    args = parser.parse_args()
+
+    print(f'{args.gates} gates in {args.processes} processes over '
+          f'{args.parkings} parkings, {args.cycles} enter/leave cycles '
+          f'each, synchronous={args.synchronous}')
+    if (os.cpu_count() or 1) < 2:
+        print('Only one CPU: events/s is CPU-bound and says nothing about '
+              'throughput scaling')
+    print(f'{"shards":>6} {"events/s":>9} {"p50 ms":>8} {"p99 ms":>8} '
+          f'{"failed":>7}')
+    for shards in (1, 2, 4, 8):
+        with tempfile.TemporaryDirectory() as tmp:
+            rate, p50, p99, failed = run(tmp, shards, args.gates,
+                                         args.processes, args.parkings,
+                                         args.cycles, args.synchronous)
+        print(f'{shards:>6} {rate:>9.0f} {p50:>8.2f} {p99:>8.2f} '
+              f'{failed:>7}')
+
+
+if __name__ == '__main__':
+    main()
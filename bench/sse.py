@@ -0,0 +1,60 @@
+"""Occupancy fan-out to idle server-sent event subscribers.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.sse --subscribers 5000
+"""
+import argparse
+import statistics
+import time
+
+from module_29_testing.hw.main.broadcast import OccupancyBroadcaster
+
+from .stats import percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--parkings', type=int, default=50)
+    parser.add_argument('--changes', type=int, default=500)
+    args = parser.parse_args()
+
+    broadcaster = OccupancyBroadcaster(max_subscribers=args.subscribers)
+    # A board per parking, the rest watch every parking
+    boards = [broadcaster.subscribe(i % args.parkings + 1)
+              for i in range(args.subscribers // 2)]
+    walls = [broadcaster.subscribe()
+             for _ in range(args.subscribers - len(boards))]
+
+    publish_us = []
+    fan_out_ms = []
+    for change in range(args.changes):
+        parking_id = change % args.parkings + 1
+        availability = {'parking_id': parking_id,
+                        'count_available_places': change,
+                        'opened': True}
+        started = time.perf_counter()
+        broadcaster.publish(availability)
+        publish_us.append((time.perf_counter() - started) * 1e6)
+        # The last subscriber in line for this parking marks the end
+        for subscription in walls:
+            subscription.get(5)
+        for subscription in boards[parking_id - 1::args.parkings]:
+            subscription.get(5)
+        fan_out_ms.append((time.perf_counter() - started) * 1000)
+
+    receivers = len(walls) + len(boards) // args.parkings
+    print(f'{args.subscribers} idle subscribers, ~{receivers} per change')
+    print(f'publish on the request thread: p50 '
+          f'{statistics.median(publish_us):.1f} us, '
+          f'p99 {percentile(publish_us, 99):.1f} us')
+    print(f'delivered to every subscriber: p50 '
+          f'{statistics.median(fan_out_ms):.2f} ms, '
+          f'p99 {percentile(fan_out_ms, 99):.2f} ms')
+    print(f'dropped: {sum(s.dropped for s in boards + walls)}')
+    print(f'polling every second instead: {args.subscribers} requests/s')
+
+
+if __name__ == '__main__':
+    main()
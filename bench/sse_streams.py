@@ -0,0 +1,151 @@
+"""Gate latency while occupancy event streams stay open.
+
+Every stream of the Flask app holds a worker thread, so the app refuses
+streams over ``SSE_MAX_SUBSCRIBERS`` with a 503; the ASGI app holds none.
+
+Run from the directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.sse_streams --streams 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+
+from module_29_testing.hw.main.app import create_app
+from module_29_testing.hw.main.asgi import create_async_app
+from module_29_testing.hw.main.models import db
+
+from .async_vs_sync import run_async
+from .endpoints import TestClientDriver, run
+from .seed import seed
+from .stats import summarize
+
+
+def gate_requests(args, rnd, client_ids):
+    # Clients not used by an earlier run, every entry is admitted
+    return [('POST', '/client_parkings', {'client_id': next(client_ids),
+                                          'parking_id': rnd.randint(
+                                              1, args.parkings)})
+            for _ in range(args.requests)]
+
+
+def open_sync_streams(app, count):
+    # A thread per stream reads it, as a WSGI worker would serve it
+    stop = threading.Event()
+    accepted = []
+    threads = []
+
+    def read(response):
+        try:
+            for _ in response.response:
+                if stop.is_set():
+                    return
+        finally:
+            response.close()
+
+    for _ in range(count):
+        response = app.test_client().get('/parkings/events', buffered=False)
+        if response.status_code != 200:
+            continue
+        accepted.append(response)
+        threads.append(threading.Thread(target=read, args=(response,)))
+        threads[-1].start()
+
+    def close():
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return len(accepted), close
+
+
+async def open_async_stream(app, stop):
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await stop.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        pass
+
+    await app({'type': 'http', 'method': 'GET', 'path': '/parkings/events',
+               'query_string': b'', 'headers': []}, receive, send)
+
+
+def report(flavour, streams, accepted, latencies, elapsed, failures):
+    summary = summarize(latencies, elapsed, 0)
+    print(f'{flavour:<14} {streams:>7} {accepted:>8} '
+          f'{summary["p50_ms"]:>8.2f} {summary["p99_ms"]:>8.2f} '
+          f'{summary["rps"]:>8.0f} {len(failures):>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=20_000)
+    parser.add_argument('--parkings', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--heartbeat', type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        config = {'SQLALCHEMY_DATABASE_URI': uri,
+                  'SCHEMA_CHECK': False,
+                  'SSE_HEARTBEAT': args.heartbeat,
+                  'SQLITE_BUSY_TIMEOUT_MS': 60_000}
+        with create_app(config).app_context():
+            db.create_all()
+            seed(args.clients, args.parkings, 0, places=args.clients)
+            db.session.remove()
+
+        print(f'{"app":<14} {"streams":>7} {"accepted":>8} {"p50 ms":>8} '
+              f'{"p99 ms":>8} {"req/s":>8} {"errors":>7}')
+        rnd = random.Random('sse')
+        client_ids = iter(rnd.sample(range(1, args.clients + 1),
+                                     args.clients))
+        runs = [('sync', {}), ('sync uncapped',
+                               {'SSE_MAX_SUBSCRIBERS': args.streams})]
+        for flavour, overrides in runs:
+            for streams in (0, args.streams):
+                app = create_app(dict(config, **overrides))
+                accepted, close = open_sync_streams(app, streams)
+                try:
+                    report(flavour, streams, accepted, *run(
+                        TestClientDriver(app),
+                        gate_requests(args, rnd, client_ids),
+                        args.concurrency))
+                finally:
+                    close()
+
+        # One event loop for the whole run, pooled aiosqlite connections
+        # are bound to the loop they were opened on
+        async def run_all():
+            app = create_async_app(config)
+            for streams in (0, args.streams):
+                stop = asyncio.Event()
+                tasks = [asyncio.ensure_future(open_async_stream(app, stop))
+                         for _ in range(streams)]
+                # Every stream has subscribed before the gates start
+                while len(app.broadcaster) < streams:
+                    await asyncio.sleep(0.01)
+                report('async', streams, len(app.broadcaster),
+                       *await run_async(app,
+                                        gate_requests(args, rnd, client_ids),
+                                        args.concurrency))
+                stop.set()
+                await asyncio.gather(*tasks)
+            await app.engine.dispose()
+
+        asyncio.run(run_all())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Worker cold start: import, create_app and the first request.
+
+Every run is a fresh interpreter so imports are not cached. Run from the
+directory containing ``module_29_testing``::
+
+    python -m module_29_testing.hw.bench.startup --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+from module_29_testing.hw.main.migrations import upgrade
+
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from module_29_testing.hw.main.app import create_app, db
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1],
+                  'SCHEMA_CHECK': sys.argv[2] == 'check'})
+if sys.argv[2] == 'create_all':
+    with app.app_context():
+        db.create_all()
+created = time.perf_counter()
+assert app.test_client().get('/clients?limit=1').status_code == 200
+served = time.perf_counter()
+print(json.dumps({'import': imported - started,
+                  'create_app': created - imported,
+                  'first_request': served - created}))
+'''
+
+# create_all is what every worker used to run on boot
+MODES = ('create_all', 'check', 'no check')
+
+
+def probe(uri, mode):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path),
+               SQLALCHEMY_SILENCE_UBER_WARNING='1')
+    output = subprocess.run([sys.executable, '-c', PROBE, uri, mode],
+                            env=env, check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        upgrade(create_engine(uri))
+
+        print(f'{"mode":<12} {"import ms":>10} {"create_app ms":>14} '
+              f'{"first req ms":>13} {"total ms":>9}')
+        for mode in MODES:
+            runs = [probe(uri, mode) for _ in range(args.runs)]
+            medians = {key: statistics.median(run[key] for run in runs) * 1000
+                       for key in runs[0]}
+            print(f'{mode:<12} {medians["import"]:>10.1f} '
+                  f'{medians["create_app"]:>14.1f} '
+                  f'{medians["first_request"]:>13.1f} '
+                  f'{sum(medians.values()):>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
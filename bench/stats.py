@@ -0,0 +1,37 @@
+import statistics
+import threading
+
+from sqlalchemy import event
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies_ms, elapsed, queries):
+    return {'requests': len(latencies_ms),
+            'p50_ms': round(statistics.median(latencies_ms), 3),
+            'p99_ms': round(percentile(latencies_ms, 99), 3),
+            'rps': round(len(latencies_ms) / elapsed, 1),
+            'queries_per_request': round(queries / len(latencies_ms), 2)}
+
+
+class QueryCounter:
+    """Counts SQL statements an engine executes, across all threads."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
@@ -1,35 +1,254 @@
 import datetime
+import os
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, json, jsonify, request, \
+    stream_with_context, url_for
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
-from .models import db, Client, Parking, ClientParking
+from . import billing, broadcast, compaction, engine, etags, export, \
+    gate, group_commit, history, idempotency, importer, listing, \
+    metrics, migrations, plates, reservations, rollups, shards
+from .cache import AvailabilityCache, VersionCache
+from .models import db, Client, Parking
+from .serializers import install_json_provider
 
 
-def create_app():
+CLIENTS_PAGE_LIMIT = 100
+CLIENTS_MAX_LIMIT = 1000
+CLIENTS_STREAM_CHUNK = 1000
+
+
+def _iter_json_array(items):
+    # Emits a JSON array piece by piece so the response can start
+    # before the whole collection has been read
+    yield '['
+    for i, item in enumerate(items):
+        if i:
+            yield ','
+        yield json.dumps(item.to_json(), separators=(',', ':'))
+    yield ']'
+
+
+def create_app(config=None):
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///prod.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['AVAILABILITY_CACHE_TTL'] = 60.0
+    app.config['METRICS_ENABLED'] = False
+    app.config['SLOW_QUERY_MS'] = 100
+    app.config['JSON_BACKEND'] = 'auto'
+    app.config['COMPACTION_INTERVAL'] = None
+    app.config['ETAG_VERSION_TTL'] = 5.0
+    app.config['SCHEMA_CHECK'] = True
+    app.config['IMPORT_BATCH_SIZE'] = importer.IMPORT_BATCH
+    app.config['EXPORT_CHUNK_SIZE'] = export.EXPORT_CHUNK
+    app.config['SSE_HEARTBEAT'] = broadcast.SSE_HEARTBEAT
+    app.config['SSE_MAX_PENDING'] = broadcast.SSE_MAX_PENDING
+    app.config['SSE_MAX_SUBSCRIBERS'] = broadcast.SSE_MAX_THREADED_SUBSCRIBERS
+    app.config['RESERVATION_HORIZON'] = reservations.RESERVATION_HORIZON
+    app.config['RESERVATION_EARLY'] = reservations.RESERVATION_EARLY
+    app.config['PARKING_SNAPSHOT_TTL'] = listing.PARKING_SNAPSHOT_TTL
+    engine.load_environment(app.config)
+    app.config.update(config or {})
+    engine.configure(app)
+    install_json_provider(app)
     db.init_app(app)
-
-    with app.app_context():
-        db.create_all()
+    shards.install(app)
+    shard_router = app.extensions.get('shard_router')
+    migrations.install(app)
+
+    availability = AvailabilityCache(ttl=app.config['AVAILABILITY_CACHE_TTL'])
+    app.extensions['availability_cache'] = availability
+    versions = VersionCache(ttl=app.config['ETAG_VERSION_TTL'])
+    app.extensions['version_cache'] = versions
+    etags.install_session_events()
+    broadcaster = broadcast.OccupancyBroadcaster(
+        max_pending=app.config['SSE_MAX_PENDING'],
+        max_subscribers=app.config['SSE_MAX_SUBSCRIBERS'])
+    app.extensions['occupancy_broadcaster'] = broadcaster
+    parking_snapshot = listing.ParkingSnapshot(
+        ttl=app.config['PARKING_SNAPSHOT_TTL'])
+    app.extensions['parking_snapshot'] = parking_snapshot
+
+    plates.install_session_events()
+
+    reservation_index = reservations.ReservationIndex(
+        app.config['RESERVATION_HORIZON'], app.config['RESERVATION_EARLY'])
+    app.extensions['reservations'] = reservation_index
+
+    def prepare_to_serve():
+        with app.app_context():
+            migrations.check(db.engine)
+        for shard_engine in shard_router.engines if shard_router else []:
+            migrations.check(shard_engine)
+        # Entries are checked against the reservation index, so it is
+        # loaded before serving. Sharded, every shard has its own
+        if shard_router:
+            shards.sync_reservations(shard_router, datetime.datetime.now())
+        else:
+            with app.app_context():
+                reservation_index.sync(db.session, datetime.datetime.now())
+                db.session.remove()
+
+    if app.config['SCHEMA_CHECK'] and os.environ.get('FLASK_RUN_FROM_CLI'):
+        # Loaded by the flask command, which may be about to upgrade the
+        # schema. "flask run" checks it on the first request instead
+        prepared = []
+
+        @app.before_request
+        def prepare_on_first_request():
+            if not prepared:
+                prepare_to_serve()
+                prepared.append(True)
+    elif app.config['SCHEMA_CHECK']:
+        prepare_to_serve()
+
+    if app.config['METRICS_ENABLED']:
+        metrics.install(app)
+    compaction.install(app)
+    rollups.install(app)
+    billing.install(app)
+    importer.install(app)
+    export.install(app)
+    idempotency.install(app)
+    group_commit.install(app)
 
     @app.teardown_appcontext
     def shutdown_session(exception=None):
         db.session.remove()
 
+    @app.errorhandler(StaleDataError)
+    def concurrent_update(e):
+        # Clients carry a version, a write based on an outdated read of one
+        # is refused instead of overwriting the other request's change
+        db.session.rollback()
+        return jsonify(success=False,
+                       reason='Changed by another request, retry'), 409
+
+    # Everything recorded about a parking is in its shard when sharded
+    def parking_session(parking_id, read=True):
+        if shard_router:
+            return shard_router.session(parking_id)
+        return engine.read_session() if read else db.session
+
+    def parking_reservations(parking_id):
+        return shard_router.reservation_index(parking_id) if shard_router \
+            else reservation_index
+
+    def move(action, client_id, parking_id):
+        if shard_router:
+            return shards.move(shard_router, action, client_id, parking_id)
+        return group_commit.submit(action, client_id, parking_id)
+
     @app.route('/clients', methods=['GET'])
     def get_all_clients():
-        clients = db.session.query(Client).all()
-        client_list = [c.to_json() for c in clients]
+        car_number = request.args.get('car_number')
+        after_id = request.args.get('after_id', type=int)
+        limit = request.args.get('limit', type=int)
+        stream = request.args.get('stream', '').lower() in ('1', 'true')
 
-        return jsonify(client_list), 200
+        if limit is not None and limit <= 0:
+            return jsonify(success=False,
+                           reason='"limit" has to be positive'), 400
+
+        session = engine.read_session()
+        # The version is read before the rows, a write in between only
+        # makes the ETag older than the body and costs one more refetch
+        etag = etags.collection_etag(
+            etags.CLIENTS, etags.collection_version(session, versions),
+            request.args)
+        cached = etags.not_modified(etag)
+        if cached:
+            return cached
+
+        if car_number is not None:
+            plate = plates.normalize_plate(car_number)
+            clients = plates.find_clients(session, plate) \
+                if plate else []
+            response = jsonify([c.to_json() for c in clients])
+            response.set_etag(etag)
+            return response, 200
+
+        query = session.query(Client).order_by(Client.id)
+        if after_id is not None:
+            query = query.filter(Client.id > after_id)
+
+        if stream:
+            if limit is not None:
+                query = query.limit(limit)
+            rows = query.yield_per(CLIENTS_STREAM_CHUNK)
+            response = Response(stream_with_context(_iter_json_array(rows)),
+                                mimetype='application/json')
+            response.set_etag(etag)
+            return response, 200
+
+        if after_id is None and limit is None:
+            response = jsonify([c.to_json() for c in query.all()])
+            response.set_etag(etag)
+            return response, 200
+
+        limit = min(limit or CLIENTS_PAGE_LIMIT, CLIENTS_MAX_LIMIT)
+        clients = query.limit(limit).all()
+        response = jsonify([c.to_json() for c in clients])
+        response.set_etag(etag)
+        if len(clients) == limit:
+            next_page = url_for('get_all_clients',
+                                after_id=clients[-1].id, limit=limit)
+            response.headers['Link'] = f'<{next_page}>; rel="next"'
+
+        return response, 200
 
     @app.route('/clients/<int:client_id>', methods=['GET'])
     def get_client_by_id(client_id):
-        client = db.session.query(Client).filter(Client.id==client_id).first()
+        # A known version answers a matching If-None-Match without the DB
+        version = versions.get(('client', client_id))
+        if version is not None:
+            cached = etags.not_modified(etags.client_etag(client_id, version))
+            if cached:
+                return cached
+
+        client = engine.read_session().query(Client)\
+            .filter(Client.id==client_id).first()
+        if not client:
+            return jsonify(success=False,
+                           reason='Client doesn\'t exist'), 404
 
-        return client.to_json(), 200
+        versions.set(('client', client_id), client.version)
+        etag = etags.client_etag(client_id, client.version)
+        cached = etags.not_modified(etag)
+        if cached:
+            return cached
+        response = jsonify(client.to_json())
+        response.set_etag(etag)
+        return response, 200
+
+    @app.route('/clients/<int:client_id>/history', methods=['GET'])
+    def get_client_history(client_id):
+        try:
+            before, before_id, limit = history.parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        session = engine.read_session()
+        client = session.query(Client).get(client_id)
+        if not client:
+            return jsonify(success=False,
+                           reason='Client doesn\'t exist'), 404
+
+        if shard_router:
+            visits = shards.client_visits(shard_router, client_id, before,
+                                          before_id, limit)
+        else:
+            visits = history.client_visits(session, client_id, before,
+                                           before_id, limit)
+        response = jsonify(client=client.to_json(), visits=visits)
+        if len(visits) == limit:
+            next_page = url_for('get_client_history', client_id=client_id,
+                                limit=limit,
+                                **history.next_page_args(visits[-1]))
+            response.headers['Link'] = f'<{next_page}>; rel="next"'
+        return response, 200
 
     @app.route('/clients', methods=['POST'])
     def new_client():
@@ -39,12 +258,9 @@ def create_app():
         car_number = data.get('car_number')
         credit_card = data.get('credit_card')
 
-        if not name:
-            return jsonify(success=False,
-                           reason='Client has to have name'), 400
-        if not surname:
-            return jsonify(success=False,
-                           reason='Client has to have surname'), 400
+        reason = importer.client_rejection(data)
+        if reason:
+            return jsonify(success=False, reason=reason), 400
 
         client = Client(name=name,
                         surname=surname,
@@ -55,6 +271,49 @@ def create_app():
 
         return jsonify(success=True, added_client=client.to_json()), 201
 
+    @app.route('/clients/import', methods=['POST'])
+    def import_clients():
+        fmt = importer.FORMATS.get(request.mimetype) \
+            or request.args.get('format')
+        if fmt not in importer.PARSERS:
+            return jsonify(success=False,
+                           reason='Send CSV (text/csv) or NDJSON '
+                                  '(application/x-ndjson)'), 415
+
+        # The body is parsed line by line as it arrives, rows are inserted
+        # in batches and never held in memory all at once
+        report = importer.ImportReport()
+        importer.import_clients(
+            importer.PARSERS[fmt](request.stream, report), report,
+            batch_size=app.config['IMPORT_BATCH_SIZE'])
+        return jsonify(success=True, **report.to_json()), 200
+
+    @app.route('/parkings', methods=['GET'])
+    def get_all_parkings():
+        try:
+            opened, min_available, after_id, limit = \
+                listing.parse_listing_args(request.args)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        if parking_snapshot.expired():
+            # Reloaded from the primary like the availability cache
+            parking_snapshot.reload(
+                (lambda: shards.parking_rows(shard_router)) if shard_router
+                else (lambda: listing.parking_rows(db.session)))
+        parkings = parking_snapshot.page(opened, min_available, after_id,
+                                         limit)
+        response = jsonify(parkings)
+        if len(parkings) == limit:
+            filters = {name: request.args[name]
+                       for name in ('opened', 'min_available')
+                       if name in request.args}
+            next_page = url_for('get_all_parkings',
+                                after_id=parkings[-1]['id'], limit=limit,
+                                **filters)
+            response.headers['Link'] = f'<{next_page}>; rel="next"'
+        return response, 200
+
     @app.route('/parkings', methods=['POST'])
     def new_parking_zone():
         data = request.json
@@ -65,72 +324,229 @@ def create_app():
         if not address:
             return jsonify(success=False,
                            reason='Parking has to have address'), 400
-        parking_exists = db.session.query(Parking).filter(Parking.address==address).all()
-        if len(parking_exists) > 0:
-            return jsonify(success=False,
-                           reason='Already have parking with such address'), 400
-        if not count_places:
+        if not isinstance(count_places, int) or count_places <= 0:
             return jsonify(success=False,
                            reason='Parking has to have parking lots'), 400
 
-        parking = Parking(address=address,
-                          opened=opened,
-                          count_places=count_places,
-                          count_available_places=count_places)
-        db.session.add(parking)
-        db.session.commit()
+        if shard_router:
+            parking = shards.create_parking(shard_router, address, opened,
+                                            count_places)
+        else:
+            parking = Parking(address=address,
+                              opened=opened,
+                              count_places=count_places,
+                              count_available_places=count_places)
+            db.session.add(parking)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Address uniqueness is enforced by the unique index
+                db.session.rollback()
+                parking = None
+        if not parking:
+            return jsonify(success=False,
+                           reason='Already have parking with such address'), 400
+        parking_snapshot.add(parking.id, parking.address, parking.opened,
+                             parking.count_available_places)
+        gate.publish_occupancy([(parking.id, parking.count_available_places,
+                                 parking.opened, parking.version)])
 
         return jsonify(success=True, added_parking_zone=parking.to_json()), 201
 
-    @app.route('/client_parkings', methods=['POST'])
-    def enter_parking():
-        parking_request = request.json
-        client_id = parking_request.get('client_id')
-        parking_id = parking_request.get('parking_id')
+    @app.route('/parkings/<int:parking_id>', methods=['PATCH'])
+    def update_parking_zone(parking_id):
+        opened = (request.json or {}).get('opened')
+        if not isinstance(opened, bool):
+            return jsonify(success=False,
+                           reason='"opened" has to be true or false'), 400
 
-        if not client_id:
+        session = parking_session(parking_id, read=False)
+        parking = session.query(Parking).get(parking_id)
+        if not parking:
             return jsonify(success=False,
-                           reason='Need to specify "client_id" parameter'), 400
-        if not parking_id:
+                           reason='Parking doesn\'t exist'), 404
+
+        parking.opened = opened
+        parking.version = Parking.version + 1
+        session.flush()
+        occupancy = gate.current_occupancy(session, [parking_id])
+        session.commit()
+        gate.publish_occupancy(occupancy)
+
+        return jsonify(success=True, parking_zone=parking.to_json()), 200
+
+    def _event_stream(parking_id):
+        subscription = broadcaster.subscribe(parking_id)
+        if subscription is None:
             return jsonify(success=False,
-                           reason='Need to specify "parking_id" parameter'), 400
+                           reason='Too many subscribers, retry later'), 503
+
+        # Subscribed before the snapshot is read, a change in between is
+        # sent twice rather than lost. Read from the primary, the values
+        # are cached and a lagging replica would pin old counts
+        try:
+            rows = shards.occupancy_rows(shard_router, parking_id) \
+                if shard_router \
+                else listing.occupancy_rows(db.session, parking_id)
+            snapshot = [availability.set(*occupancy) for occupancy in rows]
+        except Exception:
+            broadcaster.unsubscribe(subscription)
+            raise
+        if parking_id is not None and not snapshot:
+            broadcaster.unsubscribe(subscription)
+            return jsonify(success=False,
+                           reason='Parking doesn\'t exist'), 404
+
+        response = Response(broadcast.stream(broadcaster, subscription,
+                                             snapshot,
+                                             app.config['SSE_HEARTBEAT']),
+                            mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    @app.route('/parkings/events', methods=['GET'])
+    def get_parkings_events():
+        return _event_stream(None)
+
+    @app.route('/parkings/<int:parking_id>/availability', methods=['GET'])
+    def get_parking_availability(parking_id):
+        cached = availability.get(parking_id)
+        if cached is not None:
+            return jsonify(cached), 200
+
+        # The value is cached, so it comes from the primary rather than
+        # a replica that may lag behind the last write
+        session = parking_session(parking_id, read=False)
+        occupancy = session\
+            .query(Parking.count_available_places, Parking.opened,
+                   Parking.version)\
+            .filter(Parking.id == parking_id).first()
+        if not occupancy:
+            return jsonify(success=False,
+                           reason='Parking doesn\'t exist'), 404
+
+        return jsonify(availability.set(parking_id, *occupancy)), 200
 
-        parking = db.session.query(Parking).get(parking_id)
+    @app.route('/parkings/<int:parking_id>/events', methods=['GET'])
+    def get_parking_events(parking_id):
+        return _event_stream(parking_id)
+
+    @app.route('/parkings/<int:parking_id>/stats', methods=['GET'])
+    def get_parking_stats(parking_id):
+        now = datetime.datetime.now()
+        try:
+            start, end, bucket = rollups.parse_stats_args(request.args, now)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        session = parking_session(parking_id)
+        parking = session.query(Parking).get(parking_id)
         if not parking:
             return jsonify(success=False,
                            reason='Parking doesn\'t exist'), 404
-        if not parking.opened:
-            return jsonify(success=False, reason='Parking is closed'), 409
-        if parking.count_available_places == 0:
-            return jsonify(success=False, reason='Parking is full'), 409
 
-        client = db.session.query(Client).get(client_id)
-        if not client:
+        stats = rollups.parking_stats(session, parking, start, end, bucket,
+                                      now)
+        return jsonify(parking_id=parking_id, bucket=bucket,
+                       stats=stats), 200
+
+    @app.route('/parkings/<int:parking_id>/reservations', methods=['POST'])
+    def new_reservation(parking_id):
+        data = request.json or {}
+        client_id = data.get('client_id')
+        now = datetime.datetime.now()
+
+        if not client_id:
             return jsonify(success=False,
-                           reason='Client doesn\'t exist'), 404
-        if not client.car_number:
+                           reason='Need to specify "client_id" parameter'), 400
+        try:
+            starts_at, ends_at = reservations.parse_reservation(data, now)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        result, status = reservations.reserve(
+            parking_session(parking_id, read=False),
+            parking_reservations(parking_id), parking_id, client_id,
+            starts_at, ends_at, now, client_session=db.session)
+        return jsonify(result), status
+
+    @app.route('/parkings/<int:parking_id>/reservations', methods=['GET'])
+    def get_reservations(parking_id):
+        now = datetime.datetime.now()
+        try:
+            start, end = reservations.parse_window(request.args, now)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        session = parking_session(parking_id)
+        parking = session.query(Parking).get(parking_id)
+        if not parking:
             return jsonify(success=False,
-                           reason='Cannot enter parking without car'), 409
+                           reason='Parking doesn\'t exist'), 404
 
-        client_on_parking = db.session.query(ClientParking)\
-            .filter(ClientParking.client_id == client_id)\
-            .filter(ClientParking.parking_id == parking_id)\
-            .filter(ClientParking.time_out == None).all()
-        if len(client_on_parking) > 0:
+        booked = reservations.reservations_in(session, parking_id, start,
+                                              end)
+        return jsonify({'parking_id': parking_id, 'from': start, 'to': end,
+                        'available_places': reservations.free_places(
+                            parking_reservations(parking_id), parking, start,
+                            end, now),
+                        'reservations': [r.to_json() for r in booked]}), 200
+
+    @app.route('/parkings/<int:parking_id>/sessions', methods=['GET'])
+    def get_parking_sessions(parking_id):
+        open_only = request.args.get('open', '').lower() in ('1', 'true')
+        try:
+            before, before_id, limit = history.parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        session = parking_session(parking_id)
+        parking = session.query(Parking).get(parking_id)
+        if not parking:
             return jsonify(success=False,
-                           reason='This client is already at this parking'), 409
+                           reason='Parking doesn\'t exist'), 404
 
-        parking.count_available_places -= 1
-        parking_log = ClientParking(client_id=client_id,
-                                    parking_id=parking_id,
-                                    time_in=datetime.datetime.now())
-        db.session.add(parking_log)
-        db.session.commit()
+        if shard_router:
+            sessions = shards.parking_sessions(shard_router, parking_id,
+                                               before, before_id, limit,
+                                               open_only)
+        else:
+            sessions = history.parking_sessions(session, parking_id, before,
+                                                before_id, limit, open_only)
+        response = jsonify(parking=parking.to_json(), sessions=sessions)
+        if len(sessions) == limit:
+            next_page = url_for('get_parking_sessions', parking_id=parking_id,
+                                limit=limit,
+                                **history.next_page_args(sessions[-1]),
+                                **({'open': 'true'} if open_only else {}))
+            response.headers['Link'] = f'<{next_page}>; rel="next"'
+        return response, 200
+
+    @app.route('/client_parkings', methods=['POST'])
+    @idempotency.idempotent
+    def enter_parking():
+        parking_request = request.json
+        client_id = parking_request.get('client_id')
+        parking_id = parking_request.get('parking_id')
 
-        return jsonify(success=True, parking_log=parking_log.to_json()), 201
+        if not client_id:
+            return jsonify(success=False,
+                           reason='Need to specify "client_id" parameter'), 400
+        if not parking_id:
+            return jsonify(success=False,
+                           reason='Need to specify "parking_id" parameter'), 400
+        try:
+            client_id = gate.parse_id(client_id, 'client_id')
+            parking_id = gate.parse_id(parking_id, 'parking_id')
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
 
+        result, status = move('enter', client_id, parking_id)
+        return jsonify(result), status
 
     @app.route('/client_parkings', methods=['DELETE'])
+    @idempotency.idempotent
     def leave_parking():
         client_id = request.json.get('client_id')
         parking_id = request.json.get('parking_id')
@@ -140,32 +556,100 @@ def create_app():
         if not parking_id:
             return jsonify(success=False,
                            reason='Need to specify parking_id'), 400
-
-        parking_log = db.session.query(ClientParking)\
-            .filter(ClientParking.client_id==client_id)\
-            .filter(ClientParking.parking_id==parking_id)\
-            .filter(ClientParking.time_out==None)\
-            .all()
-        if len(parking_log) == 0:
+        try:
+            client_id = gate.parse_id(client_id, 'client_id')
+            parking_id = gate.parse_id(parking_id, 'parking_id')
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        result, status = move('leave', client_id, parking_id)
+        return jsonify(result), status
+
+    @app.route('/client_parkings/export', methods=['GET'])
+    def export_client_parkings():
+        try:
+            start, end, fmt = export.parse_export_args(request.args)
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+        if fmt == 'parquet' and export.pyarrow is None:
             return jsonify(success=False,
-                           reason='Cannot find parking log'), 404
-
-        client = db.session.query(Client).get(client_id)
-        if not client:
+                           reason='Parquet export requires pyarrow'), 501
+
+        # Rows are read, encoded and sent a chunk at a time, memory doesn't
+        # depend on the date range
+        chunk_size = app.config['EXPORT_CHUNK_SIZE']
+        chunks = export.sharded_chunks(shard_router, start, end, chunk_size) \
+            if shard_router \
+            else export.iter_chunks(engine.read_session(),
+                                    export.export_queries(start, end),
+                                    chunk_size)
+        response = Response(stream_with_context(export.WRITERS[fmt](chunks)),
+                            mimetype=export.FORMATS[fmt])
+        response.headers['Content-Disposition'] = \
+            f'attachment; filename=parking-log.{fmt}'
+        return response, 200
+
+    @app.route('/client_parkings/by_plate', methods=['POST'])
+    def parking_by_plate():
+        data = request.json or {}
+        plate = plates.normalize_plate(data.get('car_number'))
+        parking_id = data.get('parking_id')
+        action = data.get('action', 'enter')
+
+        if not plate:
             return jsonify(success=False,
-                           reason='Cannot find client with this client_id'), 404
-        if not client.credit_card:
+                           reason='Need to specify "car_number" parameter'), 400
+        if not parking_id:
             return jsonify(success=False,
-                           reason='No credit card added, cannot process payment'), 402
-
-        parking = db.session.query(Parking).get(parking_id)
-        parking.count_available_places += 1
-
-        log_entry = parking_log[0]
-        log_entry.time_out = datetime.datetime.now()
-        db.session.commit()
+                           reason='Need to specify "parking_id" parameter'), 400
+        if action not in ('enter', 'leave'):
+            return jsonify(success=False,
+                           reason='Action has to be "enter" or "leave"'), 400
+        try:
+            parking_id = gate.parse_id(parking_id, 'parking_id')
+        except ValueError as e:
+            return jsonify(success=False, reason=str(e)), 400
+
+        clients = plates.find_clients(db.session, plate)
+        if not clients:
+            return jsonify(success=False,
+                           reason='No client with this car number'), 404
+        if len(clients) > 1:
+            return jsonify(success=False,
+                           reason='Several clients have this car number'), 409
+
+        # The client is already in the session, the gate doesn't load it again
+        if shard_router:
+            result, status = shards.move(shard_router, action, clients[0].id,
+                                         parking_id)
+        elif action == 'enter':
+            result, status = gate.enter(clients[0].id, parking_id,
+                                        reservation_index)
+        else:
+            result, status = gate.leave(clients[0].id, parking_id)
+        return jsonify(result), status
+
+    @app.route('/client_parkings/batch', methods=['POST'])
+    def batch_parking_events():
+        events = (request.json or {}).get('events')
+        if not isinstance(events, list) or not events:
+            return jsonify(success=False,
+                           reason='Need to specify "events" list'), 400
+        if len(events) > gate.BATCH_MAX_EVENTS:
+            return jsonify(success=False,
+                           reason='Too many events in one batch'), 400
 
-        return jsonify(success=True, parking_log=log_entry.to_json()), 200
+        if shard_router:
+            results = shards.apply_events(shard_router, events)
+        else:
+            results = gate.apply_events(events, reservation_index)
+        if results is None:
+            return jsonify(success=False,
+                           reason='Batch conflicted with concurrent '
+                                  'updates, retry it'), 409
 
+        return jsonify(success=True,
+                       results=[dict(result, status=status)
+                                for result, status in results]), 200
 
     return app
\ No newline at end of file
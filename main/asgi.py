@@ -0,0 +1,851 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from werkzeug.datastructures import MultiDict
+from werkzeug.utils import get_content_type
+
+from . import broadcast, engine, etags, export, gate, history, idempotency, \
+    importer, listing, migrations, plates, reservations, rollups
+from .app import CLIENTS_MAX_LIMIT, CLIENTS_PAGE_LIMIT, CLIENTS_STREAM_CHUNK
+from .cache import AvailabilityCache
+from .models import Client, Parking
+from .serializers import http_date
+
+
+def _default(o):
+    if isinstance(o, datetime.date):
+        return http_date(o)
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def _dumps(obj):
+    # Matches the Flask JSON provider: sorted keys, compact separators
+    return json.dumps(obj, default=_default, sort_keys=True,
+                      separators=(',', ':'))
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    if url.drivername == 'sqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+        # Flask-SQLAlchemy resolves relative SQLite paths against the app root
+        if url.database and url.database != ':memory:' \
+                and not os.path.isabs(url.database):
+            url = url.set(database=os.path.join(os.path.dirname(__file__),
+                                                url.database))
+    return url
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        # Parsed like Flask's request.args, so the same parsers take them
+        self.args = MultiDict(parse_qsl(
+            scope.get('query_string', b'').decode(), keep_blank_values=True))
+        self.headers = {key.decode().lower(): value.decode()
+                        for key, value in scope.get('headers', [])}
+        self.body = body
+
+    @property
+    def mimetype(self):
+        return self.headers.get('content-type', '').split(';')[0]\
+            .strip().lower()
+
+    @property
+    def json(self):
+        if 'json' not in self.headers.get('content-type', '') or not self.body:
+            return None
+        return json.loads(self.body)
+
+    def arg_int(self, name):
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return None
+
+
+class JSONResponse:
+    def __init__(self, payload, status=200, headers=None, body=None):
+        # ``body`` is a payload serialized already, like a stored response
+        self.body = (_dumps(payload) + '\n' if body is None
+                     else body).encode()
+        self.status = status
+        self.headers = headers or {}
+
+    async def __call__(self, send, receive=None):
+        headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(self.body)).encode())]
+        headers += [(k.lower().encode(), v.encode())
+                    for k, v in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class StreamingResponse:
+    def __init__(self, chunks, status=200, content_type='application/json',
+                 headers=None):
+        self.chunks = chunks
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    async def __call__(self, send, receive=None):
+        headers = [(b'content-type', self.content_type.encode())]
+        headers += [(k.lower().encode(), v.encode())
+                    for k, v in self.headers.items()]
+        # Servers don't fail writes to a client that went away, the stream
+        # stops at the first chunk after the disconnect
+        disconnect = asyncio.ensure_future(_disconnected(receive)) \
+            if receive is not None else None
+        try:
+            await send({'type': 'http.response.start', 'status': self.status,
+                        'headers': headers})
+            async for chunk in self.chunks:
+                if disconnect is not None and disconnect.done():
+                    return
+                await send({'type': 'http.response.body',
+                            'body': chunk if isinstance(chunk, bytes)
+                            else chunk.encode(),
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if disconnect is not None:
+                disconnect.cancel()
+            await self.chunks.aclose()
+
+
+def _failure(reason, status):
+    return JSONResponse({'success': False, 'reason': reason}, status)
+
+
+def _stored(entry, request_fingerprint):
+    # A response given before to a request with the same key
+    if entry[0] != request_fingerprint:
+        return _failure(idempotency.REUSED_REASON, 422)
+    return JSONResponse(None, entry[1], {'Idempotent-Replayed': 'true'},
+                        body=entry[2])
+
+
+class AsyncApp:
+    def __init__(self, config):
+        self.config = config
+        # The pragmas and pool settings of the Flask app's engine; aiosqlite
+        # hands connect_args, the connection factory too, to sqlite3
+        options = engine.primary_options(config)
+        if options.get('poolclass') is QueuePool:
+            options['poolclass'] = AsyncAdaptedQueuePool
+        self.engine = create_async_engine(
+            async_database_uri(config['SQLALCHEMY_DATABASE_URI']), **options)
+        self.session_factory = sessionmaker(self.engine, class_=AsyncSession,
+                                            expire_on_commit=False)
+        self.availability = AvailabilityCache(
+            ttl=config['AVAILABILITY_CACHE_TTL'])
+        # Loaded by the first entry, which syncs it like every other one
+        self.reservations = reservations.ReservationIndex(
+            config['RESERVATION_HORIZON'], config['RESERVATION_EARLY'])
+        # Orders bookings of this app. The index's own booking lock would
+        # block the event loop while another booking awaits the database
+        self.booking = asyncio.Lock()
+        self.broadcaster = broadcast.OccupancyBroadcaster(
+            max_pending=config['SSE_MAX_PENDING'],
+            max_subscribers=config['SSE_MAX_SUBSCRIBERS'])
+        self.parking_snapshot = listing.ParkingSnapshot(
+            ttl=config['PARKING_SNAPSHOT_TTL'])
+        # Shares the idempotency_key table with the Flask app, so a retry
+        # is answered whichever app gets it
+        self.idempotency = idempotency.IdempotencyStore(
+            config['IDEMPOTENCY_CACHE_SIZE'], event=asyncio.Event)
+        etags.install_session_events()
+        plates.install_session_events()
+        self.routes = [
+            ('GET', r'/clients', self.get_all_clients),
+            ('GET', r'/clients/(?P<client_id>\d+)', self.get_client_by_id),
+            ('GET', r'/clients/(?P<client_id>\d+)/history',
+             self.get_client_history),
+            ('POST', r'/clients', self.new_client),
+            ('POST', r'/clients/import', self.import_clients),
+            ('GET', r'/parkings', self.get_all_parkings),
+            ('POST', r'/parkings', self.new_parking_zone),
+            ('PATCH', r'/parkings/(?P<parking_id>\d+)',
+             self.update_parking_zone),
+            ('GET', r'/parkings/events', self.get_parkings_events),
+            ('GET', r'/parkings/(?P<parking_id>\d+)/availability',
+             self.get_parking_availability),
+            ('GET', r'/parkings/(?P<parking_id>\d+)/events',
+             self.get_parking_events),
+            ('GET', r'/parkings/(?P<parking_id>\d+)/stats',
+             self.get_parking_stats),
+            ('POST', r'/parkings/(?P<parking_id>\d+)/reservations',
+             self.new_reservation),
+            ('GET', r'/parkings/(?P<parking_id>\d+)/reservations',
+             self.get_reservations),
+            ('GET', r'/parkings/(?P<parking_id>\d+)/sessions',
+             self.get_parking_sessions),
+            ('POST', r'/client_parkings',
+             self._idempotent(self.enter_parking)),
+            ('DELETE', r'/client_parkings',
+             self._idempotent(self.leave_parking)),
+            ('GET', r'/client_parkings/export', self.export_client_parkings),
+            ('POST', r'/client_parkings/by_plate', self.parking_by_plate),
+            ('POST', r'/client_parkings/batch', self.batch_parking_events),
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), handler)
+                       for method, pattern, handler in self.routes]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        request = Request(scope, body)
+
+        handler, params, allowed = self.match(request.method, request.path)
+        if handler is not None:
+            async with self.session_factory() as session:
+                response = await handler(request, session, **params)
+                await response(send, receive)
+            return
+
+        status = 405 if allowed else 404
+        await JSONResponse({'success': False,
+                            'reason': 'Method Not Allowed' if allowed
+                            else 'Not Found'}, status)(send)
+
+    def match(self, method, path):
+        # (handler, params, path matched some route)
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if not match:
+                continue
+            allowed = True
+            if route_method == method:
+                return handler, {key: int(value) for key, value
+                                 in match.groupdict().items()}, True
+        return None, {}, allowed
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.config['SCHEMA_CHECK']:
+                        async with self.engine.connect() as connection:
+                            migrations.check_version(await connection.run_sync(
+                                migrations.current_version))
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _idempotent(self, handler):
+        # The Idempotency-Key contract of idempotency.idempotent
+        async def wrapper(request, session, **params):
+            key = request.headers.get('idempotency-key')
+            if key is None:
+                return await handler(request, session, **params)
+            if not key or len(key) > idempotency.IDEMPOTENCY_KEY_MAX:
+                return _failure(idempotency.KEY_LENGTH_REASON, 400)
+            return await self._handle_idempotent(key, handler, request,
+                                                 session, params)
+        return wrapper
+
+    async def _handle_idempotent(self, key, handler, request, session,
+                                 params):
+        store = self.idempotency
+        request_fingerprint = idempotency.request_fingerprint(
+            request.method, request.path, request.body)
+        deadline = time.monotonic() + self.config['IDEMPOTENCY_WAIT']
+
+        while True:
+            entry = store.get(key)
+            if entry is not None:
+                return _stored(entry, request_fingerprint)
+            first = store.start(key)
+            if first is None:
+                break
+            # A duplicate in this process, the first request answers for both
+            try:
+                await asyncio.wait_for(first.wait(),
+                                       max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                return _failure(idempotency.IN_FLIGHT_REASON, 409)
+
+        try:
+            if not await session.run_sync(
+                    lambda sync_session: idempotency.claim(
+                        sync_session, key, request_fingerprint,
+                        self.config['IDEMPOTENCY_LEASE'])):
+                # Claimed by another process
+                while True:
+                    entry = await session.run_sync(
+                        lambda sync_session: idempotency.stored_entry(
+                            sync_session, store, key))
+                    if entry is None:
+                        return _failure(idempotency.IN_FLIGHT_REASON, 409)
+                    if entry[0] != request_fingerprint \
+                            or entry[1] is not None:
+                        return _stored(entry, request_fingerprint)
+                    if time.monotonic() >= deadline:
+                        return _failure(idempotency.IN_FLIGHT_REASON, 409)
+                    await asyncio.sleep(idempotency.IDEMPOTENCY_POLL)
+                    session.expire_all()
+
+            try:
+                response = await handler(request, session, **params)
+            except Exception:
+                await session.run_sync(
+                    lambda sync_session: idempotency.release(sync_session,
+                                                             key))
+                raise
+
+            body = response.body.decode()
+            await session.run_sync(
+                lambda sync_session: idempotency.record(
+                    sync_session, key, response.status, body))
+            store.remember(key, request_fingerprint, response.status, body)
+            return response
+        finally:
+            store.finish(key)
+
+    def _publish(self, occupancy):
+        # gate.publish_occupancy for the caches and streams of this app
+        for parking_id, count_available_places, opened, version \
+                in occupancy:
+            change = self.availability.update(parking_id,
+                                              count_available_places,
+                                              opened, version)
+            if change is not None:
+                self.parking_snapshot.update(parking_id,
+                                             count_available_places, opened)
+                self.broadcaster.publish(change)
+
+    async def get_all_clients(self, request, session):
+        after_id = request.arg_int('after_id')
+        limit = request.arg_int('limit')
+        stream = request.args.get('stream', '').lower() in ('1', 'true')
+
+        if limit is not None and limit <= 0:
+            return _failure('"limit" has to be positive', 400)
+
+        car_number = request.args.get('car_number')
+        if car_number is not None:
+            plate = plates.normalize_plate(car_number)
+            clients = await session.run_sync(
+                lambda sync_session: plates.find_clients(sync_session, plate)) \
+                if plate else []
+            return JSONResponse([c.to_json() for c in clients])
+
+        query = select(Client).order_by(Client.id)
+        if after_id is not None:
+            query = query.filter(Client.id > after_id)
+
+        if stream:
+            if limit is not None:
+                query = query.limit(limit)
+            result = await session.stream(query.execution_options(
+                yield_per=CLIENTS_STREAM_CHUNK))
+            return StreamingResponse(self._iter_json_array(result.scalars()))
+
+        if after_id is None and limit is None:
+            clients = (await session.execute(query)).scalars()
+            return JSONResponse([c.to_json() for c in clients])
+
+        limit = min(limit or CLIENTS_PAGE_LIMIT, CLIENTS_MAX_LIMIT)
+        clients = (await session.execute(query.limit(limit))).scalars().all()
+        headers = {}
+        if len(clients) == limit:
+            next_page = urlencode({'after_id': clients[-1].id, 'limit': limit})
+            headers['Link'] = f'</clients?{next_page}>; rel="next"'
+        return JSONResponse([c.to_json() for c in clients], headers=headers)
+
+    @staticmethod
+    async def _iter_json_array(items):
+        yield '['
+        first = True
+        async for item in items:
+            yield ('' if first else ',') + _dumps(item.to_json())
+            first = False
+        yield ']'
+
+    async def get_client_by_id(self, request, session, client_id):
+        client = await session.get(Client, client_id)
+        if not client:
+            return _failure('Client doesn\'t exist', 404)
+        return JSONResponse(client.to_json())
+
+    async def get_client_history(self, request, session, client_id):
+        try:
+            before, before_id, limit = history.parse_page_args(request.args)
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        client = await session.get(Client, client_id)
+        if not client:
+            return _failure('Client doesn\'t exist', 404)
+
+        visits = await session.run_sync(
+            lambda sync_session: history.client_visits(
+                sync_session, client_id, before, before_id, limit))
+        headers = {}
+        if len(visits) == limit:
+            next_page = urlencode(dict(
+                {'limit': limit}, **history.next_page_args(visits[-1])))
+            headers['Link'] = \
+                f'</clients/{client_id}/history?{next_page}>; rel="next"'
+        return JSONResponse({'client': client.to_json(), 'visits': visits},
+                            headers=headers)
+
+    async def new_client(self, request, session):
+        data = request.json or {}
+        reason = importer.client_rejection(data)
+        if reason:
+            return _failure(reason, 400)
+
+        client = Client(name=data['name'],
+                        surname=data['surname'],
+                        car_number=data.get('car_number'),
+                        credit_card=data.get('credit_card'))
+        session.add(client)
+        await session.commit()
+
+        return JSONResponse({'success': True,
+                             'added_client': client.to_json()}, 201)
+
+    async def import_clients(self, request, session):
+        fmt = importer.FORMATS.get(request.mimetype) \
+            or request.args.get('format')
+        if fmt not in importer.PARSERS:
+            return _failure('Send CSV (text/csv) or NDJSON '
+                            '(application/x-ndjson)', 415)
+
+        # The ASGI app has the whole body already, it is still parsed and
+        # inserted in batches
+        report = importer.ImportReport()
+        await session.run_sync(
+            lambda sync_session: importer.import_clients(
+                importer.PARSERS[fmt](io.BytesIO(request.body), report),
+                report, sync_session,
+                batch_size=self.config['IMPORT_BATCH_SIZE']))
+        return JSONResponse(dict({'success': True}, **report.to_json()))
+
+    async def new_parking_zone(self, request, session):
+        data = request.json or {}
+        address = data.get('address')
+        count_places = data.get('count_places')
+
+        if not address:
+            return _failure('Parking has to have address', 400)
+        if not isinstance(count_places, int) or count_places <= 0:
+            return _failure('Parking has to have parking lots', 400)
+
+        parking = Parking(address=address,
+                          opened=data.get('opened', True),
+                          count_places=count_places,
+                          count_available_places=count_places)
+        session.add(parking)
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return _failure('Already have parking with such address', 400)
+        self.parking_snapshot.add(parking.id, parking.address,
+                                  parking.opened,
+                                  parking.count_available_places)
+        self._publish([(parking.id, parking.count_available_places,
+                        parking.opened, parking.version)])
+
+        return JSONResponse({'success': True,
+                             'added_parking_zone': parking.to_json()}, 201)
+
+    async def update_parking_zone(self, request, session, parking_id):
+        opened = (request.json or {}).get('opened')
+        if not isinstance(opened, bool):
+            return _failure('"opened" has to be true or false', 400)
+
+        def update(sync_session):
+            parking = sync_session.query(Parking).get(parking_id)
+            if not parking:
+                return None, None
+            parking.opened = opened
+            parking.version = Parking.version + 1
+            sync_session.flush()
+            occupancy = gate.current_occupancy(sync_session, [parking_id])
+            sync_session.commit()
+            return parking.to_json(), occupancy
+
+        parking, occupancy = await session.run_sync(update)
+        if not parking:
+            return _failure('Parking doesn\'t exist', 404)
+        self._publish(occupancy)
+
+        return JSONResponse({'success': True, 'parking_zone': parking})
+
+    async def get_all_parkings(self, request, session):
+        try:
+            opened, min_available, after_id, limit = \
+                listing.parse_listing_args(request.args)
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        if self.parking_snapshot.expired():
+            await session.run_sync(
+                lambda sync_session: self.parking_snapshot.reload(
+                    lambda: listing.parking_rows(sync_session)))
+        parkings = self.parking_snapshot.page(opened, min_available,
+                                              after_id, limit)
+        headers = {}
+        if len(parkings) == limit:
+            filters = {name: request.args[name]
+                       for name in ('opened', 'min_available')
+                       if name in request.args}
+            next_page = urlencode(dict({'after_id': parkings[-1]['id'],
+                                        'limit': limit}, **filters))
+            headers['Link'] = f'</parkings?{next_page}>; rel="next"'
+        return JSONResponse(parkings, headers=headers)
+
+    async def _event_stream(self, session, parking_id):
+        subscription = self.broadcaster.subscribe(parking_id,
+                                                  asyncio.get_running_loop())
+        if subscription is None:
+            return _failure('Too many subscribers, retry later', 503)
+
+        # Subscribed before the snapshot is read, as in the Flask app
+        try:
+            rows = await session.run_sync(
+                lambda sync_session: listing.occupancy_rows(sync_session,
+                                                            parking_id))
+            snapshot = [self.availability.set(*occupancy)
+                        for occupancy in rows]
+        except Exception:
+            self.broadcaster.unsubscribe(subscription)
+            raise
+        if parking_id is not None and not snapshot:
+            self.broadcaster.unsubscribe(subscription)
+            return _failure('Parking doesn\'t exist', 404)
+        # An open stream holds no database connection
+        await session.close()
+
+        return StreamingResponse(
+            broadcast.async_stream(self.broadcaster, subscription, snapshot,
+                                   self.config['SSE_HEARTBEAT']),
+            content_type=get_content_type('text/event-stream', 'utf-8'),
+            headers={'Cache-Control': 'no-cache',
+                     'X-Accel-Buffering': 'no'})
+
+    async def get_parkings_events(self, request, session):
+        return await self._event_stream(session, None)
+
+    async def get_parking_events(self, request, session, parking_id):
+        return await self._event_stream(session, parking_id)
+
+    async def get_parking_availability(self, request, session, parking_id):
+        cached = self.availability.get(parking_id)
+        if cached is not None:
+            return JSONResponse(cached)
+
+        occupancy = (await session.execute(
+            select(Parking.count_available_places, Parking.opened,
+                   Parking.version)
+            .filter(Parking.id == parking_id))).first()
+        if not occupancy:
+            return _failure('Parking doesn\'t exist', 404)
+
+        return JSONResponse(self.availability.set(parking_id, *occupancy))
+
+    async def get_parking_stats(self, request, session, parking_id):
+        now = datetime.datetime.now()
+        try:
+            start, end, bucket = rollups.parse_stats_args(request.args, now)
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        parking = await session.get(Parking, parking_id)
+        if not parking:
+            return _failure('Parking doesn\'t exist', 404)
+
+        stats = await session.run_sync(
+            lambda sync_session: rollups.parking_stats(
+                sync_session, parking, start, end, bucket, now))
+        return JSONResponse({'parking_id': parking_id, 'bucket': bucket,
+                             'stats': stats})
+
+    async def new_reservation(self, request, session, parking_id):
+        data = request.json or {}
+        client_id = data.get('client_id')
+        now = datetime.datetime.now()
+
+        if not client_id:
+            return _failure('Need to specify "client_id" parameter', 400)
+        try:
+            starts_at, ends_at = reservations.parse_reservation(data, now)
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        async with self.booking:
+            result, status = await session.run_sync(
+                lambda sync_session: reservations.reserve(
+                    sync_session, self.reservations, parking_id, client_id,
+                    starts_at, ends_at, now))
+        return JSONResponse(result, status)
+
+    async def get_reservations(self, request, session, parking_id):
+        now = datetime.datetime.now()
+        try:
+            start, end = reservations.parse_window(request.args, now)
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        parking = await session.get(Parking, parking_id)
+        if not parking:
+            return _failure('Parking doesn\'t exist', 404)
+
+        def read(sync_session):
+            # The index is loaded lazily here, not before serving
+            self.reservations.sync(sync_session, now)
+            return [r.to_json() for r in reservations.reservations_in(
+                sync_session, parking_id, start, end)]
+
+        booked = await session.run_sync(read)
+        return JSONResponse({'parking_id': parking_id, 'from': start,
+                             'to': end,
+                             'available_places': reservations.free_places(
+                                 self.reservations, parking, start, end,
+                                 now),
+                             'reservations': booked})
+
+    async def get_parking_sessions(self, request, session, parking_id):
+        open_only = request.args.get('open', '').lower() in ('1', 'true')
+        try:
+            before, before_id, limit = history.parse_page_args(request.args)
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        parking = await session.get(Parking, parking_id)
+        if not parking:
+            return _failure('Parking doesn\'t exist', 404)
+
+        sessions = await session.run_sync(
+            lambda sync_session: history.parking_sessions(
+                sync_session, parking_id, before, before_id, limit,
+                open_only))
+        headers = {}
+        if len(sessions) == limit:
+            next_page = urlencode(dict(
+                {'limit': limit}, **history.next_page_args(sessions[-1]),
+                **({'open': 'true'} if open_only else {})))
+            headers['Link'] = \
+                f'</parkings/{parking_id}/sessions?{next_page}>; rel="next"'
+        return JSONResponse({'parking': parking.to_json(),
+                             'sessions': sessions}, headers=headers)
+
+    async def enter_parking(self, request, session):
+        data = request.json or {}
+        client_id = data.get('client_id')
+        parking_id = data.get('parking_id')
+
+        if not client_id:
+            return _failure('Need to specify "client_id" parameter', 400)
+        if not parking_id:
+            return _failure('Need to specify "parking_id" parameter', 400)
+        try:
+            client_id = gate.parse_id(client_id, 'client_id')
+            parking_id = gate.parse_id(parking_id, 'parking_id')
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        # The gate logic is shared with the Flask app and runs on the sync
+        # facade of the async session
+        result, status = await session.run_sync(
+            lambda sync_session: gate.enter(client_id, parking_id,
+                                            self.reservations, sync_session,
+                                            self._publish))
+        return JSONResponse(result, status)
+
+    async def leave_parking(self, request, session):
+        data = request.json or {}
+        client_id = data.get('client_id')
+        parking_id = data.get('parking_id')
+
+        if not client_id:
+            return _failure('Need to specify client_id', 400)
+        if not parking_id:
+            return _failure('Need to specify parking_id', 400)
+        try:
+            client_id = gate.parse_id(client_id, 'client_id')
+            parking_id = gate.parse_id(parking_id, 'parking_id')
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        result, status = await session.run_sync(
+            lambda sync_session: gate.leave(client_id, parking_id,
+                                            sync_session, self._publish))
+        return JSONResponse(result, status)
+
+    async def export_client_parkings(self, request, session):
+        try:
+            start, end, fmt = export.parse_export_args(request.args)
+        except ValueError as e:
+            return _failure(str(e), 400)
+        if fmt == 'parquet' and export.pyarrow is None:
+            return _failure('Parquet export requires pyarrow', 501)
+
+        chunks = export.WRITERS[fmt](export.iter_chunks(
+            session.sync_session, export.export_queries(start, end),
+            self.config['EXPORT_CHUNK_SIZE']))
+        return StreamingResponse(
+            self._iter_sync(session, chunks),
+            content_type=get_content_type(export.FORMATS[fmt], 'utf-8'),
+            headers={'Content-Disposition':
+                     f'attachment; filename=parking-log.{fmt}'})
+
+    @staticmethod
+    async def _iter_sync(session, chunks):
+        # Advances a generator over the sync facade a chunk at a time,
+        # the loop serves other requests between chunks
+        end = object()
+        try:
+            while True:
+                chunk = await session.run_sync(lambda _: next(chunks, end))
+                if chunk is end:
+                    return
+                yield chunk
+        finally:
+            await session.run_sync(lambda _: chunks.close())
+
+    async def parking_by_plate(self, request, session):
+        data = request.json or {}
+        plate = plates.normalize_plate(data.get('car_number'))
+        parking_id = data.get('parking_id')
+        action = data.get('action', 'enter')
+
+        if not plate:
+            return _failure('Need to specify "car_number" parameter', 400)
+        if not parking_id:
+            return _failure('Need to specify "parking_id" parameter', 400)
+        if action not in ('enter', 'leave'):
+            return _failure('Action has to be "enter" or "leave"', 400)
+        try:
+            parking_id = gate.parse_id(parking_id, 'parking_id')
+        except ValueError as e:
+            return _failure(str(e), 400)
+
+        clients = await session.run_sync(
+            lambda sync_session: plates.find_clients(sync_session, plate))
+        if not clients:
+            return _failure('No client with this car number', 404)
+        if len(clients) > 1:
+            return _failure('Several clients have this car number', 409)
+
+        if action == 'enter':
+            result, status = await session.run_sync(
+                lambda sync_session: gate.enter(clients[0].id, parking_id,
+                                                self.reservations,
+                                                sync_session, self._publish))
+        else:
+            result, status = await session.run_sync(
+                lambda sync_session: gate.leave(clients[0].id, parking_id,
+                                                sync_session, self._publish))
+        return JSONResponse(result, status)
+
+    async def batch_parking_events(self, request, session):
+        events = (request.json or {}).get('events')
+        if not isinstance(events, list) or not events:
+            return _failure('Need to specify "events" list', 400)
+        if len(events) > gate.BATCH_MAX_EVENTS:
+            return _failure('Too many events in one batch', 400)
+
+        results = await session.run_sync(
+            lambda sync_session: gate.apply_events(events, self.reservations,
+                                                   sync_session,
+                                                   self._publish))
+        if results is None:
+            return _failure('Batch conflicted with concurrent updates, '
+                            'retry it', 409)
+
+        return JSONResponse({'success': True,
+                             'results': [dict(result, status=status)
+                                         for result, status in results]})
+
+
+def create_async_app(config=None):
+    app_config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///prod.db',
+                  'AVAILABILITY_CACHE_TTL': 60.0,
+                  'IMPORT_BATCH_SIZE': importer.IMPORT_BATCH,
+                  'EXPORT_CHUNK_SIZE': export.EXPORT_CHUNK,
+                  'SSE_HEARTBEAT': broadcast.SSE_HEARTBEAT,
+                  'SSE_MAX_PENDING': broadcast.SSE_MAX_PENDING,
+                  'SSE_MAX_SUBSCRIBERS': broadcast.SSE_MAX_SUBSCRIBERS,
+                  'PARKING_SNAPSHOT_TTL': listing.PARKING_SNAPSHOT_TTL,
+                  'IDEMPOTENCY_CACHE_SIZE': idempotency.IDEMPOTENCY_CACHE_SIZE,
+                  'IDEMPOTENCY_WAIT': idempotency.IDEMPOTENCY_WAIT,
+                  'IDEMPOTENCY_LEASE': idempotency.IDEMPOTENCY_LEASE,
+                  'RESERVATION_HORIZON': reservations.RESERVATION_HORIZON,
+                  'RESERVATION_EARLY': reservations.RESERVATION_EARLY,
+                  'SCHEMA_CHECK': True}
+    app_config.update(engine.DEFAULTS)
+    engine.load_environment(app_config)
+    app_config.update(config or {})
+    return AsyncApp(app_config)
+
+
+async def asgi_request(app, method, path, json_body=None, headers=None):
+    """Calls an ASGI app in-process, returns (status, headers, body)."""
+    path, _, query = path.partition('?')
+    body = json.dumps(json_body).encode() if json_body is not None else b''
+    request_headers = [(b'content-type', b'application/json')] if body else []
+    request_headers += [(k.lower().encode(), v.encode())
+                        for k, v in (headers or {}).items()]
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query.encode(), 'headers': request_headers}
+
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected until the app has answered
+        await asyncio.Event().wait()
+
+    response = {'body': b''}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {k.decode(): v.decode()
+                                   for k, v in message['headers']}
+        else:
+            response['body'] += message.get('body', b'')
+
+    await app(scope, receive, send)
+    return response['status'], response['headers'], response['body']
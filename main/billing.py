@@ -0,0 +1,277 @@
+import datetime
+import math
+import random
+import threading
+import time
+import uuid
+
+import click
+from sqlalchemy import bindparam
+
+from .models import db, BillingJob, Client
+
+
+def fake_gateway(config):
+    return FakePaymentGateway(
+        latency=config['BILLING_GATEWAY_LATENCY'],
+        failure_rate=config['BILLING_GATEWAY_FAILURE_RATE'])
+
+
+DEFAULTS = {
+    # Called with the app config, returns the gateway the workers charge
+    'PAYMENT_GATEWAY': fake_gateway,
+    'BILLING_RATE_PER_HOUR': 100,
+    'BILLING_WORKERS': 0,
+    'BILLING_BATCH_SIZE': 50,
+    'BILLING_POLL_INTERVAL': 0.5,
+    'BILLING_MAX_ATTEMPTS': 5,
+    'BILLING_BACKOFF_SECONDS': 1.0,
+    'BILLING_BACKOFF_MAX_SECONDS': 300.0,
+    'BILLING_LEASE_SECONDS': 60.0,
+    'BILLING_GATEWAY_LATENCY': 0.0,
+    'BILLING_GATEWAY_FAILURE_RATE': 0.0,
+}
+
+_DUE = ('pending', 'processing')
+
+
+class PaymentError(Exception):
+    pass
+
+
+class FakePaymentGateway:
+    """Local stand-in for the payment processor.
+
+    Charges are idempotent by reference, like the real thing, so a job
+    retried after a lost response is never charged twice.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.charges = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def charge(self, card, amount, reference):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if reference in self.charges:
+                return self.charges[reference][0]
+            if not card:
+                raise PaymentError('No credit card')
+            if self._random.random() < self.failure_rate:
+                raise PaymentError('Payment declined')
+            transaction_id = f'tx-{len(self.charges) + 1}'
+            self.charges[reference] = (transaction_id, card, amount)
+        return transaction_id
+
+
+def compute_amount(time_in, time_out, rate_per_hour):
+    # Every started hour is paid, a session is at least one hour
+    if time_in is None:
+        return rate_per_hour
+    hours = math.ceil((time_out - time_in).total_seconds() / 3600)
+    return max(1, hours) * rate_per_hour
+
+
+def backoff(attempts, base, cap):
+    # Exponential with jitter, so failed jobs don't retry in lockstep
+    return min(cap, base * 2 ** attempts) * random.uniform(0.5, 1.0)
+
+
+def new_job(log_entry, time_out):
+    return BillingJob(client_parking_id=log_entry.id,
+                      client_id=log_entry.client_id,
+                      parking_id=log_entry.parking_id,
+                      time_in=log_entry.time_in,
+                      time_out=time_out,
+                      next_attempt_at=time_out)
+
+
+def _claim(session, batch_size, lease, now, client_session=None,
+           max_attempts=None):
+    # A claimed job stays due once its lease runs out, so jobs of a worker
+    # that died are picked up again. Every claim counts as an attempt, a
+    # job that keeps killing its worker is given up like one that keeps
+    # failing
+    token = uuid.uuid4().hex
+    due = session.query(BillingJob.id, BillingJob.attempts)\
+        .filter(BillingJob.status.in_(_DUE))\
+        .filter(BillingJob.next_attempt_at <= now)\
+        .order_by(BillingJob.next_attempt_at)\
+        .limit(batch_size).all()
+    if not due:
+        session.rollback()
+        return token, []
+    exhausted = [job_id for job_id, attempts in due
+                 if max_attempts is not None and attempts >= max_attempts]
+    ids = [job_id for job_id, attempts in due if job_id not in exhausted]
+    if exhausted:
+        session.query(BillingJob)\
+            .filter(BillingJob.id.in_(exhausted))\
+            .filter(BillingJob.status.in_(_DUE))\
+            .filter(BillingJob.next_attempt_at <= now)\
+            .update({BillingJob.status: 'failed',
+                     BillingJob.last_error: 'Claim expired',
+                     BillingJob.processed_at: now,
+                     BillingJob.claimed_by: None},
+                    synchronize_session=False)
+    session.query(BillingJob)\
+        .filter(BillingJob.id.in_(ids))\
+        .filter(BillingJob.status.in_(_DUE))\
+        .filter(BillingJob.next_attempt_at <= now)\
+        .update({BillingJob.status: 'processing',
+                 BillingJob.attempts: BillingJob.attempts + 1,
+                 BillingJob.claimed_by: token,
+                 BillingJob.next_attempt_at: now + lease},
+                synchronize_session=False)
+    session.commit()
+    if client_session is None:
+        jobs = session.query(BillingJob.id, BillingJob.attempts,
+                             BillingJob.time_in, BillingJob.time_out,
+                             Client.credit_card)\
+            .outerjoin(Client, Client.id == BillingJob.client_id)\
+            .filter(BillingJob.claimed_by == token)\
+            .filter(BillingJob.status == 'processing').all()
+    else:
+        # Jobs of a shard, the cards are in the main database
+        claimed = session.query(BillingJob.id, BillingJob.attempts,
+                                BillingJob.time_in, BillingJob.time_out,
+                                BillingJob.client_id)\
+            .filter(BillingJob.claimed_by == token)\
+            .filter(BillingJob.status == 'processing').all()
+        cards = dict(client_session.query(Client.id, Client.credit_card)
+                     .filter(Client.id.in_({job.client_id
+                                            for job in claimed})))
+        client_session.rollback()
+        jobs = [(job.id, job.attempts, job.time_in, job.time_out,
+                 cards.get(job.client_id)) for job in claimed]
+    # Nothing is held open while the gateway is called
+    session.rollback()
+    return token, jobs
+
+
+def process_batch(gateway, config, session=None, client_session=None):
+    session = db.session if session is None else session
+    now = datetime.datetime.now()
+    lease = datetime.timedelta(seconds=config['BILLING_LEASE_SECONDS'])
+    token, jobs = _claim(session, config['BILLING_BATCH_SIZE'], lease, now,
+                         client_session, config['BILLING_MAX_ATTEMPTS'])
+    if not jobs:
+        return 0
+
+    results = []
+    # ``attempts`` already counts this claim
+    for job_id, attempts, time_in, time_out, card in jobs:
+        amount = compute_amount(time_in, time_out,
+                                config['BILLING_RATE_PER_HOUR'])
+        result = {'job_id': job_id, 'new_amount': amount, 'new_transaction_id': None,
+                  'new_error': None, 'finished_at': None}
+        try:
+            result['new_transaction_id'] = gateway.charge(
+                card, amount, reference=f'billing-job-{job_id}')
+        except PaymentError as e:
+            result['new_error'] = str(e)[:200]
+        finished = datetime.datetime.now()
+        if result['new_transaction_id']:
+            result.update(new_status='paid', finished_at=finished,
+                          due_at=finished)
+        elif attempts >= config['BILLING_MAX_ATTEMPTS']:
+            result.update(new_status='failed', finished_at=finished,
+                          due_at=finished)
+        else:
+            delay = backoff(attempts - 1, config['BILLING_BACKOFF_SECONDS'],
+                            config['BILLING_BACKOFF_MAX_SECONDS'])
+            result.update(new_status='pending', due_at=finished
+                          + datetime.timedelta(seconds=delay))
+        results.append(result)
+
+    # Results only land if the claim is still ours
+    table = BillingJob.__table__
+    session.execute(
+        table.update()
+        .where(table.c.id == bindparam('job_id'))
+        .where(table.c.claimed_by == token)
+        .values(status=bindparam('new_status'),
+                amount=bindparam('new_amount'),
+                next_attempt_at=bindparam('due_at'),
+                transaction_id=bindparam('new_transaction_id'),
+                last_error=bindparam('new_error'),
+                processed_at=bindparam('finished_at'),
+                claimed_by=None),
+        results)
+    session.commit()
+    return len(results)
+
+
+def _job_sessions(app):
+    # (session holding jobs, session holding clients if it is another one)
+    router = app.extensions.get('shard_router')
+    shard_sessions = router.sessions if router else []
+    return [(db.session, None)] + [(shard_session, db.session)
+                                   for shard_session in shard_sessions]
+
+
+def process_all(gateway, app):
+    return sum(process_batch(gateway, app.config, session, client_session)
+               for session, client_session in _job_sessions(app))
+
+
+class BillingWorkerPool:
+    def __init__(self, app, gateway, workers):
+        self.app = app
+        self.gateway = gateway
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._run, daemon=True,
+                                          name=f'billing-{i}')
+                         for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        interval = self.app.config['BILLING_POLL_INTERVAL']
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    processed = process_all(self.gateway, self.app)
+                except Exception:
+                    for session, _ in _job_sessions(self.app):
+                        session.rollback()
+                    self.app.logger.exception('Billing batch failed')
+                    processed = 0
+            if not processed:
+                self._stopped.wait(interval)
+
+
+def install(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    # Built from the config before any worker starts, a real gateway is
+    # plugged in through PAYMENT_GATEWAY
+    gateway = app.config['PAYMENT_GATEWAY'](app.config)
+    app.extensions['payment_gateway'] = gateway
+
+    @app.cli.command('process-billing')
+    def process_billing():
+        """Charge every billing job that is due."""
+        total = 0
+        while True:
+            processed = process_all(gateway, app)
+            if not processed:
+                break
+            total += processed
+        click.echo(f'Processed {total} billing jobs')
+
+    if app.config['BILLING_WORKERS']:
+        pool = BillingWorkerPool(app, gateway, app.config['BILLING_WORKERS'])
+        app.extensions['billing_workers'] = pool
+        pool.start()
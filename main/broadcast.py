@@ -0,0 +1,175 @@
+import asyncio
+import json
+import queue
+import threading
+
+
+SSE_HEARTBEAT = 15.0
+SSE_MAX_PENDING = 64
+SSE_MAX_SUBSCRIBERS = 10_000
+# A stream of the Flask app holds a worker thread for as long as it is
+# open, keep this below the server's thread count
+SSE_MAX_THREADED_SUBSCRIBERS = 32
+SSE_RETRY_MS = 2000
+
+
+def format_event(availability):
+    data = json.dumps(availability, sort_keys=True, separators=(',', ':'))
+    return f'event: occupancy\ndata: {data}\n\n'
+
+
+class Subscription:
+    def __init__(self, parking_id, max_pending):
+        self.parking_id = parking_id
+        self.dropped = False
+        self._messages = queue.Queue(max_pending)
+
+    def push(self, message):
+        try:
+            self._messages.put_nowait(message)
+        except queue.Full:
+            self.dropped = True
+            return False
+        return True
+
+    def get(self, timeout):
+        try:
+            return self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    # Read by a stream on an event loop. The dispatcher thread wakes all
+    # the streams of a loop that got a message with one callback
+    def __init__(self, parking_id, max_pending, loop):
+        super().__init__(parking_id, max_pending)
+        self.loop = loop
+        self._ready = asyncio.Event()
+
+    def wake(self):
+        self._ready.set()
+
+    async def get(self, timeout):
+        try:
+            return self._messages.get_nowait()
+        except queue.Empty:
+            if self.dropped:
+                return None
+        self._ready.clear()
+        timer = self.loop.call_later(timeout, self._ready.set)
+        try:
+            await self._ready.wait()
+        finally:
+            timer.cancel()
+        try:
+            return self._messages.get_nowait()
+        except queue.Empty:
+            return None
+
+
+def _wake(subscriptions):
+    for subscription in subscriptions:
+        subscription.wake()
+
+
+class OccupancyBroadcaster:
+    """Fans occupancy changes out to server-sent event streams.
+
+    ``publish`` only hands the change to a dispatcher thread, so a gate
+    request never waits for subscribers. Each change is formatted once and
+    pushed to bounded per-subscriber queues; a subscriber that falls
+    ``max_pending`` messages behind is dropped and its stream closed; the
+    client reconnects and starts again from a fresh snapshot.
+    """
+
+    def __init__(self, max_pending=SSE_MAX_PENDING,
+                 max_subscribers=SSE_MAX_SUBSCRIBERS):
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        # Parking id to its subscriptions, None holds the all-parkings ones
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._pending = queue.SimpleQueue()
+        self._thread = None
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, parking_id=None, loop=None):
+        # With ``loop`` the subscription is read by async_stream on it
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = Subscription(parking_id, self.max_pending) \
+                if loop is None \
+                else AsyncSubscription(parking_id, self.max_pending, loop)
+            self._subscribers.setdefault(parking_id, set()).add(subscription)
+            self._count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch,
+                                                daemon=True,
+                                                name='occupancy-broadcast')
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.parking_id)
+            if subscriptions and subscription in subscriptions:
+                subscriptions.remove(subscription)
+                self._count -= 1
+                if not subscriptions:
+                    del self._subscribers[subscription.parking_id]
+
+    def publish(self, availability):
+        if self._count:
+            self._pending.put(availability)
+
+    def deliver(self, availability):
+        with self._lock:
+            targets = list(self._subscribers.get(availability['parking_id'],
+                                                 ()))
+            targets += self._subscribers.get(None, ())
+        message = format_event(availability)
+        waiting = {}
+        for subscription in targets:
+            if not subscription.push(message):
+                self.unsubscribe(subscription)
+            if isinstance(subscription, AsyncSubscription):
+                waiting.setdefault(subscription.loop, []).append(subscription)
+        for loop, subscriptions in waiting.items():
+            loop.call_soon_threadsafe(_wake, subscriptions)
+
+    def _dispatch(self):
+        while True:
+            self.deliver(self._pending.get())
+
+
+def stream(broadcaster, subscription, snapshot, heartbeat=SSE_HEARTBEAT):
+    # Comments keep idle connections open through proxies and let the
+    # server notice clients that went away
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        for availability in snapshot:
+            yield format_event(availability)
+        while not subscription.dropped:
+            message = subscription.get(heartbeat)
+            yield ': keepalive\n\n' if message is None else message
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+async def async_stream(broadcaster, subscription, snapshot,
+                       heartbeat=SSE_HEARTBEAT):
+    # stream() for the ASGI app, waiting for a change holds no thread
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        for availability in snapshot:
+            yield format_event(availability)
+        while not subscription.dropped:
+            message = await subscription.get(heartbeat)
+            yield ': keepalive\n\n' if message is None else message
+    finally:
+        broadcaster.unsubscribe(subscription)
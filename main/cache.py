@@ -0,0 +1,110 @@
+import threading
+import time
+
+
+class AvailabilityCache:
+    """In-process cache of parking occupancy.
+
+    Handlers that change a parking write the new values through with
+    ``update``; entries expire after ``ttl`` seconds. Every value carries
+    the parking version it was read at and an older one never replaces a
+    newer one, so gates publishing out of commit order or a slow reader
+    cannot pin a stale count. Invalidation hooks are called on every
+    write-through so other workers can be told to drop their copy (they
+    should call ``invalidate`` when notified).
+    """
+
+    def __init__(self, ttl=60.0, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}
+        # Newest version seen per parking, outlives expired entries
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._invalidation_hooks = []
+
+    def get(self, parking_id):
+        entry = self._entries.get(parking_id)
+        if entry is None:
+            return None
+        availability, expires_at = entry
+        if expires_at <= self._clock():
+            with self._lock:
+                if self._entries.get(parking_id) is entry:
+                    del self._entries[parking_id]
+            return None
+        return availability
+
+    def set(self, parking_id, count_available_places, opened, version):
+        availability = {'parking_id': parking_id,
+                        'count_available_places': count_available_places,
+                        'opened': bool(opened)}
+        self._store(parking_id, availability, version)
+        return availability
+
+    def update(self, parking_id, count_available_places, opened, version):
+        # None when a newer value is known already, nothing to announce
+        availability = {'parking_id': parking_id,
+                        'count_available_places': count_available_places,
+                        'opened': bool(opened)}
+        if not self._store(parking_id, availability, version):
+            return None
+        for hook in self._invalidation_hooks:
+            hook(parking_id)
+        return availability
+
+    def _store(self, parking_id, availability, version):
+        with self._lock:
+            if version < self._versions.get(parking_id, 0):
+                return False
+            self._versions[parking_id] = version
+            self._entries[parking_id] = (availability,
+                                         self._clock() + self.ttl)
+        return True
+
+    def invalidate(self, parking_id=None):
+        with self._lock:
+            if parking_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(parking_id, None)
+
+    def add_invalidation_hook(self, hook):
+        self._invalidation_hooks.append(hook)
+
+
+class VersionCache:
+    """In-process map of resource versions used to answer conditional GETs.
+
+    Versions only grow, so ``set`` keeps the newest one it has seen and a
+    slow reader cannot put an outdated version back. Entries expire after
+    ``ttl`` seconds to pick up writes made by other processes.
+    """
+
+    def __init__(self, ttl=5.0, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= self._clock():
+            return None
+        return entry[0]
+
+    def set(self, key, version):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                version = max(version, entry[0])
+            self._entries[key] = (version, now + self.ttl)
+        return version
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
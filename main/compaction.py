@@ -0,0 +1,80 @@
+import threading
+
+import click
+from sqlalchemy import select
+
+from .models import db, ClientParking, ClientParkingHistory
+
+
+COMPACTION_BATCH = 1000
+
+_COLUMNS = ('id', 'client_id', 'parking_id', 'time_in', 'time_out')
+
+
+def compact_closed_sessions(session=None, batch_size=COMPACTION_BATCH):
+    # Closed sessions never change again, so they can be copied and deleted
+    # in small transactions without blocking the gates for long
+    session = db.session if session is None else session
+    hot = ClientParking.__table__
+    moved = 0
+    while True:
+        ids = [row_id for (row_id,) in session.query(ClientParking.id)
+               .filter(ClientParking.time_out != None)
+               .order_by(ClientParking.id)
+               .limit(batch_size)]
+        if not ids:
+            return moved
+        session.execute(ClientParkingHistory.__table__.insert().from_select(
+            _COLUMNS, select(*[hot.c[name] for name in _COLUMNS])
+            .where(hot.c.id.in_(ids))))
+        session.execute(hot.delete().where(hot.c.id.in_(ids)))
+        session.commit()
+        moved += len(ids)
+
+
+def compact_all(app, batch_size=COMPACTION_BATCH):
+    # Every shard keeps its own parking log
+    router = app.extensions.get('shard_router')
+    sessions = [db.session] + (router.sessions if router else [])
+    return sum(compact_closed_sessions(session, batch_size)
+               for session in sessions)
+
+
+class CompactionWorker:
+    def __init__(self, app, interval, batch_size=COMPACTION_BATCH):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='parking-log-compaction')
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    compact_all(self.app, self.batch_size)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Parking log compaction failed')
+
+
+def install(app):
+    @app.cli.command('compact-parking-log')
+    @click.option('--batch-size', default=COMPACTION_BATCH, show_default=True)
+    def compact_parking_log(batch_size):
+        """Move closed parking sessions into the history table."""
+        moved = compact_all(app, batch_size)
+        click.echo(f'Archived {moved} closed sessions')
+
+    if app.config['COMPACTION_INTERVAL']:
+        worker = CompactionWorker(app, app.config['COMPACTION_INTERVAL'])
+        app.extensions['compaction_worker'] = worker
+        worker.start()
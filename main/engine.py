@@ -0,0 +1,145 @@
+import os
+import sqlite3
+
+from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from .models import db
+
+
+def _flag(value):
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
+
+def _list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+# Environment variable -> (config key, type)
+ENV_SETTINGS = {
+    'DATABASE_URL': ('SQLALCHEMY_DATABASE_URI', str),
+    'DATABASE_REPLICA_URL': ('DATABASE_REPLICA_URI', str),
+    'DATABASE_SHARD_URLS': ('SHARD_DATABASE_URIS', _list),
+    'DB_POOL_SIZE': ('DB_POOL_SIZE', int),
+    'DB_MAX_OVERFLOW': ('DB_MAX_OVERFLOW', int),
+    'DB_POOL_RECYCLE': ('DB_POOL_RECYCLE', int),
+    'SQLITE_JOURNAL_MODE': ('SQLITE_JOURNAL_MODE', str),
+    'SQLITE_SYNCHRONOUS': ('SQLITE_SYNCHRONOUS', str),
+    'SQLITE_MMAP_SIZE': ('SQLITE_MMAP_SIZE', int),
+    'SQLITE_BUSY_TIMEOUT_MS': ('SQLITE_BUSY_TIMEOUT_MS', int),
+    'SCHEMA_CHECK': ('SCHEMA_CHECK', _flag),
+}
+
+DEFAULTS = {
+    'DATABASE_REPLICA_URI': None,
+    'DB_POOL_SIZE': None,
+    'DB_MAX_OVERFLOW': None,
+    'DB_POOL_RECYCLE': 3600,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+}
+
+
+def load_environment(config, environ=os.environ):
+    for variable, (key, cast) in ENV_SETTINGS.items():
+        if variable in environ:
+            config[key] = cast(environ[variable])
+
+
+def sqlite_connection_class(config):
+    # Pragmas run in the connection constructor, so they follow the engine
+    # options wherever Flask-SQLAlchemy (re)creates the engine
+    pragmas = [f'PRAGMA journal_mode={config["SQLITE_JOURNAL_MODE"]}',
+               f'PRAGMA synchronous={config["SQLITE_SYNCHRONOUS"]}',
+               f'PRAGMA mmap_size={int(config["SQLITE_MMAP_SIZE"])}']
+
+    class TunedConnection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            for pragma in pragmas:
+                self.execute(pragma).close()
+
+    return TunedConnection
+
+
+def engine_options(config, uri):
+    options = {'pool_recycle': config['DB_POOL_RECYCLE'],
+               'pool_pre_ping': True}
+    url = make_url(uri)
+    pool_size = config['DB_POOL_SIZE']
+    if url.get_backend_name() == 'sqlite':
+        # Explicit connect_args replace the ones Flask-SQLAlchemy sets up,
+        # so check_same_thread has to be repeated for pooled connections.
+        # sqlite3 sets the busy timeout from ``timeout``, a pragma would
+        # override an explicit connect_args timeout
+        options['connect_args'] = {
+            'factory': sqlite_connection_class(config),
+            'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            'check_same_thread': False}
+        in_memory = url.database in (None, '', ':memory:')
+        if pool_size and not in_memory:
+            # pysqlite defaults file databases to NullPool
+            options['poolclass'] = QueuePool
+        elif in_memory:
+            pool_size = None
+    if pool_size:
+        options['pool_size'] = pool_size
+        if config['DB_MAX_OVERFLOW'] is not None:
+            options['max_overflow'] = config['DB_MAX_OVERFLOW']
+    return options
+
+
+def primary_options(config):
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS win, their connect_args are
+    # merged into the tuned ones rather than replacing the pragmas
+    options = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    explicit = config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    connect_args = dict(options.get('connect_args', {}),
+                        **explicit.get('connect_args', {}))
+    options.update(explicit)
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def _absolute_uri(app, uri):
+    # Same relative SQLite path handling as Flask-SQLAlchemy
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' \
+            and url.database not in (None, '', ':memory:'):
+        url = url.set(database=os.path.join(app.root_path, url.database))
+    return url
+
+
+def configure(app):
+    # Group commit answers a gate event once its commit returns. In WAL
+    # mode only FULL syncs every commit, NORMAL waits for the checkpoint
+    if app.config.get('GROUP_COMMIT'):
+        app.config.setdefault('SQLITE_SYNCHRONOUS', 'FULL')
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = primary_options(app.config)
+
+    replica_uri = app.config['DATABASE_REPLICA_URI']
+    if replica_uri:
+        replica_engine = create_engine(_absolute_uri(app, replica_uri),
+                                       **engine_options(app.config,
+                                                        replica_uri))
+        replica = scoped_session(sessionmaker(bind=replica_engine))
+        app.extensions['replica_session'] = replica
+
+        @app.teardown_appcontext
+        def shutdown_replica_session(exception=None):
+            replica.remove()
+
+
+def read_session():
+    # Read-only endpoints go to the replica when one is configured
+    replica = current_app.extensions.get('replica_session')
+    return db.session if replica is None else replica
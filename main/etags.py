@@ -0,0 +1,102 @@
+import hashlib
+from urllib.parse import urlencode
+
+from flask import current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .models import Client, ResourceVersion
+
+
+CLIENTS = 'clients'
+
+
+def client_etag(client_id, version):
+    return f'client-{client_id}-v{version}'
+
+
+def collection_etag(name, version, args=None):
+    # Every filter and page of a collection is a representation of its own,
+    # the query arguments are part of the tag
+    etag = f'{name}-v{version}'
+    if args:
+        query = urlencode(sorted(args.items(multi=True)))
+        etag += '-' + hashlib.sha1(query.encode()).hexdigest()[:12]
+    return etag
+
+
+def not_modified(etag):
+    """304 for the current request if it already has ``etag``, else None."""
+    if etag not in request.if_none_match:
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def bump_collection_version(session, name=CLIENTS):
+    # Writes that bypass the ORM (bulk inserts) have to call this themselves
+    session.query(ResourceVersion)\
+        .filter(ResourceVersion.name == name)\
+        .update({ResourceVersion.version: ResourceVersion.version + 1},
+                synchronize_session=False)
+    version = session.query(ResourceVersion.version)\
+        .filter(ResourceVersion.name == name).scalar()
+    session.info.setdefault('versions', {})[(name,)] = version
+
+
+def collection_version(session, versions, name=CLIENTS):
+    version = versions.get((name,))
+    if version is None:
+        version = session.query(ResourceVersion.version)\
+            .filter(ResourceVersion.name == name).scalar() or 0
+        version = versions.set((name,), version)
+    return version
+
+
+def _before_flush(session, flush_context, instances):
+    changed = [obj for obj in session.new | session.dirty | session.deleted
+               if isinstance(obj, Client)
+               and (obj not in session.dirty or session.is_modified(obj))]
+    if changed:
+        session.info.setdefault('changed_clients', []).extend(changed)
+        bump_collection_version(session)
+
+
+def _after_flush_postexec(session, flush_context):
+    versions = session.info.setdefault('versions', {})
+    for client in session.info.pop('changed_clients', ()):
+        versions[('client', client.id)] = client.version
+
+
+def _after_commit(session):
+    versions = session.info.pop('versions', None)
+    if not versions or not has_app_context():
+        return
+    cache = current_app.extensions.get('version_cache')
+    if cache is None:
+        return
+    for key, version in versions.items():
+        if version is not None:
+            cache.set(key, version)
+
+
+def _after_rollback(session):
+    session.info.pop('versions', None)
+    session.info.pop('changed_clients', None)
+
+
+_session_events_installed = False
+
+
+def install_session_events():
+    # Every session bumps versions, including the ones of the ASGI app, so
+    # the counters in the database never miss a write
+    global _session_events_installed
+    if not _session_events_installed:
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush_postexec', _after_flush_postexec)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_soft_rollback',
+                     lambda session, previous: _after_rollback(session))
+        _session_events_installed = True
@@ -0,0 +1,205 @@
+import csv
+import datetime
+import heapq
+import io
+import itertools
+
+import click
+from sqlalchemy import null, select
+
+from .models import db, Client, Parking, ClientParking, ClientParkingHistory
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+EXPORT_CHUNK = 10_000
+
+FORMATS = {'csv': 'text/csv',
+           'parquet': 'application/vnd.apache.parquet'}
+
+COLUMNS = ('id', 'client_id', 'name', 'surname', 'car_number',
+           'parking_id', 'address', 'time_in', 'time_out')
+
+
+def parse_export_args(args):
+    fmt = args.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ValueError('"format" has to be "csv" or "parquet"')
+    try:
+        start = datetime.datetime.fromisoformat(args['from']) \
+            if args.get('from') else None
+        end = datetime.datetime.fromisoformat(args['to']) \
+            if args.get('to') else None
+    except ValueError:
+        raise ValueError('"from" and "to" have to be ISO 8601 datetimes')
+    if start and end and start >= end:
+        raise ValueError('"from" has to be before "to"')
+    return start, end, fmt
+
+
+def export_queries(start=None, end=None, clients=True):
+    # Sessions that started in [start, end), one query for the hot log and
+    # one for its history. Each walks its time_in index in order, so the
+    # two are merged as they stream instead of sorting their union.
+    # Without ``clients`` the client columns are left for with_clients
+    queries = []
+    for model in (ClientParking, ClientParkingHistory):
+        client_columns = (Client.name, Client.surname, Client.car_number) \
+            if clients else (null().label('name'), null().label('surname'),
+                             null().label('car_number'))
+        query = select(model.id, model.client_id, *client_columns,
+                       model.parking_id, Parking.address, model.time_in,
+                       model.time_out)\
+            .outerjoin(Parking, Parking.id == model.parking_id)
+        if clients:
+            query = query.outerjoin(Client, Client.id == model.client_id)
+        if start is not None:
+            query = query.where(model.time_in >= start)
+        if end is not None:
+            query = query.where(model.time_in < end)
+        queries.append(query.order_by(model.time_in.nullsfirst(), model.id))
+    return queries
+
+
+def export_order(row):
+    # The order of export_queries: sessions without time_in first
+    return row.time_in is not None, row.time_in or datetime.datetime.min, \
+        row.id
+
+
+def merge_chunks(streams, chunk_size=EXPORT_CHUNK):
+    rows = heapq.merge(*streams, key=export_order)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream(session, query, chunk_size=EXPORT_CHUNK):
+    # A server-side cursor where the driver has one, only about a chunk of
+    # rows per query is ever held by the worker
+    return session.execute(query.execution_options(stream_results=True,
+                                                   yield_per=chunk_size))
+
+
+def iter_chunks(session, queries, chunk_size=EXPORT_CHUNK):
+    yield from merge_chunks([stream(session, query, chunk_size)
+                             for query in queries], chunk_size)
+
+
+def with_clients(session, chunks):
+    for rows in chunks:
+        clients = {client.id: client for client in session.query(
+            Client.id, Client.name, Client.surname, Client.car_number)
+            .filter(Client.id.in_({row.client_id for row in rows}))}
+        missing = (None, None, None, None)
+        yield [(row.id, row.client_id,
+                *clients.get(row.client_id, missing)[1:],
+                row.parking_id, row.address, row.time_in, row.time_out)
+               for row in rows]
+
+
+def sharded_chunks(router, start=None, end=None, chunk_size=EXPORT_CHUNK):
+    # Both logs of every shard merged in time order, the clients joined
+    # from the main database a chunk at a time
+    streams = [stream(session, query, chunk_size)
+               for session in router.sessions
+               for query in export_queries(start, end, clients=False)]
+    return with_clients(db.session, merge_chunks(streams, chunk_size))
+
+
+def write_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _Sink(io.RawIOBase):
+    # Collects what the Parquet writer produces until the caller takes it
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_schema():
+    return pyarrow.schema([('id', pyarrow.int64()),
+                           ('client_id', pyarrow.int64()),
+                           ('name', pyarrow.string()),
+                           ('surname', pyarrow.string()),
+                           ('car_number', pyarrow.string()),
+                           ('parking_id', pyarrow.int64()),
+                           ('address', pyarrow.string()),
+                           ('time_in', pyarrow.timestamp('us')),
+                           ('time_out', pyarrow.timestamp('us'))])
+
+
+def write_parquet(chunks):
+    # Every chunk becomes one row group and is sent as soon as it is
+    # encoded, the footer goes out last
+    schema = parquet_schema()
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pyarrow.table(
+                [pyarrow.array(column, type=field.type)
+                 for column, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+WRITERS = {'csv': write_csv, 'parquet': write_parquet}
+
+
+def install(app):
+    @app.cli.command('export-parking-log')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--from', 'start', type=click.DateTime(),
+                  help='Sessions started at or after this time.')
+    @click.option('--to', 'end', type=click.DateTime(),
+                  help='Sessions started before this time.')
+    @click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)),
+                  default='csv', show_default=True)
+    @click.option('--chunk-size', default=EXPORT_CHUNK, show_default=True)
+    def export_parking_log(path, start, end, fmt, chunk_size):
+        """Write the parking log with client and parking columns to a file."""
+        if fmt == 'parquet' and pyarrow is None:
+            raise click.UsageError('Parquet export requires pyarrow')
+        router = app.extensions.get('shard_router')
+        chunks = sharded_chunks(router, start, end, chunk_size) if router \
+            else iter_chunks(db.session, export_queries(start, end),
+                             chunk_size)
+        with open(path, 'wb') as out:
+            for data in WRITERS[fmt](chunks):
+                out.write(data.encode() if isinstance(data, str) else data)
+        click.echo(f'Exported the parking log to {path}')
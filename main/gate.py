@@ -0,0 +1,339 @@
+import datetime
+
+from flask import current_app
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import billing, reservations, rollups
+from .models import db, Client, Parking, ClientParking
+
+
+BATCH_MAX_EVENTS = 500
+BATCH_MAX_ATTEMPTS = 3
+
+
+def _failure(reason, status):
+    return {'success': False, 'reason': reason}, status
+
+
+def enter_rejection(parking, client, client_on_parking, available=None):
+    if not parking:
+        return _failure('Parking doesn\'t exist', 404)
+    if not parking.opened:
+        return _failure('Parking is closed', 409)
+    if available is None:
+        available = parking.count_available_places
+    if available == 0:
+        return _failure('Parking is full', 409)
+    if not client:
+        return _failure('Client doesn\'t exist', 404)
+    if not client.car_number:
+        return _failure('Cannot enter parking without car', 409)
+    if client_on_parking:
+        return _failure('This client is already at this parking', 409)
+    return None
+
+
+def leave_rejection(log_entry, client):
+    if not log_entry:
+        return _failure('Cannot find parking log', 404)
+    if not client:
+        return _failure('Cannot find client with this client_id', 404)
+    if not client.credit_card:
+        return _failure('No credit card added, cannot process payment', 402)
+    return None
+
+
+def current_occupancy(session, parking_ids):
+    # Read inside the writing transaction, so the values are exactly
+    # the ones being committed
+    return session.query(Parking.id,
+                         Parking.count_available_places,
+                         Parking.opened,
+                         Parking.version)\
+        .filter(Parking.id.in_(parking_ids)).all()
+
+
+def publish_occupancy(occupancy):
+    availability = current_app.extensions['availability_cache']
+    broadcaster = current_app.extensions['occupancy_broadcaster']
+    snapshot = current_app.extensions['parking_snapshot']
+    for parking_id, count_available_places, opened, version in occupancy:
+        change = availability.update(parking_id, count_available_places,
+                                     opened, version)
+        # An older value published late is dropped
+        if change is not None:
+            snapshot.update(parking_id, count_available_places, opened)
+            broadcaster.publish(change)
+
+
+def open_session(session, client_id, parking_id):
+    return session.query(ClientParking)\
+        .filter(ClientParking.client_id == client_id)\
+        .filter(ClientParking.parking_id == parking_id)\
+        .filter(ClientParking.time_out == None).first()
+
+
+def enter(client_id, parking_id, reservation_index, session=None,
+          publish=publish_occupancy, client_session=None):
+    # ``reservation_index`` of None admits without checking reservations
+    session = db.session if session is None else session
+    client_session = session if client_session is None else client_session
+    parking = session.query(Parking).get(parking_id)
+    client = client_session.query(Client).get(client_id) if parking else None
+    client_on_parking = open_session(session, client_id, parking_id) \
+        if client else None
+    rejection = enter_rejection(parking, client, client_on_parking)
+    if rejection:
+        return rejection
+    now = datetime.datetime.now()
+    if reservation_index is not None:
+        # Reservations made by other processes since the last entry
+        reservation_index.sync(session, now)
+    reservation, rejection = reservations.admit(session, reservation_index,
+                                                parking, client_id, now)
+    if rejection:
+        return rejection
+
+    # The place is taken by a single conditional UPDATE, so concurrent
+    # gates cannot overbook the parking between the check and the write
+    place_taken = session.query(Parking)\
+        .filter(Parking.id == parking_id)\
+        .filter(Parking.count_available_places > 0)\
+        .update({Parking.count_available_places:
+                 Parking.count_available_places - 1,
+                 Parking.version: Parking.version + 1})
+    if not place_taken:
+        session.rollback()
+        return _failure('Parking is full', 409)
+
+    parking_log = ClientParking(client_id=client_id,
+                                parking_id=parking_id,
+                                time_in=now)
+    session.add(parking_log)
+    if reservation:
+        reservation.used_at = now
+    try:
+        session.flush()
+    except IntegrityError:
+        # Another gate opened a session for this client first
+        session.rollback()
+        return _failure('This client is already at this parking', 409)
+    rollups.record_entry(session, parking_id, parking_log.time_in)
+    occupancy = current_occupancy(session, [parking_id])
+    session.commit()
+    if reservation:
+        reservation_index.remove(reservation.id)
+    publish(occupancy)
+
+    return {'success': True, 'parking_log': parking_log.to_json()}, 201
+
+
+def leave(client_id, parking_id, session=None, publish=publish_occupancy,
+          client_session=None):
+    session = db.session if session is None else session
+    client_session = session if client_session is None else client_session
+    log_entry = open_session(session, client_id, parking_id)
+    client = client_session.query(Client).get(client_id) \
+        if log_entry else None
+    rejection = leave_rejection(log_entry, client)
+    if rejection:
+        return rejection
+
+    # Only the request that actually closes the session frees the place
+    time_out = datetime.datetime.now()
+    session_closed = session.query(ClientParking)\
+        .filter(ClientParking.id == log_entry.id)\
+        .filter(ClientParking.time_out == None)\
+        .update({ClientParking.time_out: time_out})
+    if not session_closed:
+        session.rollback()
+        return _failure('Cannot find parking log', 404)
+
+    session.query(Parking)\
+        .filter(Parking.id == parking_id)\
+        .update({Parking.count_available_places:
+                 Parking.count_available_places + 1,
+                 Parking.version: Parking.version + 1})
+    rollups.record_exit(session, parking_id, log_entry.time_in, time_out)
+    # Payment happens in the billing workers, the gate only queues it
+    session.add(billing.new_job(log_entry, time_out))
+    occupancy = current_occupancy(session, [parking_id])
+    session.commit()
+    publish(occupancy)
+
+    return {'success': True, 'parking_log': log_entry.to_json()}, 200
+
+
+def parse_id(value, name):
+    # Ids come from JSON: "7" names the same row as 7. Anything else is
+    # refused instead of looked up, by the single and the batch endpoints
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    raise ValueError(f'"{name}" has to be an integer')
+
+
+def _parse_event(event):
+    # Returns the event with integer ids, or its rejection
+    if not isinstance(event, dict):
+        return None, _failure('Event has to be an object', 400)
+    action = event.get('action')
+    if action == 'enter':
+        if not event.get('client_id'):
+            return None, _failure('Need to specify "client_id" parameter',
+                                  400)
+        if not event.get('parking_id'):
+            return None, _failure('Need to specify "parking_id" parameter',
+                                  400)
+    elif action == 'leave':
+        if not event.get('client_id'):
+            return None, _failure('Need to specify client_id', 400)
+        if not event.get('parking_id'):
+            return None, _failure('Need to specify parking_id', 400)
+    else:
+        return None, _failure('Event action has to be "enter" or "leave"',
+                              400)
+    try:
+        return dict(event,
+                    client_id=parse_id(event['client_id'], 'client_id'),
+                    parking_id=parse_id(event['parking_id'],
+                                        'parking_id')), None
+    except ValueError as e:
+        return None, _failure(str(e), 400)
+
+
+def _apply_events_once(events, session, publish, reservation_index,
+                       client_session):
+    parsed = [_parse_event(event) for event in events]
+    results = [rejection for _, rejection in parsed]
+    valid = [(i, event) for i, (event, rejection) in enumerate(parsed)
+             if not rejection]
+
+    # One query per table for everything the batch touches
+    client_ids = {event['client_id'] for _, event in valid}
+    parking_ids = {event['parking_id'] for _, event in valid}
+    pairs = {(event['client_id'], event['parking_id']) for _, event in valid}
+    clients = {c.id: c for c in client_session.query(Client)
+               .filter(Client.id.in_(client_ids))} if valid else {}
+    parkings = {p.id: p for p in session.query(Parking)
+                .filter(Parking.id.in_(parking_ids))} if valid else {}
+    open_logs = {(log.client_id, log.parking_id): log for log in
+                 session.query(ClientParking)
+                 .filter(tuple_(ClientParking.client_id,
+                                ClientParking.parking_id).in_(pairs))
+                 .filter(ClientParking.time_out == None)} if valid else {}
+
+    now = datetime.datetime.now()
+    if reservation_index is not None and valid:
+        reservation_index.sync(session, now)
+    available = {pid: p.count_available_places for pid, p in parkings.items()}
+    deltas = {}
+    entered = []
+    closed = []
+    used = []
+    for i, event in valid:
+        client_id, parking_id = event['client_id'], event['parking_id']
+        client = clients.get(client_id)
+        parking = parkings.get(parking_id)
+        if event['action'] == 'enter':
+            results[i] = enter_rejection(parking, client,
+                                         open_logs.get((client_id, parking_id)),
+                                         available.get(parking_id))
+            if results[i]:
+                continue
+            reservation, results[i] = reservations.admit(
+                session, reservation_index, parking, client_id, now,
+                available.get(parking_id))
+            if results[i]:
+                continue
+            if reservation:
+                reservation.used_at = now
+                used.append(reservation)
+            parking_log = ClientParking(client_id=client_id,
+                                        parking_id=parking_id,
+                                        time_in=now)
+            open_logs[(client_id, parking_id)] = parking_log
+            entered.append((i, parking_log))
+            delta = -1
+        else:
+            log_entry = open_logs.get((client_id, parking_id))
+            results[i] = leave_rejection(log_entry, client)
+            if results[i]:
+                continue
+            del open_logs[(client_id, parking_id)]
+            closed.append((i, log_entry))
+            delta = 1
+        available[parking_id] += delta
+        deltas[parking_id] = deltas.get(parking_id, 0) + delta
+
+    # Writes are conditional, a concurrent gate invalidating what was read
+    # above makes the whole batch retry against fresh data
+    for parking_id, delta in deltas.items():
+        updated = session.query(Parking)\
+            .filter(Parking.id == parking_id)\
+            .filter(Parking.count_available_places + delta >= 0)\
+            .filter(Parking.count_available_places + delta
+                    <= Parking.count_places)\
+            .update({Parking.count_available_places:
+                     Parking.count_available_places + delta,
+                     Parking.version: Parking.version + 1},
+                    synchronize_session=False)
+        if not updated:
+            return None
+
+    stored_logs = [log_entry for _, log_entry in closed if log_entry.id]
+    if stored_logs:
+        updated = session.query(ClientParking)\
+            .filter(ClientParking.id.in_([log.id for log in stored_logs]))\
+            .filter(ClientParking.time_out == None)\
+            .update({ClientParking.time_out: now},
+                    synchronize_session=False)
+        if updated != len(stored_logs):
+            return None
+    for _, log_entry in closed:
+        if log_entry.id:
+            set_committed_value(log_entry, 'time_out', now)
+        else:
+            # Entered and left within the same batch
+            log_entry.time_out = now
+
+    session.add_all(parking_log for _, parking_log in entered)
+    try:
+        session.flush()
+    except IntegrityError:
+        return None
+
+    rollup_deltas = rollups.RollupDeltas()
+    for _, parking_log in entered:
+        rollup_deltas.entry(parking_log.parking_id, now)
+    for _, log_entry in closed:
+        rollup_deltas.exit(log_entry.parking_id, log_entry.time_in, now)
+    rollup_deltas.apply(session)
+    session.add_all(billing.new_job(log_entry, now) for _, log_entry in closed)
+
+    for i, parking_log in entered + closed:
+        results[i] = {'success': True, 'parking_log': parking_log.to_json()}, \
+            201 if events[i]['action'] == 'enter' else 200
+    occupancy = current_occupancy(session, list(deltas)) if deltas else []
+    session.commit()
+    for reservation in used:
+        reservation_index.remove(reservation.id)
+    publish(occupancy)
+
+    return results
+
+
+def apply_events(events, reservation_index, session=None,
+                 publish=publish_occupancy, client_session=None):
+    session = db.session if session is None else session
+    client_session = session if client_session is None else client_session
+    for _ in range(BATCH_MAX_ATTEMPTS):
+        results = _apply_events_once(events, session, publish,
+                                     reservation_index, client_session)
+        if results is not None:
+            return results
+        session.rollback()
+    return None
@@ -0,0 +1,144 @@
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from . import gate
+from .models import db
+
+
+GROUP_COMMIT_WINDOW = 0.002
+GROUP_COMMIT_MAX_EVENTS = 100
+
+
+class _Pending:
+    def __init__(self, event):
+        self.event = event
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """Applies gate events from concurrent requests in shared transactions.
+
+    A writer thread collects what arrives within ``window`` seconds of the
+    first event, up to ``max_events``, and applies it with
+    ``gate.apply_events``: one commit, one fsync for the whole group.
+    Requests are answered once that commit has returned. A rejected event
+    is answered on its own inside the group; if the group as a whole
+    fails, its events are retried one transaction each, so one bad event
+    cannot fail the others.
+
+    An answered event is only durable if the commit is synced, so group
+    commit defaults ``SQLITE_SYNCHRONOUS`` to FULL. With NORMAL, WAL
+    commits wait for the checkpoint to reach the disk and a power loss
+    can drop groups that were already answered.
+    """
+
+    def __init__(self, app, window=GROUP_COMMIT_WINDOW,
+                 max_events=GROUP_COMMIT_MAX_EVENTS):
+        self.app = app
+        self.window = window
+        self.max_events = max_events
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='group-commit')
+        self._thread.start()
+
+    def submit(self, event):
+        pending = _Pending(event)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        group = [first]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_events:
+            try:
+                pending = self._queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if pending is None:
+                # Stop after this group
+                self._queue.put(None)
+                break
+            group.append(pending)
+        return group
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            group = self._collect(first)
+            with self.app.app_context():
+                try:
+                    self._apply(group)
+                finally:
+                    db.session.remove()
+                    for pending in group:
+                        pending.done.set()
+
+    def _apply(self, group):
+        try:
+            results = gate.apply_events([p.event for p in group],
+                                        self.app.extensions['reservations'])
+        except Exception:
+            db.session.rollback()
+            results = None
+        if results is not None:
+            for pending, result in zip(group, results):
+                pending.result = result
+            return
+
+        for pending in group:
+            event = pending.event
+            try:
+                pending.result = _move(self.app, event['action'],
+                                       event['client_id'], event['parking_id'])
+            except Exception as e:
+                db.session.rollback()
+                pending.error = e
+
+
+def _move(app, action, client_id, parking_id):
+    if action == 'enter':
+        return gate.enter(client_id, parking_id,
+                          app.extensions['reservations'])
+    return gate.leave(client_id, parking_id)
+
+
+def install(app):
+    app.config.setdefault('GROUP_COMMIT', False)
+    app.config.setdefault('GROUP_COMMIT_WINDOW', GROUP_COMMIT_WINDOW)
+    app.config.setdefault('GROUP_COMMIT_MAX_EVENTS', GROUP_COMMIT_MAX_EVENTS)
+    if not app.config['GROUP_COMMIT']:
+        return
+    # Shards split the write lock instead, the handlers send gate events
+    # straight to them
+    if 'shard_router' in app.extensions:
+        app.logger.warning('GROUP_COMMIT is ignored, gate events go '
+                           'straight to the SHARD_DATABASE_URIS shards')
+        return
+    app.extensions['group_committer'] = GroupCommitter(
+        app, app.config['GROUP_COMMIT_WINDOW'],
+        app.config['GROUP_COMMIT_MAX_EVENTS'])
+
+
+def submit(action, client_id, parking_id):
+    # Straight to the gate unless group commit is on
+    committer = current_app.extensions.get('group_committer')
+    if committer is None:
+        return _move(current_app, action, client_id, parking_id)
+    return committer.submit({'action': action, 'client_id': client_id,
+                             'parking_id': parking_id})
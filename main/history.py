@@ -0,0 +1,108 @@
+import datetime
+
+from sqlalchemy import and_, or_, select, union_all
+
+from .models import Client, Parking, ClientParking, ClientParkingHistory
+
+
+HISTORY_PAGE_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
+
+
+def parse_page_args(args):
+    try:
+        before = datetime.datetime.fromisoformat(args['before']) \
+            if args.get('before') else None
+    except ValueError:
+        raise ValueError('"before" has to be an ISO 8601 datetime')
+    before_id = args.get('before_id', type=int)
+    limit = args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        raise ValueError('"limit" has to be positive')
+    return before, before_id, min(limit or HISTORY_PAGE_LIMIT,
+                                  HISTORY_MAX_LIMIT)
+
+
+def sessions_query(owner, owner_id, before=None, before_id=None,
+                   limit=HISTORY_PAGE_LIMIT, open_only=False, join=True):
+    # Newest first across the hot log and its history, with the client or
+    # the parking joined in, so a page is one statement however long it is.
+    # Each table gives at most a page through its (owner, time_in) index
+    # before the two are merged. Sessions without time_in come last; a
+    # ``before_id`` alone pages through them
+    models = (ClientParking,) if open_only \
+        else (ClientParking, ClientParkingHistory)
+    pages = []
+    for model in models:
+        if before is not None:
+            ranges = [or_(model.time_in < before,
+                          and_(model.time_in == before, model.id < before_id))
+                      if before_id is not None else model.time_in < before,
+                      model.time_in == None]
+        elif before_id is not None:
+            ranges = [and_(model.time_in == None, model.id < before_id)]
+        else:
+            ranges = [None]
+        for page_range in ranges:
+            query = select(model.id, model.client_id, model.parking_id,
+                           model.time_in, model.time_out)\
+                .where(getattr(model, owner) == owner_id)
+            if open_only:
+                query = query.where(model.time_out == None)
+            if page_range is not None:
+                query = query.where(page_range)
+            pages.append(select(query.order_by(
+                model.time_in.desc().nullslast(), model.id.desc())
+                .limit(limit).subquery()))
+    log = union_all(*pages).subquery() if len(pages) > 1 \
+        else pages[0].subquery()
+    query = select(log.c.id, log.c.client_id, log.c.parking_id,
+                   log.c.time_in, log.c.time_out)
+    # Only the other side is joined, so a client's visits can also be read
+    # from shards that don't store clients. Without ``join`` the caller
+    # looks the other side up itself
+    if join and owner == 'client_id':
+        query = query.add_columns(Parking.address)\
+            .join(Parking, Parking.id == log.c.parking_id)
+    elif join:
+        query = query.add_columns(Client.name, Client.surname,
+                                  Client.car_number)\
+            .join(Client, Client.id == log.c.client_id)
+    return query.order_by(log.c.time_in.desc().nullslast(),
+                          log.c.id.desc()).limit(limit)
+
+
+def next_page_args(last):
+    # Cursor for the page after the one ending with ``last``
+    if last['time_in'] is None:
+        return {'before_id': last['id']}
+    return {'before': last['time_in'].isoformat(), 'before_id': last['id']}
+
+
+def page_order(row):
+    # Sort key of sessions_query pages, for merging them
+    return (row['time_in'] is not None,
+            row['time_in'] or datetime.datetime.min, row['id'])
+
+
+def client_visits(session, client_id, before=None, before_id=None,
+                  limit=HISTORY_PAGE_LIMIT):
+    rows = session.execute(sessions_query('client_id', client_id, before,
+                                          before_id, limit))
+    return [{'id': row.id, 'time_in': row.time_in, 'time_out': row.time_out,
+             'parking': {'id': row.parking_id, 'address': row.address}}
+            for row in rows]
+
+
+def parking_sessions(session, parking_id, before=None, before_id=None,
+                     limit=HISTORY_PAGE_LIMIT, open_only=False):
+    rows = session.execute(sessions_query('parking_id', parking_id, before,
+                                          before_id, limit, open_only))
+    return [parking_session(row, row) for row in rows]
+
+
+def parking_session(row, client):
+    return {'id': row.id, 'time_in': row.time_in, 'time_out': row.time_out,
+            'client': {'id': row.client_id, 'name': client.name,
+                       'surname': client.surname,
+                       'car_number': client.car_number}}
@@ -0,0 +1,246 @@
+import collections
+import datetime
+import functools
+import hashlib
+import threading
+import time
+
+import click
+from flask import Response, current_app, jsonify, request
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, IdempotencyKey
+
+
+IDEMPOTENCY_CACHE_SIZE = 10_000
+# How long a duplicate waits for the first request before giving up
+IDEMPOTENCY_WAIT = 5.0
+# A claim older than this belongs to a request that died half way
+IDEMPOTENCY_LEASE = 30.0
+IDEMPOTENCY_POLL = 0.05
+IDEMPOTENCY_KEY_MAX = 255
+
+REUSED_REASON = 'Idempotency-Key was used for another request'
+IN_FLIGHT_REASON = 'A request with this Idempotency-Key is still being ' \
+    'processed'
+KEY_LENGTH_REASON = 'Idempotency-Key has to be 1 to ' \
+    f'{IDEMPOTENCY_KEY_MAX} characters'
+
+
+class IdempotencyStore:
+    """Responses already given to idempotent requests.
+
+    Finished responses are kept in a bounded LRU in front of the
+    ``idempotency_key`` table. Requests in flight in this process are
+    tracked with events, so a duplicate waits for the first one instead
+    of polling the database. The async app passes ``asyncio.Event``.
+    """
+
+    def __init__(self, max_entries=IDEMPOTENCY_CACHE_SIZE,
+                 event=threading.Event):
+        self.max_entries = max_entries
+        self._event = event
+        self._responses = collections.OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None:
+                self._responses.move_to_end(key)
+            return entry
+
+    def remember(self, key, fingerprint, status, body):
+        with self._lock:
+            self._responses[key] = (fingerprint, status, body)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    def start(self, key):
+        # None when this request owns the key, otherwise the event of the
+        # request that does
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key]
+            self._in_flight[key] = self._event()
+            return None
+
+    def finish(self, key):
+        with self._lock:
+            self._in_flight.pop(key).set()
+
+
+def request_fingerprint(method, path, body):
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def fingerprint():
+    return request_fingerprint(request.method, request.path,
+                               request.get_data())
+
+
+def _replay(status, body):
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _failure(reason, status):
+    return jsonify(success=False, reason=reason), status
+
+
+def claim(session, key, request_fingerprint, lease):
+    now = datetime.datetime.now()
+    session.add(IdempotencyKey(key=key, fingerprint=request_fingerprint,
+                               created_at=now))
+    try:
+        session.commit()
+        return True
+    except IntegrityError:
+        session.rollback()
+    row = session.query(IdempotencyKey).get(key)
+    if row is None or row.status is not None \
+            or row.created_at > now - datetime.timedelta(seconds=lease):
+        return False
+
+    # The request holding the claim never finished, take it over
+    taken = session.query(IdempotencyKey)\
+        .filter(IdempotencyKey.key == key)\
+        .filter(IdempotencyKey.status == None)\
+        .filter(IdempotencyKey.created_at == row.created_at)\
+        .update({IdempotencyKey.fingerprint: request_fingerprint,
+                 IdempotencyKey.created_at: now},
+                synchronize_session=False)
+    session.commit()
+    return bool(taken)
+
+
+def stored_entry(session, store, key):
+    # The key's entry as kept by the store, with no status while the
+    # request holding it runs. None when nobody holds the key
+    row = session.query(IdempotencyKey).get(key)
+    if row is None:
+        return None
+    if row.status is not None:
+        store.remember(key, row.fingerprint, row.status, row.body)
+    return row.fingerprint, row.status, row.body
+
+
+def record(session, key, status, body):
+    session.query(IdempotencyKey)\
+        .filter(IdempotencyKey.key == key)\
+        .update({IdempotencyKey.status: status, IdempotencyKey.body: body})
+    session.commit()
+
+
+def release(session, key):
+    # A request that failed gives the key back, so a retry runs it again
+    session.rollback()
+    session.query(IdempotencyKey).filter(IdempotencyKey.key == key).delete()
+    session.commit()
+
+
+def _stored_response(store, key, request_fingerprint, deadline):
+    # Waits for a request with the same key handled elsewhere, None if it
+    # is still running at the deadline
+    session = db.session
+    while True:
+        # The first pass reuses the row the claim has just read
+        entry = stored_entry(session, store, key)
+        if entry is None:
+            return None
+        if entry[0] != request_fingerprint:
+            return _failure(REUSED_REASON, 422)
+        if entry[1] is not None:
+            return _replay(entry[1], entry[2])
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(IDEMPOTENCY_POLL)
+        session.expire_all()
+
+
+def _handle(store, key, view, args, kwargs):
+    config = current_app.config
+    request_fingerprint = fingerprint()
+    # One wait for the whole request, however many requests it waits on
+    deadline = time.monotonic() + config['IDEMPOTENCY_WAIT']
+
+    while True:
+        entry = store.get(key)
+        if entry is not None:
+            if entry[0] != request_fingerprint:
+                return _failure(REUSED_REASON, 422)
+            return _replay(entry[1], entry[2])
+        first = store.start(key)
+        if first is None:
+            break
+        # A duplicate in this process, the first request answers for both
+        if not first.wait(max(deadline - time.monotonic(), 0)):
+            return _failure(IN_FLIGHT_REASON, 409)
+
+    try:
+        if not claim(db.session, key, request_fingerprint,
+                     config['IDEMPOTENCY_LEASE']):
+            # Claimed by another process
+            return _stored_response(store, key, request_fingerprint,
+                                    deadline) \
+                or _failure(IN_FLIGHT_REASON, 409)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            release(db.session, key)
+            raise
+
+        body = response.get_data(as_text=True)
+        record(db.session, key, response.status_code, body)
+        store.remember(key, request_fingerprint, response.status_code, body)
+        return response
+    finally:
+        store.finish(key)
+
+
+def idempotent(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX:
+            return _failure(KEY_LENGTH_REASON, 400)
+        store = current_app.extensions['idempotency_store']
+        return _handle(store, key, view, args, kwargs)
+    return wrapper
+
+
+def purge(older_than, session=None):
+    session = db.session if session is None else session
+    deleted = session.query(IdempotencyKey)\
+        .filter(IdempotencyKey.created_at < older_than)\
+        .delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+def install(app):
+    app.config.setdefault('IDEMPOTENCY_CACHE_SIZE', IDEMPOTENCY_CACHE_SIZE)
+    app.config.setdefault('IDEMPOTENCY_WAIT', IDEMPOTENCY_WAIT)
+    app.config.setdefault('IDEMPOTENCY_LEASE', IDEMPOTENCY_LEASE)
+    app.extensions['idempotency_store'] = IdempotencyStore(
+        app.config['IDEMPOTENCY_CACHE_SIZE'])
+
+    @app.cli.command('purge-idempotency-keys')
+    @click.option('--hours', default=24, show_default=True,
+                  help='Keep keys used within this many hours.')
+    def purge_idempotency_keys(hours):
+        """Forget idempotency keys older than the retry window."""
+        deleted = purge(datetime.datetime.now()
+                        - datetime.timedelta(hours=hours))
+        click.echo(f'Deleted {deleted} idempotency keys')
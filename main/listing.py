@@ -0,0 +1,139 @@
+import bisect
+import threading
+import time
+
+from .models import Parking
+
+
+PARKINGS_PAGE_LIMIT = 100
+PARKINGS_MAX_LIMIT = 1000
+PARKING_SNAPSHOT_TTL = 60.0
+
+
+def _flag(value, name):
+    if value is None:
+        return None
+    if value.lower() in ('1', 'true'):
+        return True
+    if value.lower() in ('0', 'false'):
+        return False
+    raise ValueError(f'"{name}" has to be true or false')
+
+
+def parse_listing_args(args):
+    opened = _flag(args.get('opened'), 'opened')
+    try:
+        min_available = int(args.get('min_available', 0))
+    except ValueError:
+        min_available = -1
+    if min_available < 0:
+        raise ValueError('"min_available" has to be a non-negative integer')
+    after_id = args.get('after_id', type=int)
+    limit = args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        raise ValueError('"limit" has to be positive')
+    return opened, min_available, after_id, min(limit or PARKINGS_PAGE_LIMIT,
+                                                PARKINGS_MAX_LIMIT)
+
+
+def parking_rows(session):
+    return session.query(Parking.id, Parking.address, Parking.opened,
+                         Parking.count_available_places)\
+        .order_by(Parking.id).all()
+
+
+def occupancy_rows(session, parking_id=None):
+    query = session.query(Parking.id, Parking.count_available_places,
+                          Parking.opened, Parking.version)
+    if parking_id is not None:
+        query = query.filter(Parking.id == parking_id)
+    return query.order_by(Parking.id).all()
+
+
+class ParkingSnapshot:
+    """Every parking's id, address and occupancy, kept in id order.
+
+    Loaded from the database once and then kept current by the handlers
+    that change a parking (``add`` and ``update``), so listing pages are
+    answered from memory. Changes made by other processes are picked up by
+    a reload every ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl=PARKING_SNAPSHOT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._ids = []
+        self._rows = {}
+        self._expires_at = None
+        # Updates made while a reload reads the table, replayed over it
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def expired(self):
+        return self._expires_at is None or self._expires_at <= self._clock()
+
+    def reload(self, read):
+        # ``read`` returns the rows of parking_rows() for every parking
+        with self._lock:
+            self._pending = {}
+        try:
+            rows = read()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._ids = [row.id for row in rows]
+            self._rows = {row.id: {'id': row.id, 'address': row.address,
+                                   'opened': bool(row.opened),
+                                   'count_available_places':
+                                       row.count_available_places}
+                          for row in rows}
+            for parking_id, changes in self._pending.items():
+                self._set(parking_id, changes)
+            self._pending = None
+            self._expires_at = self._clock() + self.ttl
+
+    def add(self, parking_id, address, opened, count_available_places):
+        with self._lock:
+            self._set(parking_id, {'address': address, 'opened': bool(opened),
+                                   'count_available_places':
+                                       count_available_places})
+
+    def update(self, parking_id, count_available_places, opened):
+        with self._lock:
+            self._set(parking_id, {'opened': bool(opened),
+                                   'count_available_places':
+                                       count_available_places})
+
+    def _set(self, parking_id, changes):
+        if self._pending is not None:
+            self._pending.setdefault(parking_id, {}).update(changes)
+        row = self._rows.get(parking_id)
+        if row is not None:
+            row.update(changes)
+        elif 'address' in changes:
+            bisect.insort(self._ids, parking_id)
+            self._rows[parking_id] = dict(changes, id=parking_id)
+        # An update for a parking created by another process waits for the
+        # next reload, which brings its address too
+
+    def page(self, opened=None, min_available=0, after_id=None,
+             limit=PARKINGS_PAGE_LIMIT):
+        found = []
+        with self._lock:
+            start = 0 if after_id is None \
+                else bisect.bisect_right(self._ids, after_id)
+            for i in range(start, len(self._ids)):
+                row = self._rows[self._ids[i]]
+                if opened is not None and row['opened'] != opened:
+                    continue
+                if row['count_available_places'] < min_available:
+                    continue
+                found.append(dict(row))
+                if len(found) == limit:
+                    break
+        return found
@@ -1,5 +1,10 @@
 from .app import create_app
+from .migrations import upgrade
+from .models import db
 
 if __name__ == '__main__':
-    app = create_app()
+    # The development server brings its own database up to date
+    app = create_app({'SCHEMA_CHECK': False})
+    with app.app_context():
+        upgrade(db.engine)
     app.run()
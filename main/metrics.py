@@ -0,0 +1,222 @@
+import bisect
+import threading
+import time
+
+from flask import Response, current_app, g, has_app_context, \
+    has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(
+                label_values, [[0] * (len(self.buckets) + 1), 0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} histogram']
+        for label_values, (counts, total) in sorted(self._series.items()):
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket'
+                             f'{{{labels}{"," if labels else ""}le="{bound}"}} '
+                             f'{cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket'
+                         f'{{{labels}{"," if labels else ""}le="+Inf"}} '
+                         f'{cumulative}')
+            labels = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, *label_values):
+        self._series[label_values] = self._series.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._series.items()):
+            lines.append(f'{self.name}{{{_format_labels(self.labels, label_values)}}} '
+                         f'{value}')
+        return lines
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"'
+                    for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self, slow_query_seconds):
+        self.slow_query_seconds = slow_query_seconds
+        self.lock = threading.Lock()
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency by route.',
+            ('method', 'route'), LATENCY_BUCKETS)
+        self.requests = Counter(
+            'http_requests_total', 'Requests by route and status.',
+            ('method', 'route', 'status'))
+        self.statements = Histogram(
+            'db_statements_per_request', 'SQL statements per request.',
+            ('route',), STATEMENT_BUCKETS)
+        self.db_time = Histogram(
+            'db_time_per_request_seconds', 'Time spent in SQL per request.',
+            ('route',), LATENCY_BUCKETS)
+        self.commit_duration = Histogram(
+            'db_commit_duration_seconds', 'Session flush and commit latency.',
+            (), LATENCY_BUCKETS)
+        self.slow_queries = Counter(
+            'db_slow_queries_total', 'Statements slower than the threshold.',
+            ('route',))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in (self.request_duration, self.requests,
+                           self.statements, self.db_time,
+                           self.commit_duration, self.slow_queries):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _current_metrics():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('metrics')
+
+
+def _route():
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return 'none'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters,
+                           context, executemany):
+    if _current_metrics() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters,
+                          context, executemany):
+    metrics = _current_metrics()
+    if metrics is None or not conn.info.get('query_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context():
+        g.metrics_statements = g.get('metrics_statements', 0) + 1
+        g.metrics_db_time = g.get('metrics_db_time', 0.0) + elapsed
+    if elapsed >= metrics.slow_query_seconds:
+        with metrics.lock:
+            metrics.slow_queries.inc(_route())
+        current_app.logger.warning('Slow query in %s (%.1f ms): %s',
+                                   _route(), elapsed * 1000, statement)
+
+
+def _start_commit_timer(session):
+    if _current_metrics() is not None:
+        session.info['commit_started'] = time.perf_counter()
+
+
+def _stop_commit_timer(session):
+    started = session.info.pop('commit_started', None)
+    metrics = _current_metrics()
+    if started is not None and metrics is not None:
+        with metrics.lock:
+            metrics.commit_duration.observe(time.perf_counter() - started)
+
+
+def _observe_request(metrics, method, route, status, request_globals):
+    # ``request_globals`` is the request's g, statements run while a
+    # streamed body is sent keep adding to it
+    elapsed = time.perf_counter() - request_globals.metrics_started
+    with metrics.lock:
+        metrics.request_duration.observe(elapsed, method, route)
+        metrics.requests.inc(method, route, status)
+        metrics.statements.observe(
+            request_globals.get('metrics_statements', 0), route)
+        metrics.db_time.observe(
+            request_globals.get('metrics_db_time', 0.0), route)
+
+
+_events_installed = False
+
+
+def install(app):
+    # Engine and session events are registered once per process, for
+    # every engine and session including the shards', and look the metrics
+    # up through the app context, apps without instrumentation skip them
+    global _events_installed
+    if not _events_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Session, 'before_commit', _start_commit_timer)
+        event.listen(Session, 'after_commit', _stop_commit_timer)
+        _events_installed = True
+
+    metrics = Metrics(app.config['SLOW_QUERY_MS'] / 1000)
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        g.metrics_observed = True
+        observe = (metrics, request.method, _route(), response.status_code,
+                   g._get_current_object())
+        if response.is_streamed:
+            # The body is produced after this hook, the request ends once
+            # it has been sent
+            response.call_on_close(lambda: _observe_request(*observe))
+        else:
+            _observe_request(*observe)
+        return response
+
+    @app.teardown_request
+    def observe_failed_request(exception=None):
+        # A request that raised past the error handlers skips after_request
+        if exception is not None and 'metrics_started' in g \
+                and not g.get('metrics_observed'):
+            _observe_request(metrics, request.method, _route(), 500,
+                             g._get_current_object())
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,341 @@
+"""Versioned schema migrations.
+
+The database records the last applied step in ``schema_version``. Steps
+only ever get appended. The baseline is the schema written out as it was
+when migrations were introduced, so it creates the same tables whenever
+it runs. It also adopts databases made by the old create_all() on
+startup, so it and every later step skip what already exists.
+"""
+import click
+from sqlalchemy import Boolean, CheckConstraint, Column, DateTime, Float, \
+    ForeignKey, Index, Integer, MetaData, String, Table, bindparam, \
+    inspect, select, text
+from sqlalchemy.schema import AddConstraint, CreateTable
+
+from .models import db, Client, ClientParking, ClientParkingHistory, \
+    IdempotencyKey, Parking, Reservation
+from .plates import normalize_plate
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+_metadata = MetaData()
+schema_version = Table('schema_version', _metadata,
+                       Column('version', Integer, nullable=False))
+
+
+def add_column(connection, table_name, column):
+    columns = {c['name'] for c in inspect(connection).get_columns(table_name)}
+    if column.name in columns:
+        return
+    column_type = column.type.compile(connection.dialect)
+    ddl = f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'
+    if column.server_default is not None:
+        ddl += f" DEFAULT '{column.server_default.arg}'"
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    connection.exec_driver_sql(ddl)
+
+
+_baseline = MetaData()
+
+Table('client', _baseline,
+      Column('id', Integer, primary_key=True),
+      Column('name', String(50), nullable=False),
+      Column('surname', String(50), nullable=False),
+      Column('credit_card', String(50)),
+      Column('car_number', String(10)))
+
+Table('parking', _baseline,
+      Column('id', Integer, primary_key=True),
+      Column('address', String(100), nullable=False, unique=True,
+             index=True),
+      Column('opened', Boolean),
+      Column('count_places', Integer, nullable=False),
+      Column('count_available_places', Integer, nullable=False),
+      CheckConstraint('count_available_places >= 0 '
+                      'AND count_available_places <= count_places',
+                      name='ck_parking_available_places'))
+
+Table('client_parking', _baseline,
+      Column('id', Integer, primary_key=True),
+      Column('client_id', Integer, ForeignKey('client.id')),
+      Column('parking_id', Integer, ForeignKey('parking.id')),
+      Column('time_in', DateTime),
+      Column('time_out', DateTime),
+      Index('ix_client_parking_lookup', 'client_id', 'parking_id',
+            'time_out'),
+      Index('uq_client_parking_open', 'client_id', 'parking_id',
+            unique=True, sqlite_where=text('time_out IS NULL'),
+            postgresql_where=text('time_out IS NULL')),
+      Index('ix_client_parking_open_parking', 'parking_id',
+            sqlite_where=text('time_out IS NULL'),
+            postgresql_where=text('time_out IS NULL')),
+      sqlite_autoincrement=True)
+
+Table('client_parking_history', _baseline,
+      Column('id', Integer, primary_key=True, autoincrement=False),
+      Column('client_id', Integer, ForeignKey('client.id')),
+      Column('parking_id', Integer, ForeignKey('parking.id')),
+      Column('time_in', DateTime),
+      Column('time_out', DateTime),
+      Index('ix_client_parking_history_client', 'client_id', 'time_in'),
+      Index('ix_client_parking_history_parking', 'parking_id', 'time_in'))
+
+Table('parking_stats', _baseline,
+      Column('parking_id', Integer, ForeignKey('parking.id'),
+             primary_key=True),
+      Column('bucket', DateTime, primary_key=True),
+      Column('entries', Integer, nullable=False),
+      Column('exits', Integer, nullable=False),
+      Column('stay_seconds', Float, nullable=False),
+      Column('occupied_seconds', Float, nullable=False))
+
+Table('billing_job', _baseline,
+      Column('id', Integer, primary_key=True),
+      Column('client_parking_id', Integer, nullable=False, unique=True),
+      Column('client_id', Integer, ForeignKey('client.id')),
+      Column('parking_id', Integer, ForeignKey('parking.id')),
+      Column('time_in', DateTime),
+      Column('time_out', DateTime, nullable=False),
+      Column('status', String(10), nullable=False),
+      Column('attempts', Integer, nullable=False),
+      Column('next_attempt_at', DateTime, nullable=False),
+      Column('claimed_by', String(32)),
+      Column('amount', Integer),
+      Column('transaction_id', String(64)),
+      Column('last_error', String(200)),
+      Column('processed_at', DateTime),
+      Index('ix_billing_job_due', 'status', 'next_attempt_at'))
+
+Table('resource_version', _baseline,
+      Column('name', String(50), primary_key=True),
+      Column('version', Integer, nullable=False))
+
+
+def baseline(connection):
+    # Also adopts databases made by the old create_all() on startup, which
+    # never created indexes on tables that already existed
+    _baseline.create_all(connection)
+    inspector = inspect(connection)
+    for table in _baseline.sorted_tables:
+        # Indexes on columns added by later steps are created by those steps
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if {c.name for c in index.columns} <= columns:
+                index.create(connection, checkfirst=True)
+    connection.exec_driver_sql(
+        "INSERT INTO resource_version (name, version) SELECT 'clients', 1 "
+        "WHERE NOT EXISTS (SELECT 1 FROM resource_version "
+        "WHERE name = 'clients')")
+
+
+def client_version(connection):
+    add_column(connection, 'client', Client.__table__.c.version)
+
+
+def client_plate(connection, chunk=10_000):
+    add_column(connection, 'client', Client.__table__.c.plate)
+    for index in Client.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    client = Client.__table__
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(client.c.id, client.c.car_number)
+            .where(client.c.id > last_id)
+            .where(client.c.car_number != None)
+            .where(client.c.plate == None)
+            .order_by(client.c.id).limit(chunk)).all()
+        if not rows:
+            return
+        connection.execute(
+            client.update().where(client.c.id == bindparam('client_id'))
+            .values(plate=bindparam('new_plate')),
+            [{'client_id': client_id, 'new_plate': normalize_plate(number)}
+             for client_id, number in rows])
+        last_id = rows[-1][0]
+
+
+def idempotency_keys(connection):
+    IdempotencyKey.__table__.create(connection, checkfirst=True)
+
+
+def reservations(connection):
+    Reservation.__table__.create(connection, checkfirst=True)
+
+
+def parking_version(connection):
+    add_column(connection, 'parking', Parking.__table__.c.version)
+
+
+def _rebuild(connection, table):
+    # SQLite can't add a constraint or AUTOINCREMENT to a table: the model
+    # table is created under another name, the rows are copied over and
+    # it takes the place of the old one
+    old_columns = {c['name'] for c in inspect(connection)
+                   .get_columns(table.name)}
+    metadata = MetaData()
+    for foreign_key in table.foreign_keys:
+        if foreign_key.column.table.name not in metadata.tables:
+            foreign_key.column.table.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f'{table.name}_rebuilt')
+    columns = ', '.join(c.name for c in table.columns
+                        if c.name in old_columns)
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS {new_table.name}')
+    connection.execute(CreateTable(new_table))
+    connection.exec_driver_sql(
+        f'INSERT INTO {new_table.name} ({columns}) '
+        f'SELECT {columns} FROM {table.name}')
+    connection.exec_driver_sql(f'DROP TABLE {table.name}')
+    connection.exec_driver_sql(
+        f'ALTER TABLE {new_table.name} RENAME TO {table.name}')
+    for index in table.indexes:
+        index.create(connection)
+
+
+def legacy_tables(connection):
+    # Tables adopted from create_all() databases predate the check on the
+    # parking counters and AUTOINCREMENT on the log
+    if connection.dialect.name != 'sqlite':
+        checks = {c['name'] for c in inspect(connection)
+                  .get_check_constraints('parking')}
+        for constraint in Parking.__table__.constraints:
+            if isinstance(constraint, CheckConstraint) \
+                    and constraint.name not in checks:
+                connection.execute(AddConstraint(constraint))
+        return
+
+    def table_sql(name):
+        return connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' "
+            "AND name = ?", (name,)).scalar()
+
+    if 'ck_parking_available_places' not in table_sql('parking'):
+        _rebuild(connection, Parking.__table__)
+    if 'AUTOINCREMENT' not in table_sql('client_parking').upper():
+        _rebuild(connection, ClientParking.__table__)
+        # Ids already moved to the history must never be handed out again
+        connection.exec_driver_sql(
+            "DELETE FROM sqlite_sequence WHERE name = 'client_parking'")
+        connection.exec_driver_sql(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT "
+            "'client_parking', MAX("
+            "COALESCE((SELECT MAX(id) FROM client_parking), 0), "
+            "COALESCE((SELECT MAX(id) FROM client_parking_history), 0))")
+
+
+def _create_indexes(connection, table, names):
+    for index in table.__table__.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+def export_indexes(connection):
+    _create_indexes(connection, ClientParking, ('ix_client_parking_time_in',))
+    _create_indexes(connection, ClientParkingHistory,
+                    ('ix_client_parking_history_time_in',))
+
+
+def history_indexes(connection):
+    _create_indexes(connection, ClientParking,
+                    ('ix_client_parking_client', 'ix_client_parking_parking'))
+
+
+def drop_lookup_index(connection):
+    # uq_client_parking_open already serves the open session lookups
+    connection.exec_driver_sql('DROP INDEX IF EXISTS ix_client_parking_lookup')
+
+
+MIGRATIONS = [
+    (1, 'Baseline schema', baseline),
+    (2, 'Client version counter', client_version),
+    (3, 'Normalized client plates', client_plate),
+    (4, 'Idempotency keys', idempotency_keys),
+    (5, 'Reservations', reservations),
+    (6, 'Parking version counter', parking_version),
+    (7, 'Log time_in indexes for exports', export_indexes),
+    (8, 'Rebuild tables adopted without constraints', legacy_tables),
+    (9, 'Hot log indexes for histories', history_indexes),
+    (10, 'Drop the log lookup index', drop_lookup_index),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(connection):
+    if not inspect(connection).has_table('schema_version'):
+        return 0
+    return connection.execute(select(schema_version.c.version)).scalar() or 0
+
+
+def upgrade(engine, target=LATEST, echo=lambda message: None):
+    with engine.begin() as connection:
+        _metadata.create_all(connection)
+        if connection.execute(select(schema_version.c.version)).first() \
+                is None:
+            connection.execute(schema_version.insert().values(version=0))
+
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version > target:
+            break
+        # One transaction per step, a failed step leaves the previous
+        # version recorded
+        with engine.begin() as connection:
+            if current_version(connection) >= version:
+                continue
+            migrate(connection)
+            connection.execute(schema_version.update().values(
+                version=version))
+        echo(f'Applied {version}: {description}')
+        applied.append(version)
+    return applied
+
+
+def check_version(version):
+    if version < LATEST:
+        raise SchemaOutOfDate(
+            f'Database schema is at version {version}, the code needs '
+            f'{LATEST}. Run "flask db upgrade" first.')
+    return version
+
+
+def check(engine):
+    # A version lookup instead of reflecting the whole schema on every boot
+    with engine.connect() as connection:
+        return check_version(current_version(connection))
+
+
+def install(app):
+    @app.cli.group('db')
+    def db_group():
+        """Database schema commands."""
+
+    def engines():
+        # Output is prefixed with the database only when there are shards
+        router = app.extensions.get('shard_router')
+        if router is None:
+            return [('', db.engine)]
+        return [('main: ', db.engine)] + \
+            [(f'shard {i}: ', shard_engine) for i, shard_engine
+             in enumerate(router.engines)]
+
+    @db_group.command('upgrade')
+    @click.option('--target', default=LATEST, show_default=True)
+    def upgrade_command(target):
+        """Apply pending schema migrations."""
+        # Shards carry the whole schema, tables they don't use stay empty
+        for prefix, engine in engines():
+            if not upgrade(engine, target,
+                           echo=lambda message: click.echo(prefix + message)):
+                click.echo(f'{prefix}Schema is up to date')
+
+    @db_group.command('current')
+    def current_command():
+        """Print the schema version of the database."""
+        for prefix, engine in engines():
+            with engine.connect() as connection:
+                click.echo(f'{prefix}{current_version(connection)} '
+                           f'(latest {LATEST})')
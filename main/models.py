@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 
+from .serializers import ColumnSerializer
+
 db = SQLAlchemy()
 
 
@@ -11,31 +13,48 @@ class Client(db.Model):
     surname = db.Column(db.String(50), nullable=False)
     credit_card = db.Column(db.String(50))
     car_number = db.Column(db.String(10))
+    # car_number normalized for lookups, kept in sync by main.plates
+    plate = db.Column(db.String(16), index=True)
+    # Bumped by the ORM on every update, backs the ETags
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
 
     parking = db.relationship('ClientParking', backref='client')
 
-    def to_json(self):
-        return {c.name: getattr(self, c.name) for c in
-                self.__table__.columns}
+    __mapper_args__ = {'version_id_col': version}
+
+    to_json = ColumnSerializer(exclude=('plate', 'version'))
 
 
 class Parking(db.Model):
     __tablename__ = 'parking'
 
     id = db.Column(db.Integer, primary_key=True)
-    address = db.Column(db.String(100), nullable=False)
+    address = db.Column(db.String(100), nullable=False, unique=True,
+                        index=True)
     opened = db.Column(db.Boolean)
     count_places = db.Column(db.Integer, nullable=False)
     count_available_places = db.Column(db.Integer, nullable=False)
+    # Bumped with every write to the counters or opened, so cached copies
+    # can tell which of two values is newer
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
 
     client = db.relationship('ClientParking', backref='parking')
 
-    def to_json(self):
-        return {c.name: getattr(self, c.name) for c in
-                self.__table__.columns}
+    __table_args__ = (
+        db.CheckConstraint(
+            'count_available_places >= 0 '
+            'AND count_available_places <= count_places',
+            name='ck_parking_available_places'),
+    )
+
+    to_json = ColumnSerializer(exclude=('version',))
 
 
 class ClientParking(db.Model):
+    # Hot table: open sessions plus closed ones waiting for compaction
+    # into ClientParkingHistory
     __tablename__ = 'client_parking'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -44,6 +63,137 @@ class ClientParking(db.Model):
     time_in = db.Column(db.DateTime)
     time_out = db.Column(db.DateTime)
 
-    def to_json(self):
-        return {c.name: getattr(self, c.name) for c in
-                self.__table__.columns}
+    __table_args__ = (
+        # Open sessions are a small slice of the log, partial indexes keep
+        # the enter/leave lookups independent of the log size. The unique
+        # one is also the enter/leave lookup, a full (client_id, parking_id,
+        # time_out) index would only add a write to every gate event
+        db.Index('uq_client_parking_open', 'client_id', 'parking_id',
+                 unique=True,
+                 sqlite_where=db.text('time_out IS NULL'),
+                 postgresql_where=db.text('time_out IS NULL')),
+        db.Index('ix_client_parking_open_parking', 'parking_id',
+                 sqlite_where=db.text('time_out IS NULL'),
+                 postgresql_where=db.text('time_out IS NULL')),
+        # Histories page through a client's or a parking's sessions by
+        # time_in, exports read the whole log in that order
+        db.Index('ix_client_parking_client', 'client_id', 'time_in'),
+        db.Index('ix_client_parking_parking', 'parking_id', 'time_in'),
+        db.Index('ix_client_parking_time_in', 'time_in'),
+        # Archived rows keep their ids, so SQLite must never hand out the id
+        # of a row that was moved away
+        {'sqlite_autoincrement': True},
+    )
+
+    to_json = ColumnSerializer()
+
+
+class ClientParkingHistory(db.Model):
+    # Append-only archive of closed sessions
+    __tablename__ = 'client_parking_history'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'))
+    parking_id = db.Column(db.Integer, db.ForeignKey('parking.id'))
+    time_in = db.Column(db.DateTime)
+    time_out = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_client_parking_history_client', 'client_id', 'time_in'),
+        db.Index('ix_client_parking_history_parking', 'parking_id', 'time_in'),
+        db.Index('ix_client_parking_history_time_in', 'time_in'),
+    )
+
+    to_json = ColumnSerializer()
+
+
+class ParkingStats(db.Model):
+    # Hourly rollup of the parking log, maintained by the gates
+    __tablename__ = 'parking_stats'
+
+    parking_id = db.Column(db.Integer, db.ForeignKey('parking.id'),
+                           primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+    exits = db.Column(db.Integer, nullable=False, default=0)
+    # Total stay of the sessions that ended in the bucket
+    stay_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    # Car-seconds spent on the parking within the bucket by closed sessions
+    occupied_seconds = db.Column(db.Float, nullable=False, default=0.0)
+
+    to_json = ColumnSerializer()
+
+
+class BillingJob(db.Model):
+    # Outbox of closed sessions waiting to be charged
+    __tablename__ = 'billing_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    client_parking_id = db.Column(db.Integer, nullable=False, unique=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'))
+    parking_id = db.Column(db.Integer, db.ForeignKey('parking.id'))
+    time_in = db.Column(db.DateTime)
+    time_out = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # When the job is due, or when the lease of a claimed job runs out
+    next_attempt_at = db.Column(db.DateTime, nullable=False)
+    claimed_by = db.Column(db.String(32))
+    amount = db.Column(db.Integer)
+    transaction_id = db.Column(db.String(64))
+    last_error = db.Column(db.String(200))
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_billing_job_due', 'status', 'next_attempt_at'),
+    )
+
+    to_json = ColumnSerializer()
+
+
+class Reservation(db.Model):
+    # A place held for a client at a parking over [starts_at, ends_at),
+    # used_at is set when the client enters on it
+    __tablename__ = 'reservation'
+
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'),
+                          nullable=False)
+    parking_id = db.Column(db.Integer, db.ForeignKey('parking.id'),
+                           nullable=False)
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    used_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_reservation_parking_starts', 'parking_id', 'starts_at'),
+        db.Index('ix_reservation_client', 'client_id', 'parking_id',
+                 'starts_at'),
+    )
+
+    to_json = ColumnSerializer()
+
+
+class ResourceVersion(db.Model):
+    # Version counters of whole collections, e.g. the client list
+    __tablename__ = 'resource_version'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+
+db.event.listen(ResourceVersion.__table__, 'after_create', db.DDL(
+    "INSERT INTO resource_version (name, version) VALUES ('clients', 1)"))
+
+
+class IdempotencyKey(db.Model):
+    # First response to a request sent with an Idempotency-Key header,
+    # status is NULL while the request is still being handled
+    __tablename__ = 'idempotency_key'
+
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,36 @@
+from sqlalchemy import event
+
+from .models import Client
+
+
+# Cyrillic letters that look like Latin ones on Russian plates
+_LOOKALIKES = str.maketrans('АВЕКМНОРСТУХ', 'ABEKMHOPCTYX')
+
+
+def normalize_plate(value):
+    if not value:
+        return None
+    plate = ''.join(ch for ch in value.upper().translate(_LOOKALIKES)
+                    if ch.isalnum())
+    return plate or None
+
+
+def find_clients(session, plate):
+    # Always answered by the indexed column: clients added by bulk imports
+    # or other workers are seen at once
+    return session.query(Client).filter(Client.plate == plate)\
+        .order_by(Client.id).all()
+
+
+def _set_plate(client, value, oldvalue, initiator):
+    client.plate = normalize_plate(value)
+
+
+_events_installed = False
+
+
+def install_session_events():
+    global _events_installed
+    if not _events_installed:
+        event.listen(Client.car_number, 'set', _set_plate)
+        _events_installed = True
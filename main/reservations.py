@@ -0,0 +1,296 @@
+import bisect
+import datetime
+import threading
+
+from .models import Client, Parking, Reservation
+
+
+# Cars parked now are assumed to stay this long, and walk-ins may not
+# take places reserved within it
+RESERVATION_HORIZON = datetime.timedelta(hours=1)
+# How early a client may enter on their reservation
+RESERVATION_EARLY = datetime.timedelta(minutes=15)
+RESERVATION_MAX_LENGTH = datetime.timedelta(hours=24)
+RESERVATION_MAX_WINDOW = datetime.timedelta(days=7)
+RESERVATION_PRUNE_EVERY = datetime.timedelta(minutes=5)
+
+
+def _failure(reason, status):
+    return {'success': False, 'reason': reason}, status
+
+
+class Timeline:
+    """Number of reservations held at a parking, as a step function.
+
+    ``counts[i]`` is the number held over ``[times[i], times[i + 1])``.
+    Every reservation adds breakpoints at its ends, so a query only walks
+    the steps inside the asked window.
+    """
+
+    def __init__(self):
+        self.times = []
+        self.counts = []
+
+    @classmethod
+    def build(cls, intervals):
+        # Sweep over the sorted ends instead of inserting one by one
+        deltas = {}
+        for start, end in intervals:
+            deltas[start] = deltas.get(start, 0) + 1
+            deltas[end] = deltas.get(end, 0) - 1
+        timeline = cls()
+        held = 0
+        for time in sorted(deltas):
+            held += deltas[time]
+            timeline.times.append(time)
+            timeline.counts.append(held)
+        return timeline
+
+    def _split(self, time):
+        i = bisect.bisect_left(self.times, time)
+        if i == len(self.times) or self.times[i] != time:
+            self.times.insert(i, time)
+            self.counts.insert(i, self.counts[i - 1] if i else 0)
+        return i
+
+    def add(self, start, end, delta=1):
+        i = self._split(start)
+        j = self._split(end)
+        for k in range(i, j):
+            self.counts[k] += delta
+
+    def peak(self, start, end):
+        i = max(bisect.bisect_right(self.times, start) - 1, 0)
+        j = bisect.bisect_left(self.times, end)
+        return max(self.counts[i:j], default=0)
+
+    def prune(self, before):
+        # Keeps the step that contains ``before``, reservations that ended
+        # earlier don't reach it
+        i = bisect.bisect_right(self.times, before) - 1
+        if i > 0:
+            del self.times[:i]
+            del self.counts[:i]
+
+
+class ReservationIndex:
+    """Per-parking timelines of the reservations not used yet.
+
+    Built from the database at startup; ``sync`` picks up reservations
+    made by other processes and is called before every admission. A
+    reservation used elsewhere keeps counting here until it ends, which
+    only makes this process stricter.
+    """
+
+    def __init__(self, horizon=RESERVATION_HORIZON, early=RESERVATION_EARLY):
+        self.horizon = horizon
+        self.early = early
+        self._timelines = {}
+        self._reservations = {}
+        self._synced_id = 0
+        self._pruned_at = None
+        self._lock = threading.Lock()
+        # Held from the capacity check until the reservation is indexed.
+        # It only orders this process, ``reserve`` recounts in the database
+        self.booking = threading.Lock()
+
+    def __len__(self):
+        return len(self._reservations)
+
+    def add(self, reservation_id, parking_id, start, end):
+        with self._lock:
+            self._add(reservation_id, parking_id, start, end)
+
+    def _add(self, reservation_id, parking_id, start, end):
+        if reservation_id in self._reservations:
+            return
+        self._reservations[reservation_id] = (parking_id, start, end)
+        self._timelines.setdefault(parking_id, Timeline()).add(start, end)
+
+    def remove(self, reservation_id):
+        with self._lock:
+            entry = self._reservations.pop(reservation_id, None)
+            if entry is not None:
+                parking_id, start, end = entry
+                self._timelines[parking_id].add(start, end, -1)
+
+    def peak(self, parking_id, start, end):
+        with self._lock:
+            timeline = self._timelines.get(parking_id)
+            return timeline.peak(start, end) if timeline else 0
+
+    def sync(self, session, now):
+        rows = session.query(Reservation.id, Reservation.parking_id,
+                             Reservation.starts_at, Reservation.ends_at)\
+            .filter(Reservation.id > self._synced_id)\
+            .filter(Reservation.ends_at > now)\
+            .filter(Reservation.used_at == None)\
+            .order_by(Reservation.id).all()
+        with self._lock:
+            if not self._reservations:
+                by_parking = {}
+                for row in rows:
+                    self._reservations[row.id] = (row.parking_id,
+                                                  row.starts_at, row.ends_at)
+                    by_parking.setdefault(row.parking_id, []).append(
+                        (row.starts_at, row.ends_at))
+                self._timelines = {parking_id: Timeline.build(intervals)
+                                   for parking_id, intervals
+                                   in by_parking.items()}
+            else:
+                for row in rows:
+                    self._add(row.id, row.parking_id, row.starts_at,
+                              row.ends_at)
+            if rows:
+                self._synced_id = max(self._synced_id, rows[-1].id)
+            if self._pruned_at is None \
+                    or now - self._pruned_at >= RESERVATION_PRUNE_EVERY:
+                self._prune(now)
+        return len(rows)
+
+    def _prune(self, now):
+        self._pruned_at = now
+        for reservation_id, (_, _, end) in list(self._reservations.items()):
+            if end <= now:
+                del self._reservations[reservation_id]
+        for timeline in self._timelines.values():
+            timeline.prune(now)
+
+
+def free_places(index, parking, start, end, now, reserved=None):
+    occupied = parking.count_places - parking.count_available_places
+    live = occupied if start < now + index.horizon else 0
+    if reserved is None:
+        reserved = index.peak(parking.id, start, end)
+    return max(0, parking.count_places - live - reserved)
+
+
+def reserved_peak(session, parking_id, start, end):
+    # Same count as ReservationIndex.peak, straight from the table
+    held = session.query(Reservation.starts_at, Reservation.ends_at)\
+        .filter(Reservation.parking_id == parking_id)\
+        .filter(Reservation.used_at == None)\
+        .filter(Reservation.starts_at < end)\
+        .filter(Reservation.starts_at > start - RESERVATION_MAX_LENGTH)\
+        .filter(Reservation.ends_at > start).all()
+    return Timeline.build(held).peak(start, end)
+
+
+def admit(session, index, parking, client_id, now, available=None):
+    # Returns the reservation the client enters on, or the rejection of a
+    # walk-in that would take a reserved place
+    if index is None:
+        return None, None
+    if index.peak(parking.id, now, now + index.early):
+        reservation = session.query(Reservation)\
+            .filter(Reservation.client_id == client_id)\
+            .filter(Reservation.parking_id == parking.id)\
+            .filter(Reservation.used_at == None)\
+            .filter(Reservation.starts_at < now + index.early)\
+            .filter(Reservation.ends_at > now)\
+            .order_by(Reservation.starts_at).first()
+        if reservation:
+            return reservation, None
+
+    if available is None:
+        available = parking.count_available_places
+    occupied = parking.count_places - available
+    reserved = index.peak(parking.id, now, now + index.horizon)
+    if reserved and occupied + reserved >= parking.count_places:
+        return None, _failure('Remaining places are reserved', 409)
+    return None, None
+
+
+def parse_reservation(data, now):
+    try:
+        starts_at = datetime.datetime.fromisoformat(data['starts_at'])
+        ends_at = datetime.datetime.fromisoformat(data['ends_at'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('"starts_at" and "ends_at" have to be ISO 8601 '
+                         'datetimes')
+    if starts_at >= ends_at:
+        raise ValueError('"starts_at" has to be before "ends_at"')
+    if ends_at <= now:
+        raise ValueError('Reservation has to end in the future')
+    if ends_at - starts_at > RESERVATION_MAX_LENGTH:
+        raise ValueError('Reservation cannot be longer than '
+                         f'{RESERVATION_MAX_LENGTH}')
+    return starts_at, ends_at
+
+
+def parse_window(args, now):
+    try:
+        start = datetime.datetime.fromisoformat(args['from']) \
+            if args.get('from') else now
+        end = datetime.datetime.fromisoformat(args['to']) \
+            if args.get('to') else start + RESERVATION_HORIZON
+    except ValueError:
+        raise ValueError('"from" and "to" have to be ISO 8601 datetimes')
+    if start >= end:
+        raise ValueError('"from" has to be before "to"')
+    if end - start > RESERVATION_MAX_WINDOW:
+        raise ValueError(f'Window cannot be longer than '
+                         f'{RESERVATION_MAX_WINDOW}')
+    return start, end
+
+
+def reserve(session, index, parking_id, client_id, starts_at, ends_at, now,
+            client_session=None):
+    client_session = session if client_session is None else client_session
+    parking = session.query(Parking).get(parking_id)
+    if not parking:
+        return _failure('Parking doesn\'t exist', 404)
+    if not parking.opened:
+        return _failure('Parking is closed', 409)
+    client = client_session.query(Client).get(client_id)
+    if not client:
+        return _failure('Client doesn\'t exist', 404)
+    if not client.car_number:
+        return _failure('Cannot reserve a place without car', 409)
+
+    with index.booking:
+        index.sync(session, now)
+        overlapping = session.query(Reservation.id)\
+            .filter(Reservation.client_id == client_id)\
+            .filter(Reservation.parking_id == parking_id)\
+            .filter(Reservation.used_at == None)\
+            .filter(Reservation.starts_at < ends_at)\
+            .filter(Reservation.starts_at
+                    > starts_at - RESERVATION_MAX_LENGTH)\
+            .filter(Reservation.ends_at > starts_at).first()
+        if overlapping:
+            return _failure('Client already has a reservation for this time',
+                            409)
+        if not free_places(index, parking, starts_at, ends_at, now):
+            return _failure('No places left for this time', 409)
+
+        # Other processes book into the same table: lock the parking row
+        # (the insert takes the write lock on SQLite) and recount there,
+        # this reservation included
+        session.query(Parking.id).filter(Parking.id == parking_id)\
+            .with_for_update().one()
+        reservation = Reservation(client_id=client_id, parking_id=parking_id,
+                                  starts_at=starts_at, ends_at=ends_at,
+                                  created_at=now)
+        session.add(reservation)
+        session.flush()
+        held = reserved_peak(session, parking_id, starts_at, ends_at)
+        if not free_places(index, parking, starts_at, ends_at, now,
+                           held - 1):
+            session.rollback()
+            return _failure('No places left for this time', 409)
+        session.commit()
+        index.add(reservation.id, parking_id, starts_at, ends_at)
+
+    return {'success': True, 'reservation': reservation.to_json()}, 201
+
+
+def reservations_in(session, parking_id, start, end):
+    # Reservations are at most RESERVATION_MAX_LENGTH long, which bounds
+    # the scan of the (parking_id, starts_at) index
+    return session.query(Reservation)\
+        .filter(Reservation.parking_id == parking_id)\
+        .filter(Reservation.starts_at < end)\
+        .filter(Reservation.starts_at > start - RESERVATION_MAX_LENGTH)\
+        .filter(Reservation.ends_at > start)\
+        .order_by(Reservation.starts_at, Reservation.id).all()
@@ -0,0 +1,219 @@
+import datetime
+
+import click
+from sqlalchemy import select, union, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, ClientParking, ClientParkingHistory, Parking, \
+    ParkingStats
+
+
+REBUILD_CHUNK = 10000
+STATS_MAX_BUCKETS = 24 * 31
+
+HOUR = datetime.timedelta(hours=1)
+BUCKETS = {'hour': HOUR, 'day': datetime.timedelta(days=1)}
+
+_COUNTERS = ('entries', 'exits', 'stay_seconds', 'occupied_seconds')
+_UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_bucket(moment, bucket):
+    moment = floor_hour(moment)
+    return moment.replace(hour=0) if bucket == 'day' else moment
+
+
+def _occupancy(time_in, time_out):
+    # Splits a stay into the seconds it spent in every hour it touched
+    hour = floor_hour(time_in)
+    while hour < time_out:
+        start = max(hour, time_in)
+        end = min(hour + HOUR, time_out)
+        yield hour, (end - start).total_seconds()
+        hour += HOUR
+
+
+class RollupDeltas:
+    """Counter increments per (parking, hour), written as one upsert."""
+
+    def __init__(self):
+        self.deltas = {}
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def _add(self, parking_id, bucket, entries=0, exits=0, stay_seconds=0.0,
+             occupied_seconds=0.0):
+        counters = self.deltas.setdefault((parking_id, bucket),
+                                          [0, 0, 0.0, 0.0])
+        counters[0] += entries
+        counters[1] += exits
+        counters[2] += stay_seconds
+        counters[3] += occupied_seconds
+
+    def entry(self, parking_id, time_in):
+        self._add(parking_id, floor_hour(time_in), entries=1)
+
+    def exit(self, parking_id, time_in, time_out):
+        # time_in is nullable, such sessions only count as an exit
+        if time_in is None:
+            self._add(parking_id, floor_hour(time_out), exits=1)
+            return
+        self._add(parking_id, floor_hour(time_out), exits=1,
+                  stay_seconds=(time_out - time_in).total_seconds())
+        for hour, seconds in _occupancy(time_in, time_out):
+            self._add(parking_id, hour, occupied_seconds=seconds)
+
+    def apply(self, session):
+        if not self.deltas:
+            return
+        table = ParkingStats.__table__
+        insert = _UPSERTS[session.connection().dialect.name](table)
+        upsert = insert.on_conflict_do_update(
+            index_elements=[table.c.parking_id, table.c.bucket],
+            set_={name: table.c[name] + insert.excluded[name]
+                  for name in _COUNTERS})
+        session.execute(upsert, [
+            dict(zip(_COUNTERS, counters), parking_id=parking_id,
+                 bucket=bucket)
+            for (parking_id, bucket), counters in self.deltas.items()])
+        self.deltas = {}
+
+
+def record_entry(session, parking_id, time_in):
+    deltas = RollupDeltas()
+    deltas.entry(parking_id, time_in)
+    deltas.apply(session)
+
+
+def record_exit(session, parking_id, time_in, time_out):
+    deltas = RollupDeltas()
+    deltas.exit(parking_id, time_in, time_out)
+    deltas.apply(session)
+
+
+def _rebuild_parking(session, parking_id, chunk_size):
+    # Parking rows are locked the way the gates lock them, and the old
+    # rollups deleted, before the log is read: on SQLite the delete takes
+    # the write lock. A gate event is either in the log read here or waits
+    # and is upserted over the rebuilt rows, it is never lost
+    session.query(Parking.id).filter(Parking.id == parking_id)\
+        .with_for_update().first()
+    session.query(ParkingStats)\
+        .filter(ParkingStats.parking_id == parking_id)\
+        .delete(synchronize_session=False)
+
+    columns = ('parking_id', 'time_in', 'time_out')
+    log = union_all(*[
+        select(*[model.__table__.c[name] for name in columns])
+        .where(model.parking_id == parking_id)
+        for model in (ClientParking, ClientParkingHistory)])
+    rows = session.execute(log.execution_options(yield_per=chunk_size))
+    processed = 0
+    deltas = RollupDeltas()
+    for partition in rows.partitions():
+        for parking_id, time_in, time_out in partition:
+            if time_in is not None:
+                deltas.entry(parking_id, time_in)
+            if time_out is not None:
+                deltas.exit(parking_id, time_in, time_out)
+        processed += len(partition)
+        # Partial sums are added up by the upsert, memory stays bounded
+        # by the chunk instead of the parking's whole log
+        deltas.apply(session)
+    session.commit()
+    return processed
+
+
+def rebuild(session=None, chunk_size=REBUILD_CHUNK, after_id=None):
+    # Recomputes the rollups from the hot log and its history, one short
+    # transaction per parking so gates keep writing in between. Readers
+    # see each parking either before or after its rebuild. ``after_id``
+    # resumes a rebuild that stopped after that parking
+    session = db.session if session is None else session
+    parking_ids = union(select(Parking.id),
+                        select(ParkingStats.parking_id)).subquery()
+    query = select(parking_ids.c[0]).order_by(parking_ids.c[0])
+    if after_id is not None:
+        query = query.where(parking_ids.c[0] > after_id)
+    processed = 0
+    for parking_id in session.execute(query).scalars().all():
+        processed += _rebuild_parking(session, parking_id, chunk_size)
+    return processed
+
+
+def parse_stats_args(args, now):
+    bucket = args.get('bucket', 'hour')
+    if bucket not in BUCKETS:
+        raise ValueError('"bucket" has to be "hour" or "day"')
+    try:
+        end = datetime.datetime.fromisoformat(args['to']) \
+            if args.get('to') else now
+        start = datetime.datetime.fromisoformat(args['from']) \
+            if args.get('from') else end - BUCKETS['day']
+    except ValueError:
+        raise ValueError('"from" and "to" have to be ISO 8601 datetimes')
+    if start >= end:
+        raise ValueError('"from" has to be before "to"')
+    start = floor_bucket(start, bucket)
+    if (end - start) / BUCKETS[bucket] > STATS_MAX_BUCKETS:
+        raise ValueError(f'Cannot return more than {STATS_MAX_BUCKETS} '
+                         'buckets at once')
+    return start, end, bucket
+
+
+def parking_stats(session, parking, start, end, bucket, now):
+    step = BUCKETS[bucket]
+    buckets = {}
+    moment = start
+    while moment < end:
+        buckets[moment] = [0, 0, 0.0, 0.0]
+        moment += step
+
+    rows = session.query(ParkingStats.bucket,
+                         *[getattr(ParkingStats, name) for name in _COUNTERS])\
+        .filter(ParkingStats.parking_id == parking.id)\
+        .filter(ParkingStats.bucket >= start)\
+        .filter(ParkingStats.bucket < end)
+    for hour, *counters in rows:
+        totals = buckets[floor_bucket(hour, bucket)]
+        for i, value in enumerate(counters):
+            totals[i] += value
+
+    # Open sessions only reach the rollups when they close, their share of
+    # the occupancy is added here from the open-session index
+    open_sessions = session.query(ClientParking.time_in)\
+        .filter(ClientParking.parking_id == parking.id)\
+        .filter(ClientParking.time_out == None)\
+        .filter(ClientParking.time_in != None)
+    for (time_in,) in open_sessions:
+        for hour, seconds in _occupancy(max(time_in, start), min(now, end)):
+            buckets[floor_bucket(hour, bucket)][3] += seconds
+
+    return [{'bucket_start': moment,
+             'entries': entries,
+             'exits': exits,
+             'turnover': entries / parking.count_places,
+             'average_stay_seconds': stay / exits if exits else None,
+             'average_occupancy': occupied / step.total_seconds(),
+             'occupancy_rate': occupied / step.total_seconds()
+             / parking.count_places}
+            for moment, (entries, exits, stay, occupied) in buckets.items()]
+
+
+def install(app):
+    @app.cli.command('rebuild-parking-stats')
+    @click.option('--chunk-size', default=REBUILD_CHUNK, show_default=True)
+    @click.option('--after-id', type=int,
+                  help='Resume a rebuild that stopped after this parking.')
+    def rebuild_parking_stats(chunk_size, after_id):
+        """Recompute the hourly parking rollups from the parking log."""
+        router = app.extensions.get('shard_router')
+        sessions = [db.session] + (router.sessions if router else [])
+        processed = sum(rebuild(session, chunk_size, after_id)
+                        for session in sessions)
+        click.echo(f'Rebuilt parking stats from {processed} sessions')
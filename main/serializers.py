@@ -0,0 +1,120 @@
+import datetime
+import re
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    # Same output as werkzeug.http.http_date without the email.utils detour
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    elif value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return f'{_WEEKDAYS[value.weekday()]}, {value.day:02d} ' \
+           f'{_MONTHS[value.month - 1]} {value.year:04d} ' \
+           f'{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT'
+
+
+def make_serializer(columns, exclude=()):
+    # The column names are collected once per model instead of walking the
+    # table for every row
+    names = tuple(c.name for c in columns if c.name not in exclude)
+
+    def to_json(obj):
+        return {name: getattr(obj, name) for name in names}
+    return to_json
+
+
+class ColumnSerializer:
+    """``to_json`` for a model, built from its table on first use."""
+
+    def __init__(self, exclude=()):
+        self.exclude = exclude
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        serializer = make_serializer(owner.__table__.columns, self.exclude)
+        # Replace the descriptor, later lookups hit the plain function
+        setattr(owner, self.name, serializer)
+        return serializer.__get__(obj, owner)
+
+
+# Everything the default provider escapes with ensure_ascii
+_ESCAPED = re.compile('[^\x00-\x7e]')
+
+
+def _escape(match):
+    code = ord(match.group())
+    if code < 0x10000:
+        return f'\\u{code:04x}'
+    code -= 0x10000
+    return f'\\u{0xd800 | code >> 10:04x}\\u{0xdc00 | code & 0x3ff:04x}'
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Same output as the default provider, encoded by orjson.
+
+    Dates still go through ``default`` so they keep the HTTP date format,
+    and non-ASCII characters are escaped afterwards like ``ensure_ascii``
+    does. Objects orjson refuses, such as non-str keys, are left to the
+    default provider. Floats are the one difference: exponents are
+    written the short way (``1e16``, not ``1e+16``) and NaN and the
+    infinities become ``null``.
+    """
+
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS \
+        if orjson else 0
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime.date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        option = self.option
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        elif kwargs.get('separators') != (',', ':'):
+            # orjson only writes the compact and the indented layouts
+            return super().dumps(obj, **kwargs)
+        if set(kwargs) - {'separators', 'indent'}:
+            return super().dumps(obj, **kwargs)
+        try:
+            encoded = orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, **kwargs)
+        text = encoded.decode()
+        # Non-ASCII only ever appears inside strings
+        if not encoded.isascii() or '\x7f' in text:
+            text = _ESCAPED.sub(_escape, text)
+        return text
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def install_json_provider(app):
+    backend = app.config['JSON_BACKEND']
+    if backend == 'auto':
+        backend = 'orjson' if orjson else 'default'
+    if backend == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_BACKEND "orjson" requires orjson')
+        app.json = OrjsonProvider(app)
+    elif backend != 'default':
+        raise ValueError(f'Unknown JSON_BACKEND {backend!r}')
@@ -0,0 +1,197 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from . import engine, gate, history, listing, reservations
+from .models import db, Client, Parking
+
+
+SHARD_CREATE_ATTEMPTS = 3
+
+
+class ShardRouter:
+    """Sessions for a deployment split into databases by parking.
+
+    A parking and everything recorded about it (its log, counters, stats,
+    reservations and billing jobs) live in shard ``parking_id %
+    len(shards)``; clients stay in the main database. Parking ids are
+    allocated so that they land in the shard that stores them. Every shard
+    has its own reservation index, reservation ids are per shard. Reads
+    that span parkings run on every shard at once through ``fan_out``.
+    """
+
+    def __init__(self, app, uris):
+        self.engines = [create_engine(engine._absolute_uri(app, uri),
+                                      **engine.engine_options(app.config,
+                                                              uri))
+                        for uri in uris]
+        self.sessions = [scoped_session(sessionmaker(bind=shard_engine))
+                         for shard_engine in self.engines]
+        self.reservations = [reservations.ReservationIndex(
+            app.config['RESERVATION_HORIZON'],
+            app.config['RESERVATION_EARLY']) for _ in uris]
+        self._pool = ThreadPoolExecutor(len(uris),
+                                        thread_name_prefix='shard')
+
+    def __len__(self):
+        return len(self.engines)
+
+    def shard_for(self, parking_id):
+        return parking_id % len(self.engines)
+
+    def session(self, parking_id):
+        return self.sessions[self.shard_for(parking_id)]
+
+    def reservation_index(self, parking_id):
+        return self.reservations[self.shard_for(parking_id)]
+
+    def fan_out(self, read):
+        # Results are in shard order
+        return list(self._pool.map(self._read, self.sessions,
+                                   [read] * len(self.sessions)))
+
+    def _read(self, session, read):
+        try:
+            return read(session)
+        finally:
+            session.remove()
+
+    def remove(self):
+        for session in self.sessions:
+            session.remove()
+
+    def close(self):
+        self._pool.shutdown()
+        for shard_engine in self.engines:
+            shard_engine.dispose()
+
+
+def _shard_stats(address):
+    def read(session):
+        taken = session.query(Parking.id)\
+            .filter(Parking.address == address).first() is not None
+        last_id = session.query(func.max(Parking.id)).scalar() or 0
+        return taken, last_id
+    return read
+
+
+def create_parking(router, address, opened, count_places):
+    # Every shard offers the next id that maps to it and the lowest one
+    # wins, so ids stay dense and parkings spread evenly. Racing creators
+    # collide on the primary key or the address index and start over.
+    # None means the address is taken
+    for attempt in range(SHARD_CREATE_ATTEMPTS):
+        stats = router.fan_out(_shard_stats(address))
+        if any(taken for taken, _ in stats):
+            return None
+        parking_id = min(last_id + ((shard - last_id) % len(router)
+                                    or len(router))
+                         for shard, (_, last_id) in enumerate(stats))
+
+        session = router.session(parking_id)
+        parking = Parking(id=parking_id, address=address, opened=opened,
+                          count_places=count_places,
+                          count_available_places=count_places)
+        session.add(parking)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            if attempt == SHARD_CREATE_ATTEMPTS - 1:
+                raise
+            continue
+        return parking
+
+
+def move(router, action, client_id, parking_id):
+    # The parking's shard does the write, the client is read from the
+    # main database
+    session = router.session(parking_id)
+    if action == 'enter':
+        return gate.enter(client_id, parking_id,
+                          router.reservation_index(parking_id),
+                          session=session, client_session=db.session)
+    return gate.leave(client_id, parking_id, session=session,
+                      client_session=db.session)
+
+
+def _event_shard(router, event):
+    # Events the gate will reject go with the first shard's
+    try:
+        return router.shard_for(gate.parse_id(event.get('parking_id'),
+                                              'parking_id'))
+    except (AttributeError, ValueError):
+        return 0
+
+
+def apply_events(router, events):
+    # One transaction per shard. Shards commit independently, so when one
+    # keeps conflicting only its events are answered with a retry
+    results = [None] * len(events)
+    by_shard = {}
+    for i, event in enumerate(events):
+        by_shard.setdefault(_event_shard(router, event), []).append(i)
+    for shard, positions in sorted(by_shard.items()):
+        shard_results = gate.apply_events(
+            [events[i] for i in positions], router.reservations[shard],
+            session=router.sessions[shard], client_session=db.session)
+        for n, i in enumerate(positions):
+            results[i] = shard_results[n] if shard_results is not None \
+                else ({'success': False,
+                       'reason': 'Batch conflicted with concurrent updates, '
+                                 'retry it'}, 409)
+    return results
+
+
+def sync_reservations(router, now):
+    for session, index in zip(router.sessions, router.reservations):
+        index.sync(session, now)
+    router.remove()
+
+
+def parking_sessions(router, parking_id, before=None, before_id=None,
+                     limit=history.HISTORY_PAGE_LIMIT, open_only=False):
+    # The log is read from the parking's shard, the clients from the main
+    # database
+    rows = router.session(parking_id).execute(history.sessions_query(
+        'parking_id', parking_id, before, before_id, limit, open_only,
+        join=False)).all()
+    clients = {client.id: client for client in db.session.query(
+        Client.id, Client.name, Client.surname, Client.car_number)
+        .filter(Client.id.in_({row.client_id for row in rows}))}
+    return [history.parking_session(row, clients[row.client_id])
+            for row in rows if row.client_id in clients]
+
+
+def occupancy_rows(router, parking_id=None):
+    if parking_id is not None:
+        return listing.occupancy_rows(router.session(parking_id), parking_id)
+    return list(heapq.merge(*router.fan_out(listing.occupancy_rows)))
+
+
+def client_visits(router, client_id, before=None, before_id=None,
+                  limit=history.HISTORY_PAGE_LIMIT):
+    pages = router.fan_out(lambda session: history.client_visits(
+        session, client_id, before, before_id, limit))
+    # Every page is newest first already
+    merged = heapq.merge(*pages, key=history.page_order, reverse=True)
+    return [visit for _, visit in zip(range(limit), merged)]
+
+
+def parking_rows(router):
+    return list(heapq.merge(*router.fan_out(listing.parking_rows)))
+
+
+def install(app):
+    app.config.setdefault('SHARD_DATABASE_URIS', None)
+    uris = app.config['SHARD_DATABASE_URIS']
+    if uris:
+        router = ShardRouter(app, uris)
+        app.extensions['shard_router'] = router
+
+        @app.teardown_appcontext
+        def shutdown_shard_sessions(exception=None):
+            router.remove()
@@ -2,14 +2,25 @@ import datetime
 import time
 
 import pytest
+from sqlalchemy import event
 
 from module_29_testing.hw.main.app import create_app, db as _db
 from module_29_testing.hw.main.models import Client, Parking, ClientParking
 
 
+def pytest_generate_tests(metafunc):
+    # Group commit must not change any gate response, the gate tests run
+    # once more with it on
+    if metafunc.definition.get_closest_marker('parking') \
+            and 'app' in metafunc.fixturenames:
+        metafunc.parametrize('app', [False, True], indirect=True,
+                             ids=['direct', 'group_commit'])
+
+
 @pytest.fixture
-def app():
-    _app = create_app()
+def app(request):
+    _app = create_app({'SCHEMA_CHECK': False,
+                       'GROUP_COMMIT': getattr(request, 'param', False)})
     _app.config['TESTING'] = True
     _app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
 
@@ -37,6 +48,8 @@ def app():
 
         _db.session.close()
         _db.drop_all()
+    if 'group_committer' in _app.extensions:
+        _app.extensions['group_committer'].close()
 
 
 @pytest.fixture
@@ -49,3 +62,58 @@ def client(app):
 def db(app):
     with app.app_context():
         yield _db
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # Apps on a database file, for tests where threads, shards or replicas
+    # need more than the one connection an in-memory database has. The
+    # app context stays pushed until the test is over
+    contexts = []
+
+    def make(config=None, create_tables=True):
+        _app = create_app(dict({'TESTING': True,
+                                'SCHEMA_CHECK': False,
+                                'SQLALCHEMY_DATABASE_URI':
+                                    f'sqlite:///{tmp_path / "app.db"}'},
+                               **(config or {})))
+        context = _app.app_context()
+        context.push()
+        contexts.append(context)
+        if create_tables:
+            _db.create_all()
+        return _app
+
+    yield make
+    for context in reversed(contexts):
+        _db.session.remove()
+        _db.drop_all()
+        context.pop()
+
+
+class Statements(list):
+    """SQL run by an engine, ``parameters`` lines up with the statements."""
+
+    def __init__(self):
+        super().__init__()
+        self.parameters = []
+
+    def clear(self):
+        super().clear()
+        self.parameters.clear()
+
+
+@pytest.fixture
+def statements(app):
+    # Every statement the app runs from here on
+    with app.app_context():
+        engine = _db.engine
+    recorded = Statements()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+        recorded.parameters.append(parameters)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield recorded
+    event.remove(engine, 'before_cursor_execute', record)
@@ -1,8 +1,9 @@
+import datetime
 import random
 
 import factory
 
-from module_29_testing.hw.main.models import Client, db, Parking
+from module_29_testing.hw.main.models import Client, db, Parking, ClientParking
 
 
 class ClientFactory(factory.alchemy.SQLAlchemyModelFactory):
@@ -30,10 +31,22 @@ class ParkingFactory(factory.alchemy.SQLAlchemyModelFactory):
     address = factory.Faker('address')
     opened = True
     count_places = factory.LazyAttribute(lambda i: random.randint(1, 100))
-    count_available_places = count_places
+    count_available_places = factory.SelfAttribute('count_places')
 
     def to_json(self):
         return {'address': self.address,
                 'opened': self.opened,
                 'count_places': self.count_places,
-                'count_available_places': self.count_available_places}
\ No newline at end of file
+                'count_available_places': self.count_available_places}
+
+
+class ClientParkingFactory(factory.alchemy.SQLAlchemyModelFactory):
+    class Meta:
+        model = ClientParking
+        sqlalchemy_session = db.session
+
+    client = factory.SubFactory(ClientFactory)
+    parking = factory.SubFactory(ParkingFactory)
+    time_in = factory.Faker('date_time_between', start_date='-1y')
+    time_out = factory.LazyAttribute(
+        lambda i: i.time_in + datetime.timedelta(minutes=random.randint(5, 600)))
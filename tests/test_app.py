@@ -11,6 +11,37 @@ def test_all_get_return_200(client, route):
     assert response.status_code == 200
 
 
+def test_clients_keyset_pagination(client):
+    first_page = client.get('/clients?limit=1')
+    assert first_page.status_code == 200
+    assert [c['id'] for c in first_page.json] == [1]
+    assert 'after_id=1' in first_page.headers['Link']
+
+    second_page = client.get('/clients?after_id=1&limit=1')
+    assert [c['id'] for c in second_page.json] == [2]
+
+    last_page = client.get('/clients?after_id=2&limit=1')
+    assert last_page.json == []
+    assert 'Link' not in last_page.headers
+
+
+def test_clients_limit_has_to_be_positive(client):
+    response = client.get('/clients?limit=0')
+
+    assert response.status_code == 400
+    assert response.json['success'] == False
+
+
+def test_clients_stream(client):
+    streamed = client.get('/clients?stream=1')
+    assert streamed.status_code == 200
+    assert streamed.is_streamed
+    assert streamed.json == client.get('/clients').json
+
+    streamed = client.get('/clients?stream=1&after_id=1')
+    assert [c['id'] for c in streamed.json] == [2]
+
+
 def test_create_client(client):
     client_to_create = {'name': 'test',
                         'surname': 'test',
@@ -213,6 +244,8 @@ def test_available_places_reducing_when_enter_parking(client, db):
     enter = client.post('/client_parkings', json={'client_id': 1,
                                                   'parking_id': 1})
     assert enter.status_code == 201
+    # Group commit writes from its own thread and session
+    db.session.refresh(parking)
     assert parking.count_available_places < initial_places
 
 
@@ -225,6 +258,7 @@ def test_available_places_increasing_when_leave_parking(client, db):
                                                   'parking_id': 1})
     assert leave.status_code == 200
 
+    db.session.refresh(parking)
     assert parking.count_available_places > initial_places
 
 
@@ -293,3 +327,127 @@ def test_cannot_leave_without_parking_id_provided(client):
     assert leave.status_code == 400
     assert leave.json['success'] == False
     assert leave.json['reason'] == 'Need to specify parking_id'
+
+
+@pytest.mark.parking
+def test_batch_enter_and_leave(client, db):
+    batch = client.post('/client_parkings/batch', json={'events': [
+        {'action': 'leave', 'client_id': 2, 'parking_id': 1},
+        {'action': 'enter', 'client_id': 1, 'parking_id': 1},
+        {'action': 'enter', 'client_id': 2, 'parking_id': 1},
+        {'action': 'enter', 'client_id': 42, 'parking_id': 1},
+        {'action': 'leave', 'client_id': 1},
+        {'action': 'park', 'client_id': 1, 'parking_id': 1},
+    ]})
+
+    assert batch.status_code == 200
+    assert batch.json['success'] == True
+    results = batch.json['results']
+    assert [r['status'] for r in results] == [200, 201, 201, 409, 400, 400]
+    assert results[0]['parking_log']['time_out']
+    assert results[1]['parking_log']['client_id'] == 1
+    assert not results[1]['parking_log']['time_out']
+    assert results[2]['parking_log']['client_id'] == 2
+    assert results[3]['reason'] == 'Parking is full'
+    assert results[4]['reason'] == 'Need to specify parking_id'
+
+    parking = db.session.query(Parking).get(1)
+    assert parking.count_available_places == 0
+
+
+@pytest.mark.parking
+def test_batch_publishes_new_availability(client):
+    assert client.get('/parkings/1/availability')\
+        .json['count_available_places'] == 1
+
+    client.post('/client_parkings/batch', json={'events': [
+        {'action': 'enter', 'client_id': 1, 'parking_id': 1}]})
+
+    assert client.get('/parkings/1/availability')\
+        .json['count_available_places'] == 0
+
+
+@pytest.mark.parking
+def test_batch_uses_same_reasons_as_single_endpoints(client):
+    events = [{'action': 'enter', 'client_id': 1, 'parking_id': 42},
+              {'action': 'leave', 'client_id': 1, 'parking_id': 1},
+              {'action': 'enter', 'client_id': 2, 'parking_id': 1}]
+    batch = client.post('/client_parkings/batch', json={'events': events})
+
+    for event, result in zip(events, batch.json['results']):
+        method = client.post if event['action'] == 'enter' else client.delete
+        single = method('/client_parkings', json={'client_id': event['client_id'],
+                                                  'parking_id': event['parking_id']})
+        assert result['status'] == single.status_code
+        assert result['reason'] == single.json['reason']
+
+
+def _gate_event(client, event, batch):
+    # (status, body) of one event sent alone or in a batch
+    if batch:
+        result = client.post('/client_parkings/batch',
+                             json={'events': [event]}).json['results'][0]
+        return result['status'], result
+    method = client.post if event['action'] == 'enter' else client.delete
+    response = method('/client_parkings',
+                      json={'client_id': event['client_id'],
+                            'parking_id': event['parking_id']})
+    return response.status_code, response.json
+
+
+@pytest.mark.parking
+@pytest.mark.parametrize('batch', [False, True])
+def test_string_ids_name_the_same_rows(client, batch):
+    status, body = _gate_event(client, {'action': 'enter', 'client_id': '1',
+                                        'parking_id': '1'}, batch)
+    assert status == 201
+    assert body['parking_log']['client_id'] == 1
+
+    status, body = _gate_event(client, {'action': 'leave', 'client_id': '2',
+                                        'parking_id': '1'}, batch)
+    assert status == 200
+
+
+@pytest.mark.parking
+@pytest.mark.parametrize('batch', [False, True])
+@pytest.mark.parametrize('event, reason', [
+    ({'action': 'enter', 'client_id': 1, 'parking_id': 'one'},
+     '"parking_id" has to be an integer'),
+    ({'action': 'enter', 'client_id': 1.5, 'parking_id': 1},
+     '"client_id" has to be an integer'),
+    ({'action': 'leave', 'client_id': True, 'parking_id': 1},
+     '"client_id" has to be an integer'),
+])
+def test_non_integer_ids_are_refused(client, batch, event, reason):
+    status, body = _gate_event(client, event, batch)
+
+    assert status == 400
+    assert body['reason'] == reason
+
+
+@pytest.mark.parking
+def test_batch_select_count_does_not_grow_with_batch(client, statements):
+    for i in range(20):
+        client.post('/clients', json={'name': f'name {i}',
+                                      'surname': 'surname',
+                                      'car_number': f'car {i}'})
+    parking_id = client.post('/parkings', json={'address': 'batch',
+                                                'count_places': 50})\
+        .json['added_parking_zone']['id']
+
+    def selects_for(client_ids):
+        statements.clear()
+        response = client.post('/client_parkings/batch', json={'events': [
+            {'action': 'enter', 'client_id': client_id, 'parking_id': parking_id}
+            for client_id in client_ids]})
+        assert all(r['status'] == 201 for r in response.json['results'])
+        return sum(1 for s in statements if s.startswith('SELECT'))
+
+    assert selects_for(range(3, 5)) == selects_for(range(5, 22))
+
+
+def test_batch_needs_events(client):
+    batch = client.post('/client_parkings/batch', json={})
+
+    assert batch.status_code == 400
+    assert batch.json['reason'] == 'Need to specify "events" list'
@@ -0,0 +1,314 @@
+import asyncio
+import datetime
+import json
+import re
+
+import pytest
+from sqlalchemy import select
+
+pytest.importorskip('aiosqlite')
+
+from module_29_testing.hw.main.app import create_app, db as _db
+from module_29_testing.hw.main.asgi import asgi_request, create_async_app
+from module_29_testing.hw.main.models import BillingJob, Client, Parking, \
+    ClientParking, Reservation
+
+
+def seed(session):
+    session.add_all([Client(name='name',
+                            surname='surname',
+                            credit_card='1234 1234 1234 1234',
+                            car_number='A123AA123'),
+                     Client(name='Another name',
+                            surname='One mor client',
+                            credit_card='2344 5673 8909 8765',
+                            car_number='T456HC234'),
+                     Parking(address='address',
+                             opened=True,
+                             count_places=2,
+                             count_available_places=1)])
+    session.flush()
+    session.add(ClientParking(client_id=2, parking_id=1))
+    session.commit()
+
+
+@pytest.fixture
+def async_app(tmp_path):
+    _app = create_async_app({'SQLALCHEMY_DATABASE_URI':
+                             f'sqlite:///{tmp_path / "async.db"}'})
+
+    async def setup():
+        async with _app.engine.begin() as conn:
+            await conn.run_sync(_db.Model.metadata.create_all)
+        async with _app.session_factory() as session:
+            await session.run_sync(seed)
+
+    asyncio.run(setup())
+    yield _app
+    asyncio.run(_app.engine.dispose())
+
+
+@pytest.fixture
+def sync_client(tmp_path):
+    _app = create_app({'TESTING': True,
+                       'SCHEMA_CHECK': False,
+                       'SQLALCHEMY_DATABASE_URI':
+                           f'sqlite:///{tmp_path / "sync.db"}'})
+    with _app.app_context():
+        _db.create_all()
+        seed(_db.session)
+        yield _app.test_client()
+        _db.session.remove()
+
+
+def call(app, method, path, json_body=None, headers=None):
+    status, headers, body = asyncio.run(asgi_request(app, method, path,
+                                                     json_body, headers))
+    return status, headers, json.loads(body) if body else None
+
+
+SCENARIO = [
+    ('GET', '/clients/2/history?limit=1', None),
+    ('GET', '/clients/3/history', None),
+    ('GET', '/parkings/1/sessions?limit=1&open=true', None),
+    ('GET', '/parkings/1/sessions?limit=0', None),
+    ('GET', '/clients', None),
+    ('GET', '/clients?limit=1', None),
+    ('GET', '/clients?stream=1&after_id=1', None),
+    ('GET', '/clients/1', None),
+    ('GET', '/clients?car_number=a123aa123', None),
+    ('GET', '/clients?car_number=%D0%A2+456+HC+234', None),
+    ('GET', '/clients?car_number=-', None),
+    ('POST', '/clients', {'name': 'test', 'surname': 'test'}),
+    ('POST', '/clients', {'surname': 'test'}),
+    ('POST', '/parkings', {'address': 'new', 'count_places': 1}),
+    ('POST', '/parkings', {'address': 'new', 'count_places': 1}),
+    ('POST', '/client_parkings', {'client_id': 1, 'parking_id': 1}),
+    ('POST', '/client_parkings', {'client_id': 1, 'parking_id': 2}),
+    ('POST', '/client_parkings', {'client_id': 3, 'parking_id': 1}),
+    ('POST', '/client_parkings', {'client_id': '2', 'parking_id': 'x'}),
+    ('DELETE', '/client_parkings', {'client_id': 2, 'parking_id': 1}),
+    ('DELETE', '/client_parkings', {'client_id': 2, 'parking_id': 1}),
+    ('POST', '/client_parkings/batch', {'events': [
+        {'action': 'leave', 'client_id': 1, 'parking_id': 1},
+        {'action': 'enter', 'client_id': 2, 'parking_id': 2}]}),
+    ('GET', '/parkings/1/availability', None),
+    ('GET', '/parkings/2/availability', None),
+    ('PATCH', '/parkings/2', {'opened': False}),
+    ('PATCH', '/parkings/3', {'opened': False}),
+    ('GET', '/parkings', None),
+    ('GET', '/parkings?limit=1&opened=true', None),
+    ('GET', '/parkings?opened=maybe', None),
+    ('POST', '/client_parkings/by_plate',
+     {'car_number': 'a 123 aa 123', 'parking_id': 1}),
+    ('POST', '/client_parkings/by_plate',
+     {'car_number': 'x000xx000', 'parking_id': 1}),
+    ('POST', '/client_parkings/by_plate',
+     {'car_number': 'a123aa123', 'parking_id': 1, 'action': 'leave'}),
+    ('POST', '/parkings/1/reservations',
+     {'client_id': 1, 'starts_at': '2100-01-01T10:00:00',
+      'ends_at': '2100-01-01T11:00:00'}),
+    ('POST', '/parkings/1/reservations',
+     {'client_id': 1, 'starts_at': '2100-01-01T10:30:00',
+      'ends_at': '2100-01-01T11:30:00'}),
+    ('GET', '/parkings/1/reservations'
+            '?from=2100-01-01T09:00:00&to=2100-01-01T12:00:00', None),
+    ('GET', '/client_parkings/export?format=xml', None),
+]
+
+
+def _without_times(payload):
+    if isinstance(payload, dict):
+        return {key: _without_times(value) for key, value in payload.items()
+                if key not in ('time_in', 'time_out', 'created_at')}
+    if isinstance(payload, list):
+        return [_without_times(item) for item in payload]
+    return payload
+
+
+def test_async_app_matches_sync_contracts(async_app, sync_client):
+    for method, path, body in SCENARIO:
+        sync_response = sync_client.open(path, method=method, json=body)
+        status, headers, payload = call(async_app, method, path, body)
+
+        assert status == sync_response.status_code, path
+        assert _without_times(payload) == _without_times(sync_response.json), path
+        assert headers.get('link') == sync_response.headers.get('Link'), path
+
+
+def test_async_app_serves_every_flask_route(async_app, sync_client):
+    for rule in sync_client.application.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        path = re.sub(r'<int:\w+>', '1', rule.rule)
+        for method in rule.methods - {'HEAD', 'OPTIONS'}:
+            handler, _, _ = async_app.match(method, path)
+            assert handler is not None, (method, rule.rule)
+
+
+def test_async_events_stream_gate_changes(tmp_path):
+    _app = create_async_app({'SQLALCHEMY_DATABASE_URI':
+                             f'sqlite:///{tmp_path / "events.db"}',
+                             'SSE_HEARTBEAT': 0.05})
+
+    async def scenario():
+        async with _app.engine.begin() as conn:
+            await conn.run_sync(_db.Model.metadata.create_all)
+        async with _app.session_factory() as session:
+            await session.run_sync(seed)
+
+        body = []
+        messages = [{'type': 'http.request', 'body': b'',
+                     'more_body': False}]
+        gone = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            body.append(message.get('body', b'').decode())
+
+        async def wait_for(text):
+            while text not in ''.join(body):
+                await asyncio.sleep(0.01)
+
+        stream = asyncio.ensure_future(_app(
+            {'type': 'http', 'method': 'GET', 'path': '/parkings/1/events',
+             'query_string': b'', 'headers': []}, receive, send))
+        await asyncio.wait_for(wait_for('"count_available_places":1'), 5)
+        status, _, _ = await asgi_request(_app, 'POST', '/client_parkings',
+                                          {'client_id': 1, 'parking_id': 1})
+        await asyncio.wait_for(wait_for('"count_available_places":0'), 5)
+        subscribers = len(_app.broadcaster)
+        gone.set()
+        await asyncio.wait_for(stream, 5)
+        await _app.engine.dispose()
+        return status, subscribers, ''.join(body)
+
+    status, subscribers, body = asyncio.run(scenario())
+
+    assert status == 201
+    assert subscribers == 1
+    assert body.startswith('retry: ')
+    assert body.count('event: occupancy') == 2
+    assert len(_app.broadcaster) == 0
+
+
+def test_async_import_and_export(async_app):
+    async def run():
+        scope = {'type': 'http', 'method': 'POST', 'path': '/clients/import',
+                 'query_string': b'',
+                 'headers': [(b'content-type', b'text/csv')]}
+        messages = [{'type': 'http.request', 'more_body': False,
+                     'body': b'name,surname,car_number\n'
+                             b'new,client,B777BB77\n,missing,\n'}]
+        response = {'body': b''}
+
+        async def receive():
+            return messages.pop()
+
+        async def send(message):
+            response['body'] += message.get('body', b'')
+
+        await async_app(scope, receive, send)
+        return json.loads(response['body']), await asgi_request(
+            async_app, 'GET', '/client_parkings/export')
+
+    report, (status, headers, body) = asyncio.run(run())
+
+    assert report['imported'] == 1
+    assert len(report['errors']) == 1
+    assert status == 200
+    assert headers['content-type'] == 'text/csv; charset=utf-8'
+    assert body.decode().splitlines()[0] == \
+        'id,client_id,name,surname,car_number,parking_id,address,' \
+        'time_in,time_out'
+    assert len(body.decode().splitlines()) == 2
+
+
+def test_async_engine_runs_the_pragmas(async_app):
+    async def pragmas():
+        async with async_app.engine.connect() as connection:
+            return [(await connection.exec_driver_sql(
+                f'PRAGMA {name}')).scalar()
+                for name in ('journal_mode', 'synchronous', 'busy_timeout')]
+
+    assert asyncio.run(pragmas()) == ['wal', 1, 5000]
+
+
+def test_async_client_search_uses_the_plate(async_app):
+    assert [c['id'] for c in call(async_app, 'GET',
+                                  '/clients?car_number=t456hc234')[2]] == [2]
+
+
+def test_async_app_serializes_dates_like_flask(async_app):
+    status, _, payload = call(async_app, 'DELETE', '/client_parkings',
+                              {'client_id': 2, 'parking_id': 1})
+
+    assert status == 200
+    assert payload['parking_log']['time_out'].endswith(' GMT')
+
+
+def test_async_app_unknown_route(async_app):
+    assert call(async_app, 'GET', '/nope')[0] == 404
+    assert call(async_app, 'PUT', '/clients')[0] == 405
+
+
+def test_async_enter_honours_reservations(async_app):
+    now = datetime.datetime.now()
+
+    async def reserve():
+        async with async_app.session_factory() as session:
+            session.add(Reservation(client_id=2, parking_id=1,
+                                    starts_at=now,
+                                    ends_at=now + datetime.timedelta(hours=1),
+                                    created_at=now))
+            await session.commit()
+
+    asyncio.run(reserve())
+    status, _, payload = call(async_app, 'POST', '/client_parkings',
+                              {'client_id': 1, 'parking_id': 1})
+
+    assert status == 409
+    assert payload['reason'] == 'Remaining places are reserved'
+
+
+def test_async_retried_leave_replays_first_response(async_app):
+    key = {'Idempotency-Key': 'gate-1'}
+    body = {'client_id': 2, 'parking_id': 1}
+
+    first = call(async_app, 'DELETE', '/client_parkings', body, key)
+    retry = call(async_app, 'DELETE', '/client_parkings', body, key)
+
+    assert first[0] == retry[0] == 200
+    assert retry[1]['idempotent-replayed'] == 'true'
+    assert retry[2] == first[2]
+    assert call(async_app, 'DELETE', '/client_parkings',
+                {'client_id': 1, 'parking_id': 1}, key)[0] == 422
+    assert call(async_app, 'DELETE', '/client_parkings', body,
+                {'Idempotency-Key': 'k' * 256})[0] == 400
+
+    async def jobs():
+        async with async_app.session_factory() as session:
+            return len((await session.execute(
+                select(BillingJob))).scalars().all())
+
+    assert asyncio.run(jobs()) == 1
+
+
+def test_async_concurrent_duplicates_enter_once(async_app):
+    async def enter_twice():
+        return await asyncio.gather(*[asgi_request(
+            async_app, 'POST', '/client_parkings',
+            {'client_id': 1, 'parking_id': 1}, {'Idempotency-Key': 'gate-2'})
+            for _ in range(2)])
+
+    responses = asyncio.run(enter_twice())
+
+    assert [status for status, _, _ in responses] == [201, 201]
+    assert responses[0][2] == responses[1][2]
+    assert sum('idempotent-replayed' in headers
+               for _, headers, _ in responses) == 1
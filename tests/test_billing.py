@@ -0,0 +1,198 @@
+import datetime
+import time
+
+import pytest
+
+from module_29_testing.hw.main import billing
+from module_29_testing.hw.main.app import create_app, db as _db
+from module_29_testing.hw.main.models import BillingJob, Client, Parking, \
+    ClientParking
+
+
+JOBS = 200
+LATENCY = 0.02
+WORKERS = 8
+
+
+def _config(app, **overrides):
+    config = dict(app.config, BILLING_BACKOFF_SECONDS=0)
+    config.update(overrides)
+    return config
+
+
+def test_compute_amount_charges_every_started_hour():
+    time_in = datetime.datetime(2024, 1, 1, 10)
+
+    assert billing.compute_amount(time_in, time_in, 100) == 100
+    assert billing.compute_amount(
+        time_in, time_in + datetime.timedelta(minutes=61), 100) == 200
+
+
+def test_leave_queues_billing_job_without_charging(app, client, db):
+    leave = client.delete('/client_parkings', json={'client_id': 2,
+                                                    'parking_id': 1})
+
+    assert leave.status_code == 200
+    job = db.session.query(BillingJob).one()
+    assert job.client_parking_id == leave.json['parking_log']['id']
+    assert job.status == 'pending'
+    assert app.extensions['payment_gateway'].charges == {}
+
+
+def test_process_batch_charges_due_jobs(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    gateway = billing.FakePaymentGateway()
+
+    assert billing.process_batch(gateway, _config(app)) == 1
+
+    job = db.session.query(BillingJob).one()
+    assert job.status == 'paid'
+    assert job.amount == 100
+    assert gateway.charges == {
+        f'billing-job-{job.id}': (job.transaction_id,
+                                  '2344 5673 8909 8765', 100)}
+    assert billing.process_batch(gateway, _config(app)) == 0
+
+
+def test_failed_charges_back_off_and_give_up(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    gateway = billing.FakePaymentGateway(failure_rate=1.0)
+
+    billing.process_batch(gateway, _config(app, BILLING_BACKOFF_SECONDS=60))
+    job = db.session.query(BillingJob).one()
+    assert (job.status, job.attempts) == ('pending', 1)
+    assert job.next_attempt_at > datetime.datetime.now()
+    assert billing.process_batch(gateway, _config(app)) == 0
+
+    job.next_attempt_at = datetime.datetime.now()
+    db.session.commit()
+    config = _config(app, BILLING_MAX_ATTEMPTS=3)
+    while billing.process_batch(gateway, config):
+        pass
+
+    job = db.session.query(BillingJob).one()
+    assert (job.status, job.attempts) == ('failed', 3)
+    assert job.last_error == 'Payment declined'
+
+
+def test_expired_claims_are_picked_up_again(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    now = datetime.datetime.now()
+    token, jobs = billing._claim(db.session, 10, datetime.timedelta(0), now)
+    assert len(jobs) == 1
+
+    # The first worker died, its lease has run out
+    assert billing.process_batch(billing.FakePaymentGateway(),
+                                 _config(app)) == 1
+    job = db.session.query(BillingJob).one()
+    assert (job.status, job.attempts) == ('paid', 2)
+
+
+def test_claims_that_keep_expiring_are_given_up(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    for _ in range(2):
+        billing._claim(db.session, 10, datetime.timedelta(0),
+                       datetime.datetime.now())
+    gateway = billing.FakePaymentGateway()
+
+    assert billing.process_batch(gateway,
+                                 _config(app, BILLING_MAX_ATTEMPTS=2)) == 0
+    job = db.session.query(BillingJob).one()
+    assert (job.status, job.attempts, job.last_error) == \
+        ('failed', 2, 'Claim expired')
+    assert gateway.charges == {}
+
+
+def test_gateway_is_built_from_config():
+    gateway = billing.FakePaymentGateway()
+    app = create_app({'SCHEMA_CHECK': False,
+                      'PAYMENT_GATEWAY': lambda config: gateway})
+
+    assert app.extensions['payment_gateway'] is gateway
+
+
+def test_process_billing_cli_command(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+
+    result = app.test_cli_runner().invoke(args=['process-billing'])
+
+    assert 'Processed 1 billing jobs' in result.output
+    assert db.session.query(BillingJob).one().status == 'paid'
+
+
+@pytest.fixture
+def billing_app(make_app):
+    # Workers run in threads, in-memory SQLite is per connection
+    _app = make_app({'BILLING_BATCH_SIZE': 10,
+                     'BILLING_POLL_INTERVAL': 0.01,
+                     'BILLING_BACKOFF_SECONDS': 0})
+    parking = Parking(address='address', opened=True,
+                      count_places=JOBS, count_available_places=0)
+    clients = [Client(name=f'name {i}', surname='surname',
+                      credit_card=f'card {i}', car_number=f'A{i:03}AA')
+               for i in range(JOBS)]
+    _db.session.add_all([parking] + clients)
+    _db.session.flush()
+    now = datetime.datetime.now()
+    _db.session.add_all(ClientParking(client_id=c.id, parking_id=parking.id,
+                                      time_in=now) for c in clients)
+    _db.session.commit()
+    return _app
+
+
+def _leave_all(client):
+    for client_id in range(1, JOBS + 1):
+        leave = client.delete('/client_parkings',
+                              json={'client_id': client_id, 'parking_id': 1})
+        assert leave.status_code == 200
+
+
+def _drain(app, gateway, workers):
+    pool = billing.BillingWorkerPool(app, gateway, workers)
+    started = time.perf_counter()
+    pool.start()
+    try:
+        while len(gateway.charges) < JOBS \
+                and time.perf_counter() - started < 30:
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+    return time.perf_counter() - started
+
+
+def test_leave_latency_does_not_include_payment(billing_app):
+    billing_app.extensions['payment_gateway'].latency = 1.0
+    client = billing_app.test_client()
+
+    started = time.perf_counter()
+    _leave_all(client)
+
+    assert time.perf_counter() - started < JOBS * 1.0 / 10
+
+
+def test_worker_pool_drains_outbox_in_parallel(billing_app):
+    _leave_all(billing_app.test_client())
+    gateway = billing.FakePaymentGateway(latency=LATENCY)
+
+    elapsed = _drain(billing_app, gateway, WORKERS)
+
+    assert len(gateway.charges) == JOBS
+    # Sequential charging would take JOBS * LATENCY
+    assert elapsed < JOBS * LATENCY / 2
+    assert _db.session.query(BillingJob)\
+        .filter(BillingJob.status == 'paid').count() == JOBS
+
+
+def test_worker_pool_retries_injected_failures(billing_app):
+    billing_app.config['BILLING_MAX_ATTEMPTS'] = 20
+    _leave_all(billing_app.test_client())
+    gateway = billing.FakePaymentGateway(failure_rate=0.3, seed=1)
+
+    _drain(billing_app, gateway, WORKERS)
+
+    statuses = dict(_db.session.query(BillingJob.status,
+                                      _db.func.count())
+                    .group_by(BillingJob.status).all())
+    assert statuses == {'paid': JOBS}
+    assert sorted(card for _, card, _ in gateway.charges.values()) == \
+        sorted(f'card {i}' for i in range(JOBS))
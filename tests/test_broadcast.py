@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+from module_29_testing.hw.main import broadcast
+
+
+def _availability(parking_id, count_available_places, opened=True):
+    return {'parking_id': parking_id,
+            'count_available_places': count_available_places,
+            'opened': opened}
+
+
+def _data(message):
+    event, data = message.strip().split('\n')
+    assert event == 'event: occupancy'
+    return json.loads(data[len('data: '):])
+
+
+@pytest.fixture
+def events(app, client):
+    app.config['SSE_HEARTBEAT'] = 5.0
+    opened = []
+
+    def open_stream(path):
+        response = client.get(path, buffered=False)
+        opened.append(response)
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'retry: ')
+        return response, (chunk.decode() for chunk in chunks)
+
+    yield open_stream
+    for response in opened:
+        response.close()
+
+
+def test_deliver_fans_out_to_parking_and_all_parkings_subscribers():
+    broadcaster = broadcast.OccupancyBroadcaster()
+    one = broadcaster.subscribe(1)
+    two = broadcaster.subscribe(2)
+    every = broadcaster.subscribe()
+
+    broadcaster.deliver(_availability(1, 3))
+
+    assert _data(one.get(0)) == _availability(1, 3)
+    assert _data(every.get(0)) == _availability(1, 3)
+    assert two.get(0) is None
+
+
+def test_slow_subscriber_is_dropped():
+    broadcaster = broadcast.OccupancyBroadcaster(max_pending=2)
+    slow = broadcaster.subscribe(1)
+    broadcaster.subscribe(1)
+
+    for count in range(3):
+        broadcaster.deliver(_availability(1, count))
+
+    assert slow.dropped
+    assert len(broadcaster) == 0
+
+
+def test_publish_reaches_subscriber_through_dispatcher():
+    broadcaster = broadcast.OccupancyBroadcaster()
+    broadcaster.publish(_availability(1, 0))
+    subscription = broadcaster.subscribe(1)
+
+    broadcaster.publish(_availability(1, 1))
+
+    assert _data(subscription.get(5)) == _availability(1, 1)
+
+
+def test_parking_events_stream_pushes_gate_changes(client, events):
+    response, chunks = events('/parkings/1/events')
+    assert response.mimetype == 'text/event-stream'
+    assert _data(next(chunks)) == _availability(1, 1)
+
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    assert _data(next(chunks)) == _availability(1, 0)
+
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    assert _data(next(chunks)) == _availability(1, 1)
+
+
+def test_all_parkings_stream_sees_new_and_closed_parkings(client, events):
+    response, chunks = events('/parkings/events')
+    assert _data(next(chunks)) == _availability(1, 1)
+
+    client.post('/parkings', json={'address': 'new', 'count_places': 5})
+    assert _data(next(chunks)) == _availability(2, 5)
+
+    closed = client.patch('/parkings/1', json={'opened': False})
+    assert closed.json['parking_zone']['opened'] is False
+    assert _data(next(chunks)) == _availability(1, 1, opened=False)
+
+
+def test_closing_stream_unsubscribes(app, events):
+    response, chunks = events('/parkings/1/events')
+    next(chunks)
+    assert len(app.extensions['occupancy_broadcaster']) == 1
+
+    response.close()
+
+    assert len(app.extensions['occupancy_broadcaster']) == 0
+
+
+def test_streams_over_the_cap_are_refused(app, client, events):
+    # Each stream holds a worker thread of the Flask app
+    broadcaster = app.extensions['occupancy_broadcaster']
+    assert broadcaster.max_subscribers == broadcast.SSE_MAX_THREADED_SUBSCRIBERS
+    broadcaster.max_subscribers = 1
+    events('/parkings/events')
+
+    response = client.get('/parkings/1/events')
+
+    assert response.status_code == 503
+    assert len(broadcaster) == 1
+
+
+def test_events_for_missing_parking(app, client):
+    response = client.get('/parkings/5/events')
+
+    assert response.status_code == 404
+    assert len(app.extensions['occupancy_broadcaster']) == 0
+
+
+@pytest.mark.parametrize('path,body,status', [
+    ('/parkings/1', {'opened': 'no'}, 400),
+    ('/parkings/5', {'opened': False}, 404),
+])
+def test_update_parking_rejections(client, path, body, status):
+    assert client.patch(path, json=body).status_code == status
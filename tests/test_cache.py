@@ -0,0 +1,126 @@
+from module_29_testing.hw.main import gate
+from module_29_testing.hw.main.cache import AvailabilityCache, VersionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = AvailabilityCache(ttl=10, clock=clock)
+    cache.set(1, 5, True, 1)
+
+    clock.now = 9.9
+    assert cache.get(1) == {'parking_id': 1,
+                            'count_available_places': 5,
+                            'opened': True}
+    clock.now = 10
+    assert cache.get(1) is None
+
+
+def test_update_calls_invalidation_hooks():
+    cache = AvailabilityCache()
+    notified = []
+    cache.add_invalidation_hook(notified.append)
+
+    cache.set(1, 5, True, 1)
+    cache.update(2, 3, False, 1)
+
+    assert notified == [2]
+    cache.invalidate(2)
+    assert cache.get(2) is None
+    assert cache.get(1)
+
+
+def test_older_version_does_not_replace_newer():
+    cache = AvailabilityCache()
+    notified = []
+    cache.add_invalidation_hook(notified.append)
+
+    cache.update(1, 4, True, 3)
+    assert cache.update(1, 5, True, 2) is None
+    assert cache.set(1, 5, True, 2)['count_available_places'] == 5
+    assert cache.get(1)['count_available_places'] == 4
+
+    cache.invalidate(1)
+    cache.set(1, 5, True, 2)
+    assert cache.get(1) is None
+    assert notified == [1]
+
+
+def test_availability_is_written_through_on_enter_and_leave(client,
+                                                           statements):
+    enter = client.post('/client_parkings', json={'client_id': 1,
+                                                  'parking_id': 1})
+    assert enter.status_code == 201
+    statements.clear()
+
+    availability = client.get('/parkings/1/availability')
+    assert availability.status_code == 200
+    assert availability.json == {'parking_id': 1,
+                                 'count_available_places': 0,
+                                 'opened': True}
+    assert statements == []
+
+    leave = client.delete('/client_parkings', json={'client_id': 2,
+                                                    'parking_id': 1})
+    assert leave.status_code == 200
+    assert client.get('/parkings/1/availability').json[
+        'count_available_places'] == 1
+
+
+def test_availability_of_new_parking_is_cached(client):
+    parking = client.post('/parkings', json={'address': 'cached',
+                                             'count_places': 3,
+                                             'opened': False})
+    parking_id = parking.json['added_parking_zone']['id']
+
+    availability = client.get(f'/parkings/{parking_id}/availability')
+    assert availability.json == {'parking_id': parking_id,
+                                 'count_available_places': 3,
+                                 'opened': False}
+
+
+def test_availability_miss_reads_database(app, client):
+    app.extensions['availability_cache'].invalidate()
+    availability = client.get('/parkings/1/availability')
+
+    assert availability.status_code == 200
+    assert availability.json['count_available_places'] == 1
+
+
+def test_availability_of_non_existent_parking(client):
+    availability = client.get('/parkings/42/availability')
+
+    assert availability.status_code == 404
+    assert availability.json['reason'] == 'Parking doesn\'t exist'
+
+
+def test_version_cache_keeps_newest_version_until_expiry():
+    clock = FakeClock()
+    versions = VersionCache(ttl=10, clock=clock)
+
+    assert versions.set(('client', 1), 3) == 3
+    assert versions.set(('client', 1), 2) == 3
+    assert versions.get(('client', 1)) == 3
+
+    clock.now = 10
+    assert versions.get(('client', 1)) is None
+    assert versions.set(('client', 1), 2) == 2
+
+
+def test_late_publish_of_an_older_count_is_dropped(app, client):
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    before = client.get('/parkings/1/availability').json
+
+    with app.app_context():
+        gate.publish_occupancy([(1, 1, True, 1)])
+
+    assert client.get('/parkings/1/availability').json == before
+    assert client.get('/parkings').json[0]['count_available_places'] == \
+        before['count_available_places']
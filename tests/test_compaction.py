@@ -0,0 +1,59 @@
+import time
+
+from module_29_testing.hw.main.compaction import CompactionWorker, \
+    compact_closed_sessions
+from module_29_testing.hw.main.models import ClientParking, ClientParkingHistory
+
+
+def test_compaction_moves_closed_sessions_with_their_ids(client, db):
+    leave = client.delete('/client_parkings', json={'client_id': 2,
+                                                    'parking_id': 1})
+    assert leave.status_code == 200
+    enter = client.post('/client_parkings', json={'client_id': 1,
+                                                  'parking_id': 1})
+    assert enter.status_code == 201
+
+    assert compact_closed_sessions(batch_size=1) == 1
+
+    hot = db.session.query(ClientParking).all()
+    assert [log.id for log in hot] == [enter.json['parking_log']['id']]
+    archived = db.session.query(ClientParkingHistory).one()
+    assert archived.to_json() == {**leave.json['parking_log'],
+                                  'time_in': archived.time_in,
+                                  'time_out': archived.time_out}
+    assert archived.id == leave.json['parking_log']['id']
+
+
+def test_archived_ids_are_never_reused(client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    compact_closed_sessions()
+
+    enter = client.post('/client_parkings', json={'client_id': 2,
+                                                  'parking_id': 1})
+
+    assert enter.json['parking_log']['id'] > \
+        db.session.query(ClientParkingHistory).one().id
+
+
+def test_compaction_cli_command(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+
+    result = app.test_cli_runner().invoke(args=['compact-parking-log'])
+
+    assert 'Archived 1 closed sessions' in result.output
+    assert db.session.query(ClientParking).count() == 0
+
+
+def test_compaction_worker_runs_in_background(app, client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    worker = CompactionWorker(app, interval=0.01)
+    worker.start()
+    try:
+        for _ in range(100):
+            if db.session.query(ClientParkingHistory).count():
+                break
+            time.sleep(0.01)
+    finally:
+        worker.stop()
+
+    assert db.session.query(ClientParkingHistory).count() == 1
@@ -0,0 +1,85 @@
+import random
+import threading
+
+import pytest
+from sqlalchemy import func
+
+from module_29_testing.hw.main.app import db as _db
+from module_29_testing.hw.main.models import Client, Parking, ClientParking
+
+
+PLACES = 5
+CLIENTS = 20
+WORKERS = 8
+EVENTS_PER_WORKER = 250
+
+
+@pytest.fixture
+def file_app(make_app):
+    # Threads need a shared database, in-memory SQLite is per connection
+    _app = make_app({'SQLALCHEMY_ENGINE_OPTIONS': {
+        'connect_args': {'timeout': 30, 'check_same_thread': False}}})
+    _db.session.add(Parking(address='stress',
+                            opened=True,
+                            count_places=PLACES,
+                            count_available_places=PLACES))
+    _db.session.add_all([Client(name=f'name {i}',
+                                surname='surname',
+                                credit_card='1234',
+                                car_number=f'A{i:03}AA')
+                         for i in range(CLIENTS)])
+    _db.session.commit()
+    return _app
+
+
+def test_concurrent_enter_and_leave_keep_counters_exact(file_app):
+    results = []
+    errors = []
+
+    def gate(seed):
+        rnd = random.Random(seed)
+        client = file_app.test_client()
+        outcome = []
+        try:
+            for _ in range(EVENTS_PER_WORKER):
+                req = {'client_id': rnd.randint(1, CLIENTS), 'parking_id': 1}
+                if rnd.random() < 0.5:
+                    response = client.post('/client_parkings', json=req)
+                    outcome.append(('enter', response.status_code))
+                else:
+                    response = client.delete('/client_parkings', json=req)
+                    outcome.append(('leave', response.status_code))
+        except Exception as exc:
+            errors.append(exc)
+        results.extend(outcome)
+
+    threads = [threading.Thread(target=gate, args=(seed,))
+               for seed in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(results) == WORKERS * EVENTS_PER_WORKER
+    assert {status for _, status in results} <= {200, 201, 404, 409}
+
+    entered = sum(1 for kind, status in results
+                  if kind == 'enter' and status == 201)
+    left = sum(1 for kind, status in results
+               if kind == 'leave' and status == 200)
+
+    with file_app.app_context():
+        parking = _db.session.query(Parking).get(1)
+        open_sessions = _db.session.query(ClientParking)\
+            .filter(ClientParking.time_out == None).count()
+        duplicates = _db.session.query(ClientParking.client_id)\
+            .filter(ClientParking.time_out == None)\
+            .group_by(ClientParking.client_id, ClientParking.parking_id)\
+            .having(func.count() > 1).all()
+
+        assert entered > 0 and left > 0
+        assert open_sessions == entered - left
+        assert 0 <= parking.count_available_places <= PLACES
+        assert parking.count_available_places == PLACES - open_sessions
+        assert duplicates == []
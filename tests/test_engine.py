@@ -0,0 +1,87 @@
+import pytest
+
+from module_29_testing.hw.main import engine
+from module_29_testing.hw.main.app import create_app, db as _db
+from module_29_testing.hw.main.models import Client, Parking
+
+
+@pytest.fixture
+def replicated_app(make_app, tmp_path):
+    _app = make_app({'DATABASE_REPLICA_URI':
+                         f'sqlite:///{tmp_path / "replica.db"}'})
+    replica = _app.extensions['replica_session']
+    _db.Model.metadata.create_all(replica.get_bind())
+    for session, name in ((_db.session, 'primary'), (replica, 'replica')):
+        session.add_all([Client(name=name,
+                                surname='surname',
+                                credit_card='1234',
+                                car_number='A123AA123'),
+                         Parking(address='address',
+                                 opened=True,
+                                 count_places=5,
+                                 count_available_places=5)])
+        session.commit()
+
+    yield _app
+
+    replica.remove()
+
+
+def test_sqlite_pragmas_are_applied(replicated_app):
+    with replicated_app.app_context():
+        connection = _db.session.connection()
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+
+
+def test_explicit_connect_args_keep_the_pragmas(make_app):
+    _app = make_app({'SQLALCHEMY_ENGINE_OPTIONS':
+                         {'connect_args': {'timeout': 30}}})
+    with _app.app_context():
+        connection = _db.session.connection()
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 30000
+
+
+def test_reads_go_to_replica_and_writes_to_primary(replicated_app):
+    client = replicated_app.test_client()
+
+    assert client.get('/clients').json[0]['name'] == 'replica'
+    assert client.get('/clients/1').json['name'] == 'replica'
+
+    enter = client.post('/client_parkings', json={'client_id': 1,
+                                                  'parking_id': 1})
+    assert enter.status_code == 201
+    with replicated_app.app_context():
+        assert _db.session.query(Parking).get(1).count_available_places == 4
+        replica = replicated_app.extensions['replica_session']
+        assert replica.query(Parking).get(1).count_available_places == 5
+
+
+def test_engine_settings_come_from_environment(tmp_path):
+    environ = {'DATABASE_URL': f'sqlite:///{tmp_path / "env.db"}',
+               'DB_POOL_SIZE': '7',
+               'SQLITE_SYNCHRONOUS': 'FULL'}
+    config = {}
+    engine.load_environment(config, environ)
+    assert config == {'SQLALCHEMY_DATABASE_URI': environ['DATABASE_URL'],
+                      'DB_POOL_SIZE': 7,
+                      'SQLITE_SYNCHRONOUS': 'FULL'}
+
+    _app = create_app(dict(config, SCHEMA_CHECK=False))
+    with _app.app_context():
+        assert _db.engine.pool.size() == 7
+        connection = _db.session.connection()
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 2
+        _db.session.remove()
+
+
+def test_cached_reads_come_from_the_primary(replicated_app):
+    client = replicated_app.test_client()
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    replicated_app.extensions['availability_cache'].invalidate()
+
+    assert client.get('/parkings/1/availability')\
+        .json['count_available_places'] == 4
+    assert client.get('/parkings').json[0]['count_available_places'] == 4
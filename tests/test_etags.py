@@ -0,0 +1,78 @@
+from module_29_testing.hw.main.models import Client
+
+
+def test_client_etag_answers_304_without_queries(client, statements):
+    first = client.get('/clients/1')
+    assert first.status_code == 200
+    assert first.headers['ETag'] == '"client-1-v1"'
+
+    statements.clear()
+    cached = client.get('/clients/1',
+                        headers={'If-None-Match': first.headers['ETag']})
+
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == first.headers['ETag']
+    assert statements == []
+
+
+def test_client_etag_changes_on_update(client, db):
+    etag = client.get('/clients/1').headers['ETag']
+
+    db.session.get(Client, 1).car_number = 'B777BB77'
+    db.session.commit()
+    response = client.get('/clients/1', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"client-1-v2"'
+    assert response.json['car_number'] == 'B777BB77'
+
+
+def test_missing_client_is_404(client):
+    response = client.get('/clients/404')
+
+    assert response.status_code == 404
+    assert response.json['reason'] == 'Client doesn\'t exist'
+
+
+def test_client_collection_etag_changes_on_write(client):
+    listing = client.get('/clients')
+    etag = listing.headers['ETag']
+    assert client.get('/clients',
+                      headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/clients', json={'name': 'new', 'surname': 'client'})
+    response = client.get('/clients', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.json) == len(listing.json) + 1
+
+
+def test_every_query_of_the_collection_has_its_own_etag(client):
+    etag = client.get('/clients').headers['ETag']
+    page = client.get('/clients?limit=1&after_id=1')
+
+    assert page.headers['ETag'] != etag
+    assert client.get('/clients?limit=1',
+                      headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/clients?after_id=1&limit=1', headers={
+        'If-None-Match': page.headers['ETag']}).status_code == 304
+
+
+def test_concurrent_client_update_is_a_conflict(app, client, db):
+    @app.route('/test/clients/<int:client_id>', methods=['PATCH'])
+    def rename_client(client_id):
+        stale = db.session.get(Client, client_id)
+        # Another request updates the client meanwhile
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'UPDATE client SET version = version + 1 WHERE id = ?',
+                (client_id,))
+        stale.name = 'renamed'
+        db.session.commit()
+        return {}, 200
+
+    response = client.patch('/test/clients/1')
+
+    assert response.status_code == 409
+    assert db.session.get(Client, 1).name == 'name'
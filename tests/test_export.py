@@ -0,0 +1,106 @@
+import csv
+import datetime
+import io
+
+import pytest
+from sqlalchemy import text
+
+from module_29_testing.hw.main import export
+from module_29_testing.hw.main.models import ClientParking, \
+    ClientParkingHistory
+
+
+@pytest.fixture
+def archived(app, db):
+    # Older than the open session from the fixtures
+    db.session.add(ClientParkingHistory(
+        id=100, client_id=1, parking_id=1,
+        time_in=datetime.datetime(2024, 1, 1, 10),
+        time_out=datetime.datetime(2024, 1, 1, 12)))
+    db.session.commit()
+
+
+def _rows(response):
+    return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_csv_export_joins_clients_and_parkings(client, archived):
+    response = client.get('/client_parkings/export')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = _rows(response)
+    assert [row['id'] for row in rows] == ['100', '1']
+    assert rows[1]['car_number'] == 'T456HC234'
+    assert rows[1]['time_out'] == ''
+    assert rows[0]['name'] == 'name'
+    assert rows[0]['address'] == 'address'
+    assert rows[0]['time_out'] == '2024-01-01 12:00:00'
+
+
+def test_export_merges_both_logs_by_time_in(app, client, db, archived):
+    db.session.add_all([
+        ClientParking(id=2, client_id=1, parking_id=1,
+                      time_in=datetime.datetime(2024, 1, 1, 11),
+                      time_out=datetime.datetime(2024, 1, 1, 13)),
+        ClientParkingHistory(id=101, client_id=2, parking_id=1,
+                             time_in=datetime.datetime(2024, 1, 1, 12),
+                             time_out=datetime.datetime(2024, 1, 1, 14))])
+    db.session.commit()
+    app.config['EXPORT_CHUNK_SIZE'] = 1
+
+    response = client.get('/client_parkings/export?from=2024-01-01')
+
+    assert [row['id'] for row in _rows(response)] == ['100', '2', '101', '1']
+
+
+def test_export_queries_walk_the_time_in_indexes(db):
+    for query in export.export_queries(datetime.datetime(2024, 1, 1)):
+        plan = db.session.execute(
+            text('EXPLAIN QUERY PLAN '
+                 + str(query.compile(db.engine,
+                                     compile_kwargs={'literal_binds': True}))))
+        details = [row[-1] for row in plan]
+        assert 'time_in' in details[0]
+        assert not any('TEMP B-TREE' in detail for detail in details)
+
+
+def test_export_filters_by_start_time(client, archived):
+    response = client.get('/client_parkings/export'
+                          '?from=2024-01-01T00:00&to=2024-02-01T00:00')
+
+    assert [row['id'] for row in _rows(response)] == ['100']
+
+
+def test_parquet_export_writes_a_row_group_per_chunk(app, client, archived):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    app.config['EXPORT_CHUNK_SIZE'] = 1
+
+    response = client.get('/client_parkings/export?format=parquet')
+
+    assert response.mimetype == 'application/vnd.apache.parquet'
+    table = parquet.ParquetFile(io.BytesIO(response.data))
+    assert table.metadata.num_row_groups == 2
+    assert table.read().column('id').to_pylist() == [100, 1]
+    assert table.read().column('time_in').to_pylist()[0] == \
+        datetime.datetime(2024, 1, 1, 10)
+
+
+@pytest.mark.parametrize('query', ['format=xlsx', 'from=yesterday',
+                                   'from=2024-02-01&to=2024-01-01'])
+def test_export_rejects_bad_arguments(client, query):
+    response = client.get(f'/client_parkings/export?{query}')
+
+    assert response.status_code == 400
+
+
+def test_export_cli_command(app, archived, tmp_path):
+    path = tmp_path / 'log.csv'
+
+    result = app.test_cli_runner().invoke(
+        args=['export-parking-log', str(path),
+              '--from', '2024-01-01', '--to', '2024-02-01'])
+
+    assert result.exit_code == 0
+    with open(path, newline='') as exported:
+        assert [row['id'] for row in csv.DictReader(exported)] == ['100']
@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+from module_29_testing.hw.main import gate
+from module_29_testing.hw.main.app import db as _db
+from module_29_testing.hw.main.models import Client, Parking, ClientParking
+
+
+GATES = 8
+
+
+@pytest.fixture
+def grouped_app(make_app):
+    _app = make_app({'GROUP_COMMIT': True, 'GROUP_COMMIT_WINDOW': 0.05})
+    _db.session.add(Parking(address='a', opened=True, count_places=20,
+                            count_available_places=20))
+    _db.session.add_all([Client(name='n', surname='s', credit_card='1',
+                                car_number=f'A{i}') for i in range(GATES)])
+    _db.session.commit()
+    yield _app
+    _app.extensions['group_committer'].close()
+
+
+@pytest.fixture
+def groups(monkeypatch):
+    sizes = []
+    apply_events = gate.apply_events
+
+    def recording(events, *args, **kwargs):
+        sizes.append(len(events))
+        return apply_events(events, *args, **kwargs)
+
+    monkeypatch.setattr(gate, 'apply_events', recording)
+    return sizes
+
+
+def enter_together(app, client_ids):
+    barrier = threading.Barrier(len(client_ids))
+    responses = {}
+
+    def enter(client_id):
+        client = app.test_client()
+        barrier.wait()
+        responses[client_id] = client.post(
+            '/client_parkings', json={'client_id': client_id,
+                                      'parking_id': 1})
+
+    threads = [threading.Thread(target=enter, args=(client_id,))
+               for client_id in client_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_concurrent_enters_share_a_commit(grouped_app, groups):
+    responses = enter_together(grouped_app, range(1, GATES + 1))
+
+    assert {r.status_code for r in responses.values()} == {201}
+    assert sum(groups) == GATES and len(groups) < GATES
+    with grouped_app.app_context():
+        assert _db.session.query(ClientParking).count() == GATES
+        assert _db.session.get(Parking, 1).count_available_places == \
+            20 - GATES
+
+
+def test_grouped_enters_publish_new_availability(grouped_app):
+    client = grouped_app.test_client()
+    assert client.get('/parkings/1/availability')\
+        .json['count_available_places'] == 20
+
+    enter_together(grouped_app, [1, 2])
+
+    assert client.get('/parkings/1/availability')\
+        .json['count_available_places'] == 18
+
+
+def test_rejected_event_does_not_fail_its_group(grouped_app, groups):
+    responses = enter_together(grouped_app, [1, 2, 99])
+
+    assert responses[99].status_code == 404
+    assert responses[1].status_code == responses[2].status_code == 201
+
+
+def test_failed_group_falls_back_to_one_transaction_per_event(
+        grouped_app, monkeypatch):
+    def broken(events, *args, **kwargs):
+        raise RuntimeError('group failed')
+
+    monkeypatch.setattr(gate, 'apply_events', broken)
+    responses = enter_together(grouped_app, [1, 2, 3])
+
+    assert {r.status_code for r in responses.values()} == {201}
+
+
+def test_group_commit_is_opt_in(app):
+    assert 'group_committer' not in app.extensions
+
+
+def test_group_commit_syncs_every_commit(grouped_app):
+    # 2 is FULL, answered events survive a power loss
+    assert _db.session.connection().exec_driver_sql(
+        'PRAGMA synchronous').scalar() == 2
+
+
+def test_group_commit_with_shards_is_reported(make_app, tmp_path, caplog):
+    _app = make_app({'GROUP_COMMIT': True,
+                     'SHARD_DATABASE_URIS':
+                         [f'sqlite:///{tmp_path / "shard0.db"}']},
+                    create_tables=False)
+
+    assert 'group_committer' not in _app.extensions
+    assert 'GROUP_COMMIT is ignored' in caplog.text
@@ -0,0 +1,129 @@
+import datetime
+
+import pytest
+from sqlalchemy import text
+
+from module_29_testing.hw.main import history
+from module_29_testing.hw.main.models import Parking, ClientParking, \
+    ClientParkingHistory
+
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def add_visits(db, count, client_id=1):
+    parkings = [Parking(address=f'visited {i}', opened=True, count_places=5,
+                        count_available_places=5) for i in range(3)]
+    db.session.add_all(parkings)
+    db.session.flush()
+    for i in range(count):
+        # Every other visit was already moved to the archive
+        model = ClientParkingHistory if i % 2 else ClientParking
+        db.session.add(model(id=1000 + i, client_id=client_id,
+                             parking_id=parkings[i % 3].id,
+                             time_in=START + datetime.timedelta(hours=i),
+                             time_out=START + datetime.timedelta(hours=i,
+                                                                 minutes=30)))
+    db.session.commit()
+
+
+def walk_pages(client, path, key='visits'):
+    seen = []
+    while path:
+        response = client.get(path)
+        assert response.status_code == 200
+        seen += [v['id'] for v in response.json[key]]
+        link = response.headers.get('Link')
+        path = link[1:link.index('>')] if link else None
+    return seen
+
+
+def test_client_history_spans_hot_and_archived_visits(client, db):
+    add_visits(db, 4)
+
+    response = client.get('/clients/1/history')
+
+    assert response.status_code == 200
+    assert response.json['client']['id'] == 1
+    visits = response.json['visits']
+    assert [v['id'] for v in visits] == [1003, 1002, 1001, 1000]
+    assert visits[0]['parking']['address'] == 'visited 0'
+
+
+def test_client_history_pages_by_time_in(client, db):
+    add_visits(db, 7)
+
+    assert walk_pages(client, '/clients/1/history?limit=3') == \
+        list(range(1006, 999, -1))
+
+
+def test_sessions_without_time_in_are_paged_last(client, db):
+    add_visits(db, 3)
+    db.session.add_all([ClientParking(id=2000, client_id=1, parking_id=1),
+                        ClientParkingHistory(id=2001, client_id=1,
+                                             parking_id=1)])
+    db.session.commit()
+
+    assert walk_pages(client, '/clients/1/history?limit=2') == \
+        [1002, 1001, 1000, 2001, 2000]
+    assert walk_pages(client, '/parkings/1/sessions?limit=1',
+                      'sessions') == \
+        [1, 2001, 2000]
+
+
+@pytest.mark.parametrize('owner', ['client_id', 'parking_id'])
+def test_hot_log_pages_through_an_owner_index(db, owner):
+    query = history.sessions_query(owner, 1, START, 5, open_only=True)
+    plan = db.session.execute(text(
+        'EXPLAIN QUERY PLAN ' + str(query.compile(
+            db.engine, compile_kwargs={'literal_binds': True}))))
+    details = ' '.join(row[-1] for row in plan)
+
+    assert f'ix_client_parking_{owner[:-3]} ({owner}=?' in details
+
+
+@pytest.mark.parametrize('visits', [1, 60])
+def test_client_history_query_count_is_constant(client, db, statements,
+                                                visits):
+    add_visits(db, visits)
+    db.session.remove()
+    statements.clear()
+
+    response = client.get('/clients/1/history')
+
+    assert len(response.json['visits']) == visits
+    assert len(statements) == 2
+
+
+@pytest.mark.parametrize('sessions', [1, 60])
+def test_parking_sessions_query_count_is_constant(client, db, statements,
+                                                  sessions):
+    add_visits(db, sessions)
+    db.session.remove()
+    statements.clear()
+
+    response = client.get('/parkings/2/sessions')
+
+    assert len(response.json['sessions']) == (sessions + 2) // 3
+    assert len(statements) == 2
+
+
+def test_open_parking_sessions(client, db):
+    add_visits(db, 3)
+
+    response = client.get('/parkings/1/sessions?open=true')
+
+    sessions = response.json['sessions']
+    assert [s['id'] for s in sessions] == [1]
+    assert sessions[0]['time_out'] is None
+    assert sessions[0]['client']['car_number'] == 'T456HC234'
+
+
+@pytest.mark.parametrize('path,status', [
+    ('/clients/5/history', 404),
+    ('/parkings/5/sessions', 404),
+    ('/clients/1/history?before=yesterday', 400),
+    ('/parkings/1/sessions?limit=0', 400),
+])
+def test_history_rejections(client, path, status):
+    assert client.get(path).status_code == status
@@ -0,0 +1,146 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+from module_29_testing.hw.main import idempotency
+from module_29_testing.hw.main.app import db as _db
+from module_29_testing.hw.main.models import Client, Parking, ClientParking, \
+    BillingJob, IdempotencyKey
+
+
+def _leave(client, key, **body):
+    return client.delete('/client_parkings',
+                         json=dict({'client_id': 2, 'parking_id': 1}, **body),
+                         headers={'Idempotency-Key': key})
+
+
+def _leave_fingerprint(app):
+    with app.test_request_context('/client_parkings', method='DELETE',
+                                  json={'client_id': 2, 'parking_id': 1}):
+        return idempotency.fingerprint()
+
+
+def test_retried_leave_replays_first_response(client, db):
+    first = _leave(client, 'gate-1')
+    retry = _leave(client, 'gate-1')
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json == first.json
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert db.session.query(BillingJob).count() == 1
+
+
+def test_retried_enter_takes_one_place(client, db):
+    headers = {'Idempotency-Key': 'gate-2'}
+    body = {'client_id': 1, 'parking_id': 1}
+
+    first = client.post('/client_parkings', json=body, headers=headers)
+    retry = client.post('/client_parkings', json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json == first.json
+    assert db.session.query(ClientParking).count() == 2
+
+
+def test_key_reused_for_another_request(client):
+    _leave(client, 'gate-3')
+
+    response = _leave(client, 'gate-3', client_id=1)
+
+    assert response.status_code == 422
+
+
+def test_replay_from_database_after_cache_eviction(app, client, db):
+    first = _leave(client, 'gate-4')
+    app.extensions['idempotency_store'] = idempotency.IdempotencyStore()
+
+    retry = _leave(client, 'gate-4')
+
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.json == first.json
+    assert len(app.extensions['idempotency_store']) == 1
+
+
+def test_request_in_flight_elsewhere_conflicts(app, client, db):
+    app.config['IDEMPOTENCY_WAIT'] = 0
+    db.session.add(IdempotencyKey(key='gate-5',
+                                  fingerprint=_leave_fingerprint(app),
+                                  created_at=datetime.datetime.now()))
+    db.session.commit()
+
+    assert _leave(client, 'gate-5').status_code == 409
+
+
+def test_duplicate_waits_once_for_the_first_request(app, client):
+    app.config['IDEMPOTENCY_WAIT'] = 0.2
+    # The first request with this key is still running in this process
+    app.extensions['idempotency_store'].start('gate-7')
+
+    started = time.monotonic()
+    response = _leave(client, 'gate-7')
+
+    assert response.status_code == 409
+    assert time.monotonic() - started < 0.35
+
+
+def test_abandoned_claim_is_taken_over(app, client, db):
+    db.session.add(IdempotencyKey(
+        key='gate-6', fingerprint='other',
+        created_at=datetime.datetime.now() - datetime.timedelta(minutes=5)))
+    db.session.commit()
+
+    response = _leave(client, 'gate-6')
+
+    assert response.status_code == 200
+    assert db.session.query(IdempotencyKey).get('gate-6').status == 200
+
+
+def test_key_length_is_bounded(client):
+    assert _leave(client, 'k' * 256).status_code == 400
+
+
+def test_purge_forgets_old_keys(app, client, db):
+    _leave(client, 'gate-7')
+
+    assert idempotency.purge(datetime.datetime.now()
+                             - datetime.timedelta(hours=1)) == 0
+    assert idempotency.purge(datetime.datetime.now()
+                             + datetime.timedelta(seconds=1)) == 1
+
+
+@pytest.fixture
+def file_app(make_app):
+    _app = make_app({'SQLALCHEMY_ENGINE_OPTIONS':
+                         {'connect_args': {'timeout': 30}}})
+    _db.session.add_all([Parking(address='a', opened=True,
+                                 count_places=5, count_available_places=5),
+                         Client(name='n', surname='s', credit_card='1',
+                                car_number='A1')])
+    _db.session.commit()
+    return _app
+
+
+def test_concurrent_duplicates_enter_once(file_app):
+    barrier = threading.Barrier(8)
+    responses = []
+
+    def gate():
+        client = file_app.test_client()
+        barrier.wait()
+        responses.append(client.post('/client_parkings',
+                                     json={'client_id': 1, 'parking_id': 1},
+                                     headers={'Idempotency-Key': 'same'}))
+
+    threads = [threading.Thread(target=gate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {r.status_code for r in responses} == {201}
+    assert len({r.get_data() for r in responses}) == 1
+    with file_app.app_context():
+        assert _db.session.query(ClientParking).count() == 1
+        assert _db.session.get(Parking, 1).count_available_places == 4
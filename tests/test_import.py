@@ -0,0 +1,83 @@
+import json
+
+from module_29_testing.hw.main.models import Client
+
+
+CSV = ('name,surname,car_number,credit_card\n'
+       'Ivan,Petrov,A001AA,1111\n'
+       ',Sidorov,A002AA,\n'
+       '"Anna\nMaria",Ivanova,,\n'
+       'Oleg,,A003AA,3333\n')
+
+
+def test_import_clients_from_csv(client, db):
+    response = client.post('/clients/import', data=CSV,
+                           content_type='text/csv')
+
+    assert response.status_code == 200
+    assert response.json == {
+        'success': True, 'imported': 2, 'failed': 2,
+        'errors': [{'line': 3, 'reason': 'Client has to have name'},
+                   {'line': 6, 'reason': 'Client has to have surname'}],
+        'errors_truncated': False}
+    imported = db.session.query(Client).filter(Client.id > 2)\
+        .order_by(Client.id).all()
+    assert [(c.name, c.car_number, c.credit_card) for c in imported] == \
+        [('Ivan', 'A001AA', '1111'), ('Anna\nMaria', None, None)]
+
+
+def test_import_clients_from_ndjson(client):
+    body = '\n'.join([json.dumps({'name': 'a', 'surname': 'b'}),
+                      '{broken',
+                      '',
+                      json.dumps(['a', 'b']),
+                      json.dumps({'name': 'a', 'surname': ['b']})])
+
+    response = client.post('/clients/import', data=body,
+                           content_type='application/x-ndjson')
+
+    assert response.json['imported'] == 1
+    assert response.json['errors'] == [
+        {'line': 2, 'reason': 'Invalid JSON'},
+        {'line': 4, 'reason': 'Row has to be an object'},
+        {'line': 5, 'reason': 'Client fields have to be strings'}]
+
+
+def test_import_inserts_in_batches(app, client, db, statements):
+    app.config['IMPORT_BATCH_SIZE'] = 10
+    body = ''.join(json.dumps({'name': f'n{i}', 'surname': 's'}) + '\n'
+                   for i in range(25))
+
+    response = client.post('/clients/import?format=ndjson', data=body)
+
+    assert response.json['imported'] == 25
+    assert [len(parameters) for statement, parameters
+            in zip(statements, statements.parameters)
+            if statement.startswith('INSERT INTO client ')] == [10, 10, 5]
+    assert db.session.query(Client).count() == 27
+
+
+def test_import_bumps_client_collection_etag(client):
+    etag = client.get('/clients').headers['ETag']
+
+    client.post('/clients/import', data='name,surname\na,b\n',
+                content_type='text/csv')
+
+    assert client.get('/clients',
+                      headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_import_rejects_unknown_format(client):
+    response = client.post('/clients/import', json=[])
+
+    assert response.status_code == 415
+
+
+def test_import_clients_cli_command(app, db, tmp_path):
+    path = tmp_path / 'fleet.csv'
+    path.write_text(CSV)
+
+    result = app.test_cli_runner().invoke(args=['import-clients', str(path)])
+
+    assert 'Imported 2 clients, 2 rows failed' in result.output
+    assert db.session.query(Client).count() == 4
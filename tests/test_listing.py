@@ -0,0 +1,104 @@
+import pytest
+
+from module_29_testing.hw.main.listing import ParkingSnapshot, \
+    parking_rows
+from module_29_testing.hw.main.models import Parking
+
+
+def add_parkings(client, count, count_places=3):
+    return [client.post('/parkings', json={
+        'address': f'street {i}', 'count_places': count_places})
+        .json['added_parking_zone']['id'] for i in range(count)]
+
+
+def test_lists_parkings_in_id_order(client):
+    add_parkings(client, 2)
+
+    response = client.get('/parkings')
+
+    assert response.status_code == 200
+    assert [p['id'] for p in response.json] == [1, 2, 3]
+    assert response.json[0] == {'id': 1, 'address': 'address',
+                                'opened': True, 'count_available_places': 1}
+
+
+def test_filters_by_opened_and_free_places(client):
+    ids = add_parkings(client, 3)
+    client.patch(f'/parkings/{ids[0]}', json={'opened': False})
+    client.post('/client_parkings', json={'client_id': 1,
+                                          'parking_id': ids[1]})
+
+    response = client.get('/parkings?opened=true&min_available=3')
+
+    assert [p['id'] for p in response.json] == [ids[2]]
+    assert [p['id'] for p in client.get('/parkings?opened=false').json] \
+        == [ids[0]]
+
+
+def test_pages_follow_the_link_header(client):
+    add_parkings(client, 4)
+
+    first = client.get('/parkings?limit=2&min_available=1')
+    second = client.get(first.headers['Link'].split(';')[0].strip('<>'))
+
+    assert [p['id'] for p in first.json] == [1, 2]
+    assert [p['id'] for p in second.json] == [3, 4]
+    assert 'min_available=1' in first.headers['Link']
+
+
+def test_gate_updates_are_listed_without_a_query(client, db, statements):
+    client.get('/parkings')
+    client.delete('/client_parkings', json={'client_id': 2,
+                                            'parking_id': 1})
+    db.session.remove()
+    statements.clear()
+
+    response = client.get('/parkings?min_available=2')
+
+    assert statements == []
+    assert response.json[0]['count_available_places'] == 2
+
+
+def test_batch_enter_is_listed_at_once(client):
+    client.get('/parkings')
+
+    client.post('/client_parkings/batch', json={'events': [
+        {'action': 'enter', 'client_id': 1, 'parking_id': 1}]})
+
+    assert client.get('/parkings?min_available=1').json == []
+
+
+def test_reload_keeps_updates_made_while_reading(db):
+    snapshot = ParkingSnapshot()
+
+    def racing_read():
+        snapshot.update(1, 0, False)
+        return parking_rows(db.session)
+
+    snapshot.reload(racing_read)
+
+    assert snapshot.page() == [{'id': 1, 'address': 'address',
+                                'opened': False,
+                                'count_available_places': 0}]
+
+
+def test_expired_snapshot_picks_up_other_writers(app, client, db):
+    now = [0.0]
+    snapshot = app.extensions['parking_snapshot']
+    snapshot._clock = lambda: now[0]
+    client.get('/parkings')
+    db.session.add(Parking(address='elsewhere', opened=True, count_places=1,
+                           count_available_places=1))
+    db.session.commit()
+
+    assert len(client.get('/parkings').json) == 1
+    now[0] += snapshot.ttl
+    assert len(client.get('/parkings').json) == 2
+
+
+@pytest.mark.parametrize('query', ['opened=maybe', 'min_available=-1',
+                                   'min_available=x', 'limit=0'])
+def test_invalid_filters(client, query):
+    response = client.get(f'/parkings?{query}')
+
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+import logging
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from module_29_testing.hw.main import metrics
+from module_29_testing.hw.main.app import create_app, db as _db
+from module_29_testing.hw.main.models import Client, Parking
+
+
+@pytest.fixture
+def metrics_app(make_app):
+    _app = make_app({'METRICS_ENABLED': True})
+    _db.session.add_all([Client(name='name',
+                                surname='surname',
+                                credit_card='1234',
+                                car_number='A123AA123'),
+                         Parking(address='address',
+                                 opened=True,
+                                 count_places=2,
+                                 count_available_places=2)])
+    _db.session.commit()
+    return _app
+
+
+def test_metrics_endpoint_is_disabled_by_default(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_count_requests_and_statements(metrics_app):
+    client = metrics_app.test_client()
+    assert client.get('/clients/1').status_code == 200
+    assert client.post('/client_parkings',
+                       json={'client_id': 1, 'parking_id': 1}).status_code == 201
+
+    metrics = client.get('/metrics')
+    assert metrics.status_code == 200
+    assert metrics.mimetype == 'text/plain'
+    body = metrics.get_data(as_text=True)
+
+    assert 'http_request_duration_seconds_count' \
+           '{method="GET",route="/clients/<int:client_id>"} 1' in body
+    assert 'http_requests_total' \
+           '{method="POST",route="/client_parkings",status="201"} 1' in body
+    assert 'db_statements_per_request_sum{route="/clients/<int:client_id>"} 1' in body
+    assert 'db_commit_duration_seconds_count ' in body
+
+
+def test_slow_queries_are_logged_with_route(metrics_app, caplog):
+    metrics_app.extensions['metrics'].slow_query_seconds = 0
+    client = metrics_app.test_client()
+
+    with caplog.at_level(logging.WARNING):
+        client.get('/clients/1')
+
+    assert 'Slow query in /clients/<int:client_id>' in caplog.text
+    assert 'db_slow_queries_total{route="/clients/<int:client_id>"} 1' \
+           in client.get('/metrics').get_data(as_text=True)
+
+
+def test_streamed_response_is_observed_once_sent(metrics_app):
+    client = metrics_app.test_client()
+    response = client.get('/clients?stream=true')
+    assert response.json[0]['id'] == 1
+    # The server closes the response once the body is sent
+    response.close()
+
+    body = client.get('/metrics').get_data(as_text=True)
+
+    assert 'http_requests_total' \
+           '{method="GET",route="/clients",status="200"} 1' in body
+    assert 'db_statements_per_request_sum{route="/clients"} 1' in body
+
+
+def test_request_that_raises_is_counted(metrics_app):
+    @metrics_app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    client = metrics_app.test_client()
+    with pytest.raises(RuntimeError):
+        client.get('/boom')
+
+    assert 'http_requests_total{method="GET",route="/boom",status="500"} 1' \
+           in client.get('/metrics').get_data(as_text=True)
+
+
+def test_session_events_are_registered_once(metrics_app):
+    create_app({'SCHEMA_CHECK': False, 'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                'METRICS_ENABLED': True})
+
+    assert event.contains(Session, 'before_commit',
+                          metrics._start_commit_timer)
+    assert not event.contains(_db.session, 'before_commit',
+                              metrics._start_commit_timer)
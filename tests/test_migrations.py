@@ -0,0 +1,163 @@
+import pytest
+from click.testing import CliRunner
+from flask.cli import FlaskGroup
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+
+from module_29_testing.hw.main import migrations
+from module_29_testing.hw.main.app import create_app, db as _db
+
+
+@pytest.fixture
+def uri(tmp_path):
+    return f'sqlite:///{tmp_path / "schema.db"}'
+
+
+def test_create_app_refuses_unmigrated_database(uri):
+    with pytest.raises(migrations.SchemaOutOfDate):
+        create_app({'SQLALCHEMY_DATABASE_URI': uri})
+
+
+def test_flask_command_upgrades_an_empty_database(uri, monkeypatch):
+    # The flask command sets FLASK_RUN_FROM_CLI for the rest of the process
+    monkeypatch.delenv('FLASK_RUN_FROM_CLI', raising=False)
+    cli = FlaskGroup(create_app=lambda: create_app(
+        {'SQLALCHEMY_DATABASE_URI': uri}))
+
+    result = CliRunner().invoke(cli, ['db', 'upgrade'])
+
+    assert result.exit_code == 0, result.output
+    assert f'Applied {migrations.LATEST}' in result.output
+    assert migrations.check(create_engine(uri)) == migrations.LATEST
+
+
+def test_flask_run_checks_the_schema_on_the_first_request(uri, monkeypatch):
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'TESTING': True})
+    client = app.test_client()
+
+    with pytest.raises(migrations.SchemaOutOfDate):
+        client.get('/clients')
+    assert app.test_cli_runner().invoke(args=['db', 'upgrade']).exit_code \
+        == 0
+    assert client.get('/clients').status_code == 200
+
+
+def test_upgrade_creates_schema_once(uri):
+    engine = create_engine(uri)
+
+    assert migrations.upgrade(engine) == \
+        [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade(engine) == []
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+    with app.app_context():
+        assert migrations.check(_db.engine) == migrations.LATEST
+        assert set(_db.Model.metadata.tables) <= \
+            set(inspect(_db.engine).get_table_names())
+
+
+def test_upgrade_adopts_database_made_by_create_all_on_startup(uri):
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'CREATE TABLE client (id INTEGER PRIMARY KEY, '
+            'name VARCHAR(50) NOT NULL, surname VARCHAR(50) NOT NULL, '
+            'credit_card VARCHAR(50), car_number VARCHAR(10))')
+        connection.exec_driver_sql(
+            "INSERT INTO client (name, surname, car_number) "
+            "VALUES ('name', 'surname', 'а 123 вс')")
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql(
+            'SELECT version, plate FROM client').first() == (1, 'A123BC')
+        assert migrations.current_version(connection) == migrations.LATEST
+
+
+def schema(engine):
+    inspector = inspect(engine)
+    return {table: ({c['name'] for c in inspector.get_columns(table)},
+                    {i['name'] for i in inspector.get_indexes(table)},
+                    {c['name'] for c in inspector.get_check_constraints(table)})
+            for table in _db.Model.metadata.tables}
+
+
+def test_upgraded_schema_matches_the_models(uri, tmp_path):
+    engine = create_engine(uri)
+    migrations.upgrade(engine)
+    expected = create_engine(f'sqlite:///{tmp_path / "models.db"}')
+    _db.Model.metadata.create_all(expected)
+
+    assert schema(engine) == schema(expected)
+
+
+def test_open_sessions_are_looked_up_through_the_partial_index(uri):
+    engine = create_engine(uri)
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        plan = connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN SELECT id FROM client_parking '
+            'WHERE client_id = 1 AND parking_id = 1 AND time_out IS NULL')\
+            .all()
+    assert 'uq_client_parking_open' in plan[0][-1]
+
+
+def test_upgrade_rebuilds_tables_adopted_without_constraints(uri,
+                                                           tmp_path):
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'CREATE TABLE parking (id INTEGER PRIMARY KEY, '
+            'address VARCHAR(100) NOT NULL, opened BOOLEAN, '
+            'count_places INTEGER NOT NULL, '
+            'count_available_places INTEGER NOT NULL)')
+        connection.exec_driver_sql(
+            'CREATE TABLE client_parking (id INTEGER PRIMARY KEY, '
+            'client_id INTEGER, parking_id INTEGER, time_in DATETIME, '
+            'time_out DATETIME)')
+        connection.exec_driver_sql(
+            'CREATE TABLE client_parking_history (id INTEGER PRIMARY KEY, '
+            'client_id INTEGER, parking_id INTEGER, time_in DATETIME, '
+            'time_out DATETIME)')
+        connection.exec_driver_sql(
+            "INSERT INTO parking VALUES (1, 'address', 1, 2, 2)")
+        connection.exec_driver_sql(
+            'INSERT INTO client_parking (id, client_id, parking_id) '
+            'VALUES (3, 1, 1)')
+        connection.exec_driver_sql(
+            'INSERT INTO client_parking_history (id) VALUES (7)')
+
+    migrations.upgrade(engine)
+
+    expected = create_engine(f'sqlite:///{tmp_path / "models.db"}')
+    _db.Model.metadata.create_all(expected)
+    assert schema(engine) == schema(expected)
+    with engine.begin() as connection:
+        assert connection.exec_driver_sql(
+            'SELECT id, address, count_available_places FROM parking')\
+            .first() == (1, 'address', 2)
+        connection.exec_driver_sql('DELETE FROM client_parking')
+        connection.exec_driver_sql(
+            'INSERT INTO client_parking (client_id, parking_id) '
+            'VALUES (1, 1)')
+        # Not an id that is already in the history
+        assert connection.exec_driver_sql(
+            'SELECT id FROM client_parking').scalar() == 8
+    with pytest.raises(IntegrityError):
+        with engine.begin() as connection:
+            connection.exec_driver_sql(
+                'UPDATE parking SET count_available_places = 3')
+
+
+def test_db_cli_commands(uri):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'SCHEMA_CHECK': False})
+    runner = app.test_cli_runner()
+
+    assert runner.invoke(args=['db', 'current']).output == \
+        f'0 (latest {migrations.LATEST})\n'
+    upgrade = runner.invoke(args=['db', 'upgrade'])
+    assert 'Applied 1: Baseline schema' in upgrade.output
+    assert runner.invoke(args=['db', 'upgrade']).output == \
+        'Schema is up to date\n'
@@ -0,0 +1,93 @@
+import pytest
+
+from module_29_testing.hw.main import plates
+from module_29_testing.hw.main.models import Client
+
+
+@pytest.mark.parametrize('value,plate', [('A123AA123', 'A123AA123'),
+                                         ('a 123 aa-123', 'A123AA123'),
+                                         ('А123АА123', 'A123AA123'),
+                                         (' - ', None),
+                                         (None, None)])
+def test_normalize_plate(value, plate):
+    assert plates.normalize_plate(value) == plate
+
+
+def test_clients_lookup_by_car_number(client):
+    found = client.get('/clients?car_number=t 456 hc-234')
+
+    assert found.status_code == 200
+    assert [c['id'] for c in found.json] == [2]
+    assert client.get('/clients?car_number=X000XX').json == []
+
+
+def test_plate_lookup_is_one_indexed_query(client, db, statements):
+    db.session.remove()
+    statements.clear()
+
+    found = client.get('/clients?car_number=A123AA123')
+
+    assert [c['id'] for c in found.json] == [1]
+    assert len([s for s in statements if 'FROM client' in s]) == 1
+    assert 'client.plate = ?' in statements[-1]
+
+
+def test_plate_follows_client_writes(client, db):
+    db.session.get(Client, 1).car_number = 'B001BB'
+    db.session.commit()
+
+    assert [c['id'] for c in client.get('/clients?car_number=b001bb').json] \
+        == [1]
+    assert client.get('/clients?car_number=A123AA123').json == []
+
+
+def test_imported_clients_are_found_by_plate(client):
+    client.post('/clients/import', data='name,surname,car_number\n'
+                                        'n,s,a 123 aa 123\n',
+                content_type='text/csv')
+
+    found = client.get('/clients?car_number=A123AA123')
+    enter = client.post('/client_parkings/by_plate',
+                        json={'car_number': 'A123AA123', 'parking_id': 1})
+
+    assert [c['id'] for c in found.json] == [1, 3]
+    assert enter.status_code == 409
+
+
+def test_enter_and_leave_by_plate(client):
+    enter = client.post('/client_parkings/by_plate',
+                        json={'car_number': 'a123aa123', 'parking_id': 1})
+    assert enter.status_code == 201
+    assert enter.json['parking_log']['client_id'] == 1
+
+    leave = client.post('/client_parkings/by_plate',
+                        json={'car_number': 'A 123 AA 123', 'parking_id': 1,
+                              'action': 'leave'})
+    assert leave.status_code == 200
+    assert leave.json['parking_log']['time_out']
+
+
+@pytest.mark.parametrize('body,status,reason', [
+    ({'parking_id': 1}, 400, 'Need to specify "car_number" parameter'),
+    ({'car_number': 'A123AA123'}, 400,
+     'Need to specify "parking_id" parameter'),
+    ({'car_number': 'A123AA123', 'parking_id': 1, 'action': 'park'}, 400,
+     'Action has to be "enter" or "leave"'),
+    ({'car_number': 'X000XX', 'parking_id': 1}, 404,
+     'No client with this car number'),
+])
+def test_by_plate_rejections(client, body, status, reason):
+    response = client.post('/client_parkings/by_plate', json=body)
+
+    assert response.status_code == status
+    assert response.json['reason'] == reason
+
+
+def test_by_plate_refuses_shared_plates(client):
+    client.post('/clients', json={'name': 'n', 'surname': 's',
+                                  'car_number': 'A123AA123'})
+
+    response = client.post('/client_parkings/by_plate',
+                           json={'car_number': 'A123AA123', 'parking_id': 1})
+
+    assert response.status_code == 409
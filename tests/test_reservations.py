@@ -0,0 +1,165 @@
+import datetime
+
+import pytest
+
+from module_29_testing.hw.main import reservations
+from module_29_testing.hw.main.models import Reservation
+
+
+T0 = datetime.datetime(2030, 1, 1)
+
+
+def hours(n):
+    return T0 + datetime.timedelta(hours=n)
+
+
+def reserve(client, client_id, starts_at, ends_at, parking_id=1):
+    return client.post(f'/parkings/{parking_id}/reservations',
+                       json={'client_id': client_id,
+                             'starts_at': starts_at.isoformat(),
+                             'ends_at': ends_at.isoformat()})
+
+
+def soon(minutes):
+    return datetime.datetime.now() + datetime.timedelta(minutes=minutes)
+
+
+@pytest.fixture
+def third_client(client):
+    return client.post('/clients', json={
+        'name': 'n', 'surname': 's', 'credit_card': '1',
+        'car_number': 'B001BB'}).json['added_client']['id']
+
+
+def test_timeline_peak_add_and_remove():
+    timeline = reservations.Timeline.build([(hours(0), hours(2)),
+                                            (hours(1), hours(3))])
+    assert timeline.peak(hours(0), hours(1)) == 1
+    assert timeline.peak(hours(0), hours(3)) == 2
+    assert timeline.peak(hours(3), hours(4)) == 0
+
+    timeline.add(hours(1), hours(2), -1)
+    timeline.add(hours(2), hours(5))
+    assert timeline.peak(hours(0), hours(3)) == 2
+    assert timeline.peak(hours(1), hours(2)) == 1
+
+    timeline.prune(hours(4))
+    assert timeline.peak(hours(4), hours(5)) == 1
+
+
+def test_future_slots_fill_up_to_count_places(client, third_client):
+    assert reserve(client, 1, hours(0), hours(2)).status_code == 201
+    assert reserve(client, third_client, hours(1), hours(3)).status_code \
+        == 201
+
+    full = reserve(client, 2, hours(1), hours(2))
+    assert full.status_code == 409
+    assert full.json['reason'] == 'No places left for this time'
+    assert reserve(client, 2, hours(2), hours(4)).status_code == 201
+
+
+def test_slot_starting_soon_counts_parked_cars(client, third_client):
+    assert reserve(client, 1, soon(5), soon(60)).status_code == 201
+
+    assert reserve(client, third_client, soon(5), soon(60)).status_code \
+        == 409
+
+
+def test_client_cannot_hold_overlapping_reservations(client):
+    reserve(client, 1, hours(0), hours(2))
+
+    response = reserve(client, 1, hours(1), hours(3))
+
+    assert response.status_code == 409
+
+
+def test_walk_in_cannot_take_a_reserved_place(client, db, third_client):
+    reserve(client, third_client, soon(5), soon(60))
+
+    walk_in = client.post('/client_parkings',
+                          json={'client_id': 1, 'parking_id': 1})
+    assert walk_in.status_code == 409
+    assert walk_in.json['reason'] == 'Remaining places are reserved'
+
+    holder = client.post('/client_parkings',
+                         json={'client_id': third_client, 'parking_id': 1})
+    assert holder.status_code == 201
+    assert db.session.query(Reservation).one().used_at is not None
+
+
+def test_batch_enter_honours_reservations(client, third_client):
+    reserve(client, third_client, soon(5), soon(60))
+
+    response = client.post('/client_parkings/batch', json={'events': [
+        {'action': 'enter', 'client_id': 1, 'parking_id': 1},
+        {'action': 'enter', 'client_id': third_client, 'parking_id': 1}]})
+
+    assert [r['status'] for r in response.json['results']] == [409, 201]
+
+
+def test_get_reservations_reports_free_places(client, third_client):
+    reserve(client, 1, hours(0), hours(2))
+
+    response = client.get('/parkings/1/reservations'
+                          f'?from={hours(1).isoformat()}'
+                          f'&to={hours(3).isoformat()}')
+
+    assert response.status_code == 200
+    assert response.json['available_places'] == 1
+    assert [r['client_id'] for r in response.json['reservations']] == [1]
+
+
+def book_elsewhere(db, client_id, starts_at, ends_at):
+    # A reservation committed by another worker, this index hasn't seen it
+    db.session.add(Reservation(client_id=client_id, parking_id=1,
+                               starts_at=starts_at, ends_at=ends_at,
+                               created_at=datetime.datetime.now()))
+    db.session.commit()
+
+
+def test_walk_in_sees_reservations_of_other_workers(client, db,
+                                                    third_client):
+    book_elsewhere(db, third_client, soon(5), soon(60))
+
+    walk_in = client.post('/client_parkings',
+                          json={'client_id': 1, 'parking_id': 1})
+
+    assert walk_in.status_code == 409
+
+
+def test_booking_recounts_in_the_database(app, client, db, monkeypatch,
+                                          third_client):
+    reserve(client, 1, hours(0), hours(2))
+    # Committed by another worker after this one's sync
+    monkeypatch.setattr(app.extensions['reservations'], 'sync',
+                        lambda session, now: 0)
+    book_elsewhere(db, third_client, hours(0), hours(2))
+
+    response = reserve(client, 2, hours(1), hours(2))
+
+    assert response.status_code == 409
+    assert db.session.query(Reservation).count() == 2
+
+
+def test_index_is_rebuilt_from_the_database(app, client, db):
+    reserve(client, 1, hours(0), hours(2))
+    index = reservations.ReservationIndex()
+
+    assert index.sync(db.session, T0) == 1
+    assert index.peak(1, hours(1), hours(3)) == 1
+
+
+@pytest.mark.parametrize('body,status', [
+    ({'starts_at': '2030-01-01T00:00', 'ends_at': '2030-01-01T01:00'}, 400),
+    ({'client_id': 1, 'starts_at': 'soon', 'ends_at': '2030-01-01'}, 400),
+    ({'client_id': 1, 'starts_at': '2030-01-01T02:00',
+      'ends_at': '2030-01-01T01:00'}, 400),
+    ({'client_id': 1, 'starts_at': '2030-01-01T00:00',
+      'ends_at': '2030-01-03T00:00'}, 400),
+    ({'client_id': 7, 'starts_at': '2030-01-01T00:00',
+      'ends_at': '2030-01-01T01:00'}, 404),
+])
+def test_reservation_rejections(client, body, status):
+    response = client.post('/parkings/1/reservations', json=body)
+
+    assert response.status_code == status
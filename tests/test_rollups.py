@@ -0,0 +1,129 @@
+import datetime
+import threading
+
+import pytest
+
+from module_29_testing.hw.main import rollups
+from module_29_testing.hw.main.app import db as _db
+from module_29_testing.hw.main.compaction import compact_closed_sessions
+from module_29_testing.hw.main.models import Client, ClientParking, \
+    Parking, ParkingStats
+
+
+def _stats_rows(db):
+    return sorted((s.parking_id, s.bucket, s.entries, s.exits,
+                   round(s.stay_seconds, 6), round(s.occupied_seconds, 6))
+                  for s in db.session.query(ParkingStats))
+
+
+def test_exit_occupancy_is_split_by_hour():
+    deltas = rollups.RollupDeltas()
+    deltas.exit(1, datetime.datetime(2024, 1, 1, 10, 30),
+                datetime.datetime(2024, 1, 1, 12, 15))
+
+    assert deltas.deltas == {
+        (1, datetime.datetime(2024, 1, 1, 10)): [0, 0, 0.0, 1800.0],
+        (1, datetime.datetime(2024, 1, 1, 11)): [0, 0, 0.0, 3600.0],
+        (1, datetime.datetime(2024, 1, 1, 12)): [0, 1, 6300.0, 900.0],
+    }
+
+
+def test_gates_update_rollups(client, db):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    client.delete('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    client.post('/client_parkings/batch', json={'events': [
+        {'action': 'enter', 'client_id': 2, 'parking_id': 1}]})
+
+    stats = db.session.query(ParkingStats).all()
+    assert sum(s.entries for s in stats) == 2
+    assert sum(s.exits for s in stats) == 2
+
+
+@pytest.mark.parametrize('bucket', ['hour', 'day'])
+def test_parking_stats_endpoint(client, db, bucket):
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+
+    response = client.get(f'/parkings/1/stats?bucket={bucket}')
+
+    assert response.status_code == 200
+    stats = response.json['stats']
+    assert len(stats) == (25 if bucket == 'hour' else 2)
+    assert sum(s['entries'] for s in stats) == 1
+    assert sum(s['exits'] for s in stats) == 1
+    assert stats[-1]['turnover'] == pytest.approx(
+        stats[-1]['entries'] / 2)
+
+
+@pytest.mark.parametrize('query', ['bucket=week', 'from=yesterday',
+                                   'from=2024-01-02&to=2024-01-01',
+                                   'from=2020-01-01&to=2024-01-01'])
+def test_parking_stats_rejects_bad_ranges(client, query):
+    response = client.get(f'/parkings/1/stats?{query}')
+
+    assert response.status_code == 400
+
+
+def test_parking_stats_for_missing_parking(client):
+    assert client.get('/parkings/404/stats').status_code == 404
+
+
+def test_rebuild_matches_incremental_rollups(app, client, db):
+    # The fixture's open session was stored without going through a gate
+    rollups.record_entry(db.session, 1,
+                         db.session.query(ClientParking).one().time_in)
+    db.session.commit()
+    client.delete('/client_parkings', json={'client_id': 2, 'parking_id': 1})
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    compact_closed_sessions()
+    incremental = _stats_rows(db)
+
+    result = app.test_cli_runner().invoke(
+        args=['rebuild-parking-stats', '--chunk-size', '1'])
+
+    assert 'Rebuilt parking stats from 2 sessions' in result.output
+    assert _stats_rows(db) == incremental
+
+
+def test_gates_write_during_a_rebuild(make_app, monkeypatch):
+    # A short busy timeout: a gate waiting for the whole rebuild fails
+    _app = make_app({'SQLITE_BUSY_TIMEOUT_MS': 200})
+    _db.session.add_all([Client(name='n', surname='s', credit_card='1',
+                                car_number=f'A{i}') for i in range(3)])
+    _db.session.add_all([Parking(address=f'a{i}', opened=True,
+                                 count_places=5, count_available_places=5)
+                         for i in range(2)])
+    _db.session.commit()
+    client = _app.test_client()
+    client.post('/client_parkings', json={'client_id': 1, 'parking_id': 1})
+    client.post('/client_parkings', json={'client_id': 2, 'parking_id': 2})
+    incremental_before = _stats_rows(_db)
+    responses = []
+    rebuild_parking = rollups._rebuild_parking
+
+    def gates_in_between(session, parking_id, chunk_size):
+        processed = rebuild_parking(session, parking_id, chunk_size)
+        if parking_id == 1:
+            # Parking 1 is rebuilt, parking 2 not yet
+            def gates():
+                responses.extend([
+                    client.post('/client_parkings',
+                                json={'client_id': 3, 'parking_id': 1}),
+                    client.delete('/client_parkings',
+                                  json={'client_id': 2, 'parking_id': 2})])
+            thread = threading.Thread(target=gates)
+            thread.start()
+            thread.join()
+        return processed
+
+    monkeypatch.setattr(rollups, '_rebuild_parking', gates_in_between)
+    assert rollups.rebuild(chunk_size=1) == 2
+    rebuilt = _stats_rows(_db)
+    _db.session.query(ParkingStats).delete()
+    _db.session.commit()
+    monkeypatch.undo()
+    rollups.rebuild()
+
+    assert [r.status_code for r in responses] == [201, 200]
+    assert rebuilt == _stats_rows(_db) != incremental_before
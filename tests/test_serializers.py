@@ -0,0 +1,84 @@
+import datetime
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from module_29_testing.hw.main.models import ClientParking, Parking
+from werkzeug.http import http_date as werkzeug_http_date
+
+from module_29_testing.hw.main.serializers import OrjsonProvider, \
+    http_date, make_serializer
+
+
+def reflective_json(obj, exclude=()):
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns
+            if c.name not in exclude}
+
+
+def test_generated_serializer_matches_reflection():
+    parking_log = ClientParking(id=1, client_id=2, parking_id=3,
+                                time_in=datetime.datetime(2022, 1, 2, 3, 4, 5))
+    parking = Parking(id=1, address='address', opened=True,
+                      count_places=3, count_available_places=2)
+
+    assert parking_log.to_json() == reflective_json(parking_log)
+    assert parking.to_json() == reflective_json(parking, ('version',))
+
+
+def test_serializer_can_exclude_columns():
+    to_json = make_serializer(Parking.__table__.columns,
+                              exclude=('count_places',))
+    parking = Parking(id=1, address='address', opened=True,
+                      count_places=3, count_available_places=2)
+
+    assert 'count_places' not in to_json(parking)
+
+
+@pytest.mark.parametrize('value', [
+    datetime.datetime(2022, 1, 2, 3, 4, 5, 678),
+    datetime.datetime(1999, 12, 31, 23, 59, 59,
+                      tzinfo=datetime.timezone(datetime.timedelta(hours=3))),
+    datetime.date(2024, 2, 29),
+])
+def test_http_date_matches_werkzeug(value):
+    assert http_date(value) == werkzeug_http_date(value)
+
+
+def test_orjson_provider_output_matches_default(app):
+    pytest.importorskip('orjson')
+    payload = {'success': True,
+               'parking_log': {'id': 1,
+                               'time_in': datetime.datetime(2022, 1, 2, 3, 4, 5),
+                               'time_out': None},
+               'count': 1.5}
+
+    fast = OrjsonProvider(app)
+    default = DefaultJSONProvider(app)
+    assert fast.dumps(payload, separators=(',', ':')) == \
+        default.dumps(payload, separators=(',', ':'))
+    assert fast.loads(fast.dumps(payload)) == default.loads(default.dumps(payload))
+
+
+@pytest.mark.parametrize('payload', [
+    {'address': 'Невский проспект \U0001F697', 'note': 'tab\tdel\x7f'},
+    {10: 'ten', 9: 'nine'},
+    [1, 2 ** 70],
+])
+@pytest.mark.parametrize('kwargs', [{'separators': (',', ':')},
+                                    {'indent': 2}, {}])
+def test_orjson_provider_is_byte_compatible(app, payload, kwargs):
+    pytest.importorskip('orjson')
+
+    assert OrjsonProvider(app).dumps(payload, **kwargs) == \
+        DefaultJSONProvider(app).dumps(payload, **kwargs)
+
+
+def test_orjson_provider_writes_floats_the_short_way(app):
+    pytest.importorskip('orjson')
+    fast = OrjsonProvider(app)
+
+    assert fast.dumps([1e16, 1e-7], separators=(',', ':')) == '[1e16,1e-7]'
+    assert fast.loads(fast.dumps([1e16, 1e-7], separators=(',', ':'))) == \
+        [1e16, 1e-7]
+    assert fast.dumps([float('nan'), float('inf')],
+                      separators=(',', ':')) == '[null,null]'
@@ -0,0 +1,248 @@
+import csv
+import datetime
+import io
+import json
+import threading
+
+import pytest
+
+from module_29_testing.hw.main import billing, compaction, migrations
+from module_29_testing.hw.main.app import create_app, db as _db
+from module_29_testing.hw.main.models import BillingJob, Client, Parking, \
+    ClientParking, ClientParkingHistory, Reservation
+
+
+SHARDS = 3
+
+
+@pytest.fixture
+def sharded_app(make_app, tmp_path):
+    _app = make_app({'SHARD_DATABASE_URIS':
+                         [f'sqlite:///{tmp_path / f"shard{i}.db"}'
+                          for i in range(SHARDS)]}, create_tables=False)
+    router = _app.extensions['shard_router']
+    for engine in [_db.engine] + router.engines:
+        migrations.upgrade(engine)
+    _db.session.add_all([Client(name='n', surname='s', credit_card='1',
+                                car_number=f'A{i}') for i in range(2)])
+    _db.session.commit()
+    yield _app
+    router.close()
+
+
+@pytest.fixture
+def router(sharded_app):
+    return sharded_app.extensions['shard_router']
+
+
+@pytest.fixture
+def sharded_client(sharded_app):
+    client = sharded_app.test_client()
+    for i in range(4):
+        client.post('/parkings', json={'address': f'street {i}',
+                                       'count_places': 2})
+    return client
+
+
+def stored(router, model):
+    return [router.sessions[i].query(model).all() for i in range(SHARDS)]
+
+
+def test_parkings_are_spread_over_the_shards(router, sharded_client):
+    shards = stored(router, Parking)
+
+    assert sorted(p.id for shard in shards for p in shard) == [1, 2, 3, 4]
+    for i, parkings in enumerate(shards):
+        assert parkings and all(router.shard_for(p.id) == i
+                                for p in parkings)
+    assert _db.session.query(Parking).count() == 0
+
+
+def test_address_is_unique_across_shards(sharded_client):
+    response = sharded_client.post('/parkings', json={'address': 'street 0',
+                                                      'count_places': 1})
+
+    assert response.status_code == 400
+
+
+def test_gate_writes_to_the_parking_shard(router, sharded_client):
+    enter = sharded_client.post('/client_parkings',
+                                json={'client_id': 1, 'parking_id': 2})
+    assert enter.status_code == 201
+    assert [len(logs) for logs in stored(router, ClientParking)] == [0, 0, 1]
+    assert sharded_client.get('/parkings/2/availability')\
+        .json['count_available_places'] == 1
+
+    leave = sharded_client.delete('/client_parkings',
+                                  json={'client_id': 1, 'parking_id': 2})
+    assert leave.status_code == 200
+    assert sharded_client.post('/client_parkings', json={
+        'client_id': 7, 'parking_id': 2}).status_code == 404
+
+
+def test_billing_charges_jobs_queued_in_shards(sharded_app, router,
+                                               sharded_client):
+    sharded_client.post('/client_parkings', json={'client_id': 1,
+                                                  'parking_id': 1})
+    sharded_client.delete('/client_parkings', json={'client_id': 1,
+                                                    'parking_id': 1})
+    gateway = billing.FakePaymentGateway()
+
+    assert billing.process_all(gateway, sharded_app) == 1
+    job = router.session(1).query(BillingJob).one()
+    assert job.status == 'paid'
+    assert list(gateway.charges.values())[0][1] == '1'
+
+
+def test_client_history_merges_every_shard(router, sharded_client):
+    for parking_id in (1, 2, 3):
+        sharded_client.post('/client_parkings', json={
+            'client_id': 1, 'parking_id': parking_id})
+
+    response = sharded_client.get('/clients/1/history')
+
+    assert [v['parking']['id'] for v in response.json['visits']] == \
+        [3, 2, 1]
+
+
+def test_client_history_pages_past_visits_without_time_in(router,
+                                                         sharded_client):
+    sharded_client.post('/client_parkings', json={'client_id': 1,
+                                                  'parking_id': 3})
+    for parking_id in (1, 2):
+        router.session(parking_id).add(ClientParking(
+            id=100 + parking_id, client_id=1, parking_id=parking_id))
+        router.session(parking_id).commit()
+
+    first = sharded_client.get('/clients/1/history?limit=2')
+    link = first.headers['Link']
+    second = sharded_client.get(link[1:link.index('>')])
+
+    assert [v['parking']['id'] for v in first.json['visits']] == [3, 2]
+    assert [v['parking']['id'] for v in second.json['visits']] == [1]
+
+
+def test_listing_and_patch_reach_every_shard(sharded_client):
+    sharded_client.patch('/parkings/2', json={'opened': False})
+
+    response = sharded_client.get('/parkings?opened=true')
+
+    assert [p['id'] for p in response.json] == [1, 3, 4]
+
+
+def test_batch_is_split_by_shard(router, sharded_client):
+    response = sharded_client.post('/client_parkings/batch', json={'events': [
+        {'action': 'enter', 'client_id': 1, 'parking_id': 1},
+        {'action': 'enter', 'client_id': 1, 'parking_id': 2},
+        {'action': 'enter', 'client_id': 2, 'parking_id': 3},
+        {'action': 'leave', 'client_id': 1, 'parking_id': 1},
+        {'action': 'fly'}]})
+
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json['results']] == \
+        [201, 201, 201, 200, 400]
+    assert [len(logs) for logs in stored(router, ClientParking)] == [1, 1, 1]
+    assert sharded_client.get('/parkings/2/availability')\
+        .json['count_available_places'] == 1
+
+
+def test_by_plate_writes_to_the_parking_shard(router, sharded_client):
+    response = sharded_client.post('/client_parkings/by_plate', json={
+        'car_number': 'A0', 'parking_id': 2})
+
+    assert response.status_code == 201
+    assert [len(logs) for logs in stored(router, ClientParking)] == [0, 0, 1]
+
+
+def test_parking_reads_come_from_the_parking_shard(sharded_app,
+                                                   sharded_client):
+    sharded_client.post('/client_parkings', json={'client_id': 1,
+                                                  'parking_id': 2})
+
+    stats = sharded_client.get('/parkings/2/stats')
+    assert stats.status_code == 200
+    assert sum(bucket['entries'] for bucket in stats.json['stats']) == 1
+
+    sessions = sharded_client.get('/parkings/2/sessions')
+    assert sessions.status_code == 200
+    assert sessions.json['sessions'][0]['client'] == {
+        'id': 1, 'name': 'n', 'surname': 's', 'car_number': 'A0'}
+
+    sharded_app.config['SSE_HEARTBEAT'] = 5.0
+    stream = sharded_client.get('/parkings/events', buffered=False)
+    chunks = iter(stream.response)
+    next(chunks)
+    snapshot = [json.loads(next(chunks).decode().split('data: ')[1])
+                for _ in range(4)]
+    stream.close()
+    assert [(e['parking_id'], e['count_available_places'])
+            for e in snapshot] == [(1, 2), (2, 1), (3, 2), (4, 2)]
+
+
+def test_reservations_live_in_the_parking_shard(router, sharded_client):
+    sharded_client.post('/parkings', json={'address': 'small',
+                                           'count_places': 1})
+    now = datetime.datetime.now()
+    reserved = sharded_client.post('/parkings/5/reservations', json={
+        'client_id': 2,
+        'starts_at': (now + datetime.timedelta(minutes=5)).isoformat(),
+        'ends_at': (now + datetime.timedelta(hours=1)).isoformat()})
+    assert reserved.status_code == 201
+    assert [len(r) for r in stored(router, Reservation)] == [0, 0, 1]
+
+    listed = sharded_client.get('/parkings/5/reservations')
+    assert [r['client_id'] for r in listed.json['reservations']] == [2]
+    walk_in = sharded_client.post('/client_parkings',
+                                  json={'client_id': 1, 'parking_id': 5})
+    assert walk_in.status_code == 409
+    holder = sharded_client.post('/client_parkings',
+                                 json={'client_id': 2, 'parking_id': 5})
+    assert holder.status_code == 201
+
+
+def test_export_merges_every_shard(sharded_client):
+    for client_id, parking_id in ((1, 3), (2, 1), (1, 2)):
+        sharded_client.post('/client_parkings', json={
+            'client_id': client_id, 'parking_id': parking_id})
+
+    response = sharded_client.get('/client_parkings/export')
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(row['parking_id'], row['car_number']) for row in rows] == \
+        [('3', 'A0'), ('1', 'A1'), ('2', 'A0')]
+    assert rows[0]['address'] == 'street 2'
+
+
+def test_fan_out_reads_shards_in_parallel(router):
+    barrier = threading.Barrier(SHARDS, timeout=5)
+
+    assert router.fan_out(lambda session: barrier.wait() is not None) == \
+        [True] * SHARDS
+
+
+def test_compaction_archives_every_shard(sharded_app, router, sharded_client):
+    for parking_id in (1, 2):
+        sharded_client.post('/client_parkings', json={
+            'client_id': 1, 'parking_id': parking_id})
+        sharded_client.delete('/client_parkings', json={
+            'client_id': 1, 'parking_id': parking_id})
+
+    assert compaction.compact_all(sharded_app) == 2
+    assert [len(rows) for rows in stored(router, ClientParkingHistory)] == \
+        [0, 1, 1]
+
+
+def test_db_cli_covers_every_shard(tmp_path):
+    app = create_app({'SCHEMA_CHECK': False,
+                      'SQLALCHEMY_DATABASE_URI':
+                          f'sqlite:///{tmp_path / "main.db"}',
+                      'SHARD_DATABASE_URIS':
+                          [f'sqlite:///{tmp_path / "shard.db"}']})
+    runner = app.test_cli_runner()
+
+    runner.invoke(args=['db', 'upgrade'])
+
+    assert runner.invoke(args=['db', 'current']).output == \
+        f'main: {migrations.LATEST} (latest {migrations.LATEST})\n' \
+        f'shard 0: {migrations.LATEST} (latest {migrations.LATEST})\n'
+    app.extensions['shard_router'].close()
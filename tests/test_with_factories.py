@@ -1,5 +1,6 @@
 from module_29_testing.hw.main.models import Client, Parking
-from module_29_testing.hw.tests.factories import ClientFactory, ParkingFactory
+from module_29_testing.hw.tests.factories import ClientFactory, ParkingFactory, \
+    ClientParkingFactory
 
 
 def test_create_client(client, db):
@@ -16,3 +17,12 @@ def test_create_parking(client, db):
 
     assert new_parking.id is not None
     assert len(db.session.query(Parking).all()) == 2
+
+
+def test_create_parking_log(client, db):
+    parking_log = ClientParkingFactory()
+    db.session.commit()
+
+    assert parking_log.client_id is not None
+    assert parking_log.parking_id is not None
+    assert parking_log.time_out > parking_log.time_in